@@ -3,11 +3,25 @@
 # Given directory with computed conservation adds them to a conservation
 # cache directory.
 #
+# In the bulk mode the *.hom files are parsed in a process pool and
+# written into sorted run files in a working directory. The runs are then
+# merged by the sequence hash and written to the cache store at once.
+# Finished runs are kept in the working directory, so an interrupted
+# bulk load can be resumed by running the same command again. Runs are
+# named by a hash of their input files, so a run is reused only for
+# the same files.
+#
 import typing
 import logging
 import argparse
 import os
+import json
+import time
+import heapq
+import hashlib
+import multiprocessing
 from conservation_cache import add_to_cache, create_conservation_from_hom_file
+from conservation_store import digest_sequence
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -24,11 +38,29 @@ def _read_arguments() -> typing.Dict[str, str]:
     parser.add_argument(
         "--buffer-size", default=100000, type=int,
         help="How many sequences to keep in memory.")
+    parser.add_argument(
+        "--bulk", action="store_true",
+        help="Use parallel ingestion with external sort.")
+    parser.add_argument(
+        "--working-directory",
+        help="Directory for sorted runs, required for bulk mode.")
+    parser.add_argument(
+        "--workers", default=os.cpu_count(), type=int,
+        help="Number of processes used to parse files in bulk mode.")
     return vars(parser.parse_args())
 
 
 def main(arguments):
     _init_logging()
+    if arguments["bulk"]:
+        if arguments["working_directory"] is None:
+            raise RuntimeError("Working directory is required for bulk mode.")
+        bulk_load(
+            arguments["input"], arguments["cache_directory"],
+            arguments["working_directory"], arguments["buffer_size"],
+            arguments["workers"])
+        logger.info("All done")
+        return
     buffer = []
     logger.info("Collecting conservations ...")
     files = os.listdir(arguments["input"])
@@ -57,5 +89,121 @@ def _init_logging():
     logger.addHandler(handler)
 
 
+# region Bulk load
+
+class _Throughput:
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, files: int, size: int):
+        self.files += files
+        self.bytes += size
+
+    def report(self, message: str):
+        duration = max(time.monotonic() - self.start, 1e-6)
+        logger.info(
+            f"{message} {self.files} files, "
+            f"{self.files / duration:.1f} files/s, "
+            f"{self.bytes / duration / (1024 * 1024):.2f} MB/s")
+
+
+def bulk_load(
+        input_directory: str, cache_directory: str,
+        working_directory: str, buffer_size: int, workers: int):
+    os.makedirs(working_directory, exist_ok=True)
+    logger.info("Collecting conservations ...")
+    files = sorted(
+        os.path.join(input_directory, file_name)
+        for file_name in os.listdir(input_directory)
+        if file_name.endswith(".hom"))
+    logger.info(f"Found {len(files)} conservations.")
+    chunks = [
+        files[start:start + buffer_size]
+        for start in range(0, len(files), buffer_size)
+    ]
+    runs = _create_sorted_runs(chunks, working_directory, workers)
+    logger.info(f"Merging {len(runs)} runs into the cache ...")
+    start = time.monotonic()
+    added = add_to_cache(cache_directory, _merge_runs(runs))
+    logger.info(
+        f"Added {added} conservations in "
+        f"{time.monotonic() - start:.1f} s.")
+
+
+def _create_sorted_runs(
+        chunks: typing.List[typing.List[str]], working_directory: str,
+        workers: int) -> typing.List[str]:
+    result = []
+    throughput = _Throughput()
+    with multiprocessing.Pool(workers) as pool:
+        for index, chunk in enumerate(chunks):
+            run_file = os.path.join(
+                working_directory, f"run-{_chunk_digest(chunk)}.jsonl")
+            result.append(run_file)
+            if os.path.exists(run_file):
+                logger.info(f"Using existing run '{run_file}'.")
+                continue
+            records = pool.map(_load_hom_file, chunk, chunksize=64)
+            records.sort(key=lambda item: item[0])
+            _write_run_file(run_file, records)
+            throughput.add(len(chunk), sum(item[2] for item in records))
+            throughput.report(f"Run {index + 1}/{len(chunks)}, parsed")
+    return result
+
+
+def _chunk_digest(chunk: typing.List[str]) -> str:
+    """Return hash of the input files, including their size and
+    modification time."""
+    digest = hashlib.sha256()
+    for path in chunk:
+        stat = os.stat(path)
+        digest.update(
+            f"{os.path.abspath(path)}\0{stat.st_size}\0"
+            f"{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_hom_file(path: str) -> typing.Tuple[str, typing.Dict, int]:
+    conservation = create_conservation_from_hom_file(path)
+    group_hash = digest_sequence(conservation["sequence"]).hex()
+    return group_hash, conservation, os.path.getsize(path)
+
+
+def _write_run_file(path: str, records):
+    swap_path = path + ".swp"
+    with open(swap_path, "w", encoding="utf-8") as stream:
+        for group_hash, conservation, _ in records:
+            json.dump([group_hash, conservation], stream, ensure_ascii=False)
+            stream.write("\n")
+    # Only complete runs are visible, so we can resume.
+    os.replace(swap_path, path)
+
+
+def _read_run_file(path: str) -> typing.Iterator[typing.Tuple[str, typing.Dict]]:
+    with open(path, encoding="utf-8") as stream:
+        for line in stream:
+            group_hash, conservation = json.loads(line)
+            yield group_hash, conservation
+
+
+def _merge_runs(runs: typing.List[str]) -> typing.Iterator[typing.Dict]:
+    """Yield conservations ordered by hash, each sequence only once."""
+    previous = None
+    merged = heapq.merge(
+        *[_read_run_file(path) for path in runs],
+        key=lambda item: item[0])
+    for group_hash, conservation in merged:
+        key = (group_hash, conservation["sequence"])
+        if key == previous:
+            continue
+        previous = key
+        yield conservation
+
+# endregion
+
+
 if __name__ == "__main__":
     main(_read_arguments())
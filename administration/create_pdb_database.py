@@ -12,6 +12,8 @@ import re
 import json
 import datetime
 import dataclasses
+import shutil
+import subprocess
 
 # Create a symlink to the directory to allow typed imports
 try:
@@ -30,7 +32,10 @@ logger.setLevel(logging.DEBUG)
 
 # Define a schema for the prediction.
 # We use a schema that corresponds to DatabaseV3 from web_server.src.database_v3
-from executor_p2rank.run_p2rank_task import execute_directory_task
+from executor_p2rank.run_p2rank_task import execute_directory_task, \
+    execute_directory_tasks, prepare_directory_sequences
+from executor_p2rank.conservation_wrapper import \
+    compute_hmm_based_conservation_batch
 
 @dataclasses.dataclass
 class Prediction:
@@ -83,7 +88,26 @@ def _read_arguments() -> typing.Dict[str, str]:
     parser.add_argument(
         "--compute_conservation", action="store_true",
         help="If set, conservation will be computed for all PDB entries.")
-    
+    parser.add_argument(
+        "--batch_size", type=int, default=0,
+        help="Number of entries processed together, see --batch_conservation "
+             "and --batch_prediction.")
+    parser.add_argument(
+        "--batch_conservation", action="store_true",
+        help="If set, conservation for a batch is computed using a single "
+             "search in the sequence database. "
+             "Requires HMM_CONSERVATION_CACHE.")
+    parser.add_argument(
+        "--conservation_workers", type=int, default=1,
+        help="Number of parallel conservation computations in a batch.")
+    parser.add_argument(
+        "--batch_prediction", action="store_true",
+        help="If set, predictions for a batch are computed using a single "
+             "P2Rank execution.")
+    parser.add_argument(
+        "--prediction_threads", type=int, default=os.cpu_count(),
+        help="Number of P2Rank threads for batch prediction.")
+
 
     return vars(parser.parse_args())
 
@@ -185,43 +209,41 @@ def _save_json(path: str, content):
 
 def _run_predictions(args: typing.Dict[str, str], entries_list: typing.List[str]):
     successful_entries = []
-    for entry in entries_list:
-        logger.info(f"Running prediction for entry {entry}")
-
-        directory = _get_directory(entry, args)
-        if directory is None:
-            logger.error(f"Invalid entry directory: {entry}")
+    batch_size = max(1, args["batch_size"])
+    batch_conservation = args["batch_conservation"] and args["compute_conservation"]
+    batch_prediction = args["batch_prediction"]
+    for start in range(0, len(entries_list), batch_size):
+        predictions = []
+        for entry in entries_list[start:start + batch_size]:
+            prediction = _create_prediction(entry, args)
+            if prediction is not None:
+                predictions.append(prediction)
+
+        if batch_conservation:
+            _compute_conservation_batch(predictions, args)
+
+        if batch_prediction:
+            logger.info(f"Running batch prediction for {len(predictions)} entries")
+            working_directory = os.path.join(args["output_directory"], "prediction-batch")
+            try:
+                execute_directory_tasks(
+                    [prediction.directory for prediction in predictions],
+                    working_directory, args["prediction_threads"],
+                    keep_working=False, lazy_execution=batch_conservation)
+            finally:
+                shutil.rmtree(working_directory, ignore_errors=True)
+            successful_entries.extend(prediction.identifier for prediction in predictions)
             continue
 
-        logger.info(f"Preparing prediction for entry {entry}")
-
-        pdb_code, chains = _parser_identifier(entry)
-        
-        prediction = Prediction(
-            directory=directory,
-            identifier=entry,
-            database=_get_database_name(args),
-            structure_sealed=len(chains) == 0,
-            conservation="hmm" if args["compute_conservation"] else "none",
-            p2rank_configuration="conservation_hmm" if args["compute_conservation"] else "default",
-            structure_code=pdb_code,
-            chains=chains,
-            metadata={},
-        )
-
-        try:
-            os.makedirs(prediction.directory, exist_ok=True)
-        except OSError:
-            logger.error(f"Failed to create directory {prediction.directory}")
-            continue
-        
-        _prepare_prediction_directory(prediction)
+        for prediction in predictions:
+            logger.info(f"Running prediction for entry {prediction.identifier}")
 
-        logger.info(f"Running prediction for entry {entry}")
+            # With batch conservation the structure is already prepared.
+            execute_directory_task(
+                prediction.directory, keep_working=False,
+                lazy_execution=batch_conservation, stdout=False)
 
-        execute_directory_task(prediction.directory, keep_working=False, stdout=False)
-        
-        successful_entries.append(entry)
+            successful_entries.append(prediction.identifier)
 
     logger.info(f"Number of successful entries: {len(successful_entries)}")
     logger.info(f"Number of unsuccessful entries: {len(entries_list) - len(successful_entries)}")
@@ -235,6 +257,67 @@ def _run_predictions(args: typing.Dict[str, str], entries_list: typing.List[str]
     logger.info("All predictions done")
 
 
+def _create_prediction(entry: str, args: typing.Dict[str, str]) -> typing.Optional[Prediction]:
+    directory = _get_directory(entry, args)
+    if directory is None:
+        logger.error(f"Invalid entry directory: {entry}")
+        return None
+
+    logger.info(f"Preparing prediction for entry {entry}")
+
+    pdb_code, chains = _parser_identifier(entry)
+
+    prediction = Prediction(
+        directory=directory,
+        identifier=entry,
+        database=_get_database_name(args),
+        structure_sealed=len(chains) == 0,
+        conservation="hmm" if args["compute_conservation"] else "none",
+        p2rank_configuration="conservation_hmm" if args["compute_conservation"] else "default",
+        structure_code=pdb_code,
+        chains=chains,
+        metadata={},
+    )
+
+    try:
+        os.makedirs(prediction.directory, exist_ok=True)
+    except OSError:
+        logger.error(f"Failed to create directory {prediction.directory}")
+        return None
+
+    _prepare_prediction_directory(prediction)
+    return prediction
+
+
+def _compute_conservation_batch(predictions: typing.List[Prediction], args: typing.Dict[str, str]):
+    """Compute conservation for all chains of given predictions using
+    a single search, the results are stored in the conservation cache."""
+    fasta_files = []
+    for prediction in predictions:
+        try:
+            fasta_files.extend(prepare_directory_sequences(prediction.directory))
+        except Exception:
+            # The failure is reported again when the task is executed.
+            logger.exception(f"Failed to prepare sequences for entry {prediction.identifier}")
+    working_directory = os.path.join(args["output_directory"], "conservation-batch")
+    try:
+        count = compute_hmm_based_conservation_batch(
+            fasta_files, working_directory, _execute_command,
+            args["conservation_workers"])
+        logger.info(f"Computed batch conservation for {count} sequences")
+    except Exception:
+        logger.exception("Batch conservation failed, tasks will compute it on their own")
+    finally:
+        shutil.rmtree(working_directory, ignore_errors=True)
+
+
+def _execute_command(command: str, ignore_return_code: bool = True):
+    logger.debug(f"Executing '{command}' ...")
+    result = subprocess.run(command, shell=True, env=os.environ.copy())
+    if not ignore_return_code:
+        result.check_returncode()
+
+
 if __name__ == "__main__":
 
     args = _read_arguments()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Convert conservation cache directory with per-hash JSONL files into
+# the single-file conservation store.
+#
+import typing
+import logging
+import argparse
+import os
+from conservation_cache import add_to_cache, read_legacy_cache_directory
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def _read_arguments() -> typing.Dict[str, str]:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input", required=True,
+        help="Directory with the cache files '*.jsonl'.")
+    parser.add_argument(
+        "--cache-directory", required=True,
+        help="Directory where the store is saved, can be same as input.")
+    parser.add_argument(
+        "--buffer-size", default=100000, type=int,
+        help="How many sequences to keep in memory.")
+    parser.add_argument(
+        "--remove", action="store_true",
+        help="Remove the JSONL files after migration.")
+    return vars(parser.parse_args())
+
+
+def main(arguments):
+    _init_logging()
+    buffer = []
+    counter = 0
+    added = 0
+    logger.info("Migrating conservations ...")
+    for item in read_legacy_cache_directory(arguments["input"]):
+        buffer.append(item)
+        counter += 1
+        if len(buffer) > arguments["buffer_size"]:
+            added += add_to_cache(arguments["cache_directory"], buffer)
+            buffer.clear()
+            logger.info(f"Migrated {counter} conservations ...")
+    added += add_to_cache(arguments["cache_directory"], buffer)
+    logger.info(f"Migrated {counter} conservations, {added} were new.")
+    if arguments["remove"]:
+        logger.info("Removing JSONL files ...")
+        for file_name in os.listdir(arguments["input"]):
+            if file_name.endswith(".jsonl"):
+                os.remove(os.path.join(arguments["input"], file_name))
+    logger.info("All done")
+
+
+def _init_logging():
+    formatter = logging.Formatter(
+        "%(asctime)s %(name)s [%(levelname)s] : %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(formatter)
+
+    logger.addHandler(handler)
+
+
+if __name__ == "__main__":
+    main(_read_arguments())
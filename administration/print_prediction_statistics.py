@@ -5,6 +5,7 @@
 #
 import argparse
 import os
+import sys
 import typing
 import logging
 import json
@@ -30,11 +31,19 @@ def _read_arguments() -> typing.Dict[str, str]:
     parser.add_argument(
         "--pocket-size", action="store_true",
         help="Also print information about pocket sizes.")
+    parser.add_argument(
+        "--index", action="store_true",
+        help="Use the status index (PRANKWEB_STATUS_INDEX) instead of "
+             "scanning the directories.")
     return vars(parser.parse_args())
 
 
 def main(arguments):
     _init_logging()
+    if arguments["index"]:
+        _print_statistics_from_index(
+            arguments["database"], arguments["pocket_size"])
+        return
     logger.info("Collecting predictions ...")
     directories = collect_predictions_directories(arguments["database"])
     logger.info(f"Found {len(directories)} prediction directories")
@@ -58,6 +67,31 @@ def _init_logging():
     logger.addHandler(handler)
 
 
+def _print_statistics_from_index(database_directory: str, count_pockets: bool):
+    # Import here, so the tool can be used without the executor.
+    import status_index
+    if not status_index.is_available():
+        logger.error(
+            "Status index is not set or does not exist, check "
+            "PRANKWEB_STATUS_INDEX or use rebuild_status_index.py.")
+        sys.exit(1)
+    database = os.path.basename(os.path.normpath(database_directory))
+    if not count_pockets:
+        by_status = status_index.count_by_status(database)
+        print("Loaded: ", sum(by_status.values()))
+        print("Status")
+        for key, value in by_status.items():
+            print(f"  {key} : {value}")
+        return
+    logger.info("Loading predictions ...")
+    predictions = [
+        load_prediction(item["directory"], count_pockets)
+        for item in status_index.iterate(database)
+    ]
+    print_statistics(predictions, count_pockets)
+    logger.info("All done")
+
+
 def collect_predictions_directories(
         predication_directory: str) -> typing.List[str]:
     return [
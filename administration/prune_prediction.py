@@ -8,11 +8,16 @@ import typing
 import logging
 import argparse
 import shutil
+import sys
 import os
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Identifiers of uploads linked to a prediction directory,
+# keep in sync with the web-server database_v4.
+ALIASES_FILE = "aliases"
+
 
 def _read_arguments() -> typing.Dict[str, str]:
     parser = argparse.ArgumentParser()
@@ -31,33 +36,96 @@ def _read_arguments() -> typing.Dict[str, str]:
     parser.add_argument(
         "--user-upload", action="store_true",
         help="If set is used for flat directories like user-upload.")
+    parser.add_argument(
+        "--index", action="store_true",
+        help="Use the status index (PRANKWEB_STATUS_INDEX) to select "
+             "predictions instead of scanning the directories.")
 
     return vars(parser.parse_args())
 
 
 def main(arguments):
     _init_logging()
+    if arguments["index"]:
+        _prune_using_index(arguments)
+        return
     logger.info("Scanning jobs ...")
     predictions = list_prankweb_predictions(
         arguments["database"], arguments["user_upload"])
     removed_counter = 0
     for (code, directory) in predictions:
+        if not os.path.lexists(directory):
+            # Alias removed together with the prediction.
+            continue
         info_path = os.path.join(directory, "info.json")
         if not os.path.exists(info_path):
             logger.info(f"Removing prediction '{code}' with no info.json file.")
             removed_counter += 1
-            shutil.rmtree(directory)
+            _remove_directory(directory)
             continue
         with open(info_path) as stream:
             info = json.load(stream)
         if should_be_deleted(info, arguments):
             logger.info(f"Removing '{code}' in '{directory}'.")
             removed_counter += 1
-            shutil.rmtree(directory)
+            _remove_directory(directory)
     logger.info(f"Removed {removed_counter} out of {len(predictions)}.")
     logger.info("All done")
 
 
+def _prune_using_index(arguments):
+    # Import here, so the tool can be used without the executor.
+    import status_index
+    if not status_index.is_available():
+        logger.error(
+            "Status index is not set or does not exist, check "
+            "PRANKWEB_STATUS_INDEX or use rebuild_status_index.py.")
+        sys.exit(1)
+    database = os.path.basename(os.path.normpath(arguments["database"]))
+    statuses = [
+        status for status in ["queued", "running", "failed"]
+        if arguments[status]
+    ]
+    logger.info("Querying index ...")
+    predictions = status_index.iterate(database, statuses)
+    for item in predictions:
+        logger.info(f"Removing '{item['id']}' in '{item['directory']}'.")
+        if os.path.lexists(item["directory"]):
+            for alias in _remove_directory(item["directory"]):
+                status_index.remove(database, alias)
+        status_index.remove(database, item["id"])
+    logger.info(f"Removed {len(predictions)}.")
+    logger.info("All done")
+
+
+def _remove_directory(directory: str) -> typing.List[str]:
+    """Remove the prediction together with uploads linked to it, so no
+    link is left orphaned. Return identifiers of the removed links."""
+    # Uploads sharing a prediction are links to the prediction directory.
+    if os.path.islink(directory):
+        os.unlink(directory)
+        return []
+    parent = os.path.dirname(os.path.normpath(directory))
+    aliases = [
+        alias for alias in _read_aliases(directory)
+        if os.path.islink(os.path.join(parent, alias))
+    ]
+    for alias in aliases:
+        logger.info(f"Removing alias '{alias}'.")
+        os.unlink(os.path.join(parent, alias))
+    shutil.rmtree(directory)
+    return aliases
+
+
+def _read_aliases(directory: str) -> typing.List[str]:
+    try:
+        with open(os.path.join(directory, ALIASES_FILE),
+                  encoding="utf-8") as stream:
+            return [line.strip() for line in stream if line.strip()]
+    except OSError:
+        return []
+
+
 def _init_logging():
     formatter = logging.Formatter(
         "%(asctime)s %(name)s [%(levelname)s] : %(message)s",
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Recreate index of prediction status from the 'info.json' files.
+# Supports nested {code[1:3]}/{code} as well as flat (user-upload)
+# database directories.
+#
+import typing
+import logging
+import argparse
+import json
+import os
+import status_index
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def _read_arguments() -> typing.Dict[str, str]:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--predictions",
+        default=os.environ.get("PRANKWEB_DATA_PREDICTIONS", None),
+        help="Directory with prankweb databases, e.g. 'v4', 'v4-alphafold'.")
+    parser.add_argument(
+        "--index", default=status_index.STATUS_INDEX,
+        help="Path to the index file.")
+    return vars(parser.parse_args())
+
+
+def main(arguments):
+    _init_logging()
+    if arguments["predictions"] is None or arguments["index"] is None:
+        logger.error("Missing predictions directory or index file.")
+        return
+    logger.info("Collecting predictions ...")
+    items = []
+    for database_directory in _list_directories(arguments["predictions"]):
+        count = len(items)
+        items.extend(collect_predictions(database_directory))
+        logger.info(
+            f"Found {len(items) - count} predictions in "
+            f"'{database_directory}'")
+    logger.info("Writing index ...")
+    count = status_index.replace_all(items, arguments["index"])
+    logger.info(f"Indexed {count} predictions.")
+    logger.info("All done")
+
+
+def _init_logging():
+    formatter = logging.Formatter(
+        "%(asctime)s %(name)s [%(levelname)s] : %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(formatter)
+
+    logger.addHandler(handler)
+
+
+def _list_directories(directory: str) -> typing.List[str]:
+    # Links are uploads sharing a prediction, they are indexed
+    # with the prediction they link to.
+    return [
+        entry.path for entry in os.scandir(directory)
+        if entry.is_dir(follow_symlinks=False)
+    ]
+
+
+def collect_predictions(database_directory: str) \
+        -> typing.Iterator[typing.Tuple[str, typing.Dict]]:
+    database = os.path.basename(os.path.normpath(database_directory))
+    for directory in _list_directories(database_directory):
+        if os.path.exists(os.path.join(directory, "info.json")):
+            # Flat directory, e.g. user-upload.
+            yield from _load_prediction(database, directory)
+            continue
+        for prediction_directory in _list_directories(directory):
+            yield from _load_prediction(database, prediction_directory)
+
+
+def _load_prediction(database: str, directory: str) \
+        -> typing.Iterator[typing.Tuple[str, typing.Dict]]:
+    info_file = os.path.join(directory, "info.json")
+    try:
+        with open(info_file, encoding="utf-8") as stream:
+            info = json.load(stream)
+    except (OSError, ValueError):
+        logger.warning(f"Can't read '{info_file}'.")
+        return
+    if "status" not in info:
+        logger.warning(f"Missing status in '{info_file}'.")
+        return
+    info.setdefault("database", database)
+    info.setdefault("id", os.path.basename(directory))
+    yield directory, info
+    parent = os.path.dirname(os.path.normpath(directory))
+    for alias in status_index.read_aliases(directory):
+        link = os.path.join(parent, alias)
+        if os.path.islink(link):
+            yield link, {**info, "id": alias}
+
+
+if __name__ == "__main__":
+    main(_read_arguments())
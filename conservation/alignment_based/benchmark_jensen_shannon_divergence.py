@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Compare in-process Jensen-Shannon divergence with the legacy
+# score_conservation.py script on a directory with MSA files, as
+# produced by compute_msa. Report run times and score differences.
+#
+import os
+import time
+import typing
+import argparse
+import subprocess
+
+import jensen_shannon_divergence as jsd
+from conservation_alignment_based import \
+    _sanitize_jensen_shannon_divergence_input
+
+
+def _read_arguments() -> typing.Dict[str, str]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark Jensen-Shannon divergence implementations.")
+    parser.add_argument(
+        "--input", required=True,
+        help="Directory with MSA files in FASTA format.")
+    parser.add_argument(
+        "--working", required=True,
+        help="Directory for output files.")
+    parser.add_argument(
+        "--legacy-directory",
+        default=os.environ.get("JENSE_SHANNON_DIVERGANCE_DIR", None),
+        help="Directory with score_conservation.py script.")
+    return vars(parser.parse_args())
+
+
+def main(arguments):
+    os.makedirs(arguments["working"], exist_ok=True)
+    legacy_total = 0.0
+    native_total = 0.0
+    for file_name in sorted(os.listdir(arguments["input"])):
+        input_file = os.path.join(arguments["input"], file_name)
+        legacy_file = os.path.join(arguments["working"], file_name + ".legacy")
+        native_file = os.path.join(arguments["working"], file_name + ".native")
+        legacy_time = _run_legacy(
+            input_file, legacy_file, arguments["legacy_directory"])
+        native_time = _run_native(input_file, native_file)
+        legacy_total += legacy_time
+        native_total += native_time
+        difference = _compare(legacy_file, native_file)
+        print(f"{file_name}\t"
+              f"legacy: {legacy_time:.3f} s\t"
+              f"native: {native_time:.3f} s\t"
+              f"max difference: {difference}")
+    print(f"Total\tlegacy: {legacy_total:.3f} s\tnative: {native_total:.3f} s")
+
+
+def _run_legacy(input_file: str, output_file: str, directory: str) -> float:
+    sanitized_file = output_file + ".sanitized"
+    start = time.perf_counter()
+    _sanitize_jensen_shannon_divergence_input(input_file, sanitized_file)
+    subprocess.run(
+        "cd {} && python2 score_conservation.py {} > {}".format(
+            directory,
+            os.path.abspath(sanitized_file),
+            os.path.abspath(output_file)),
+        shell=True, check=True)
+    return time.perf_counter() - start
+
+
+def _run_native(input_file: str, output_file: str) -> float:
+    start = time.perf_counter()
+    jsd.compute_jensen_shannon_divergence(input_file, output_file)
+    return time.perf_counter() - start
+
+
+def _compare(left_file: str, right_file: str) -> typing.Optional[float]:
+    """Return max absolute difference in scores or None for different
+    number of columns."""
+    left = _read_scores(left_file)
+    right = _read_scores(right_file)
+    if len(left) != len(right):
+        return None
+    return max(
+        (abs(left_value - right_value)
+         for left_value, right_value in zip(left, right)),
+        default=0.0)
+
+
+def _read_scores(path: str) -> typing.List[float]:
+    with open(path) as stream:
+        return [
+            float(line.split("\t")[1])
+            for line in stream
+            if not line.startswith("#") and line.strip()
+        ]
+
+
+if __name__ == "__main__":
+    main(_read_arguments())
@@ -4,7 +4,7 @@
 # https://compbio.cs.princeton.edu/conservation/.
 #
 # Required environment variables:
-#   * JENSE_SHANNON_DIVERGANCE_DIR  = conservation_code/
+#   * JENSE_SHANNON_DIVERGANCE_DIR  = conservation_code/ (only for legacy JSD)
 #   * PSIBLAST_CMD                  = ncbi-blast-2.9.0+/bin/psiblast
 #   * BLASTDBCMD_CMD                = ncbi-blast-2.9.0+/bin/blastdbcmd
 #   * CDHIT_CMD                     = cd-hit-v4.8.1-2019-0228/cd-hit
@@ -24,6 +24,7 @@ import subprocess
 import shutil
 
 import multiple_sequence_alignment as msa
+import jensen_shannon_divergence as jsd
 
 JENSE_SHANNON_DIVERGANCE_DIR = os.environ.get(
     "JENSE_SHANNON_DIVERGANCE_DIR", None)
@@ -36,6 +37,10 @@ CDHIT_CMD = os.environ.get("CDHIT_CMD", None)
 
 MUSCLE_CMD = os.environ.get("MUSCLE_CMD", None)
 
+# Use 'legacy' to run score_conservation.py from JENSE_SHANNON_DIVERGANCE_DIR
+# instead of the in-process jensen_shannon_divergence module.
+JSD_ENGINE = os.environ.get("JSD_ENGINE", "native")
+
 
 class Configuration:
     # See multiple_sequence_alignment.MsaConfiguration for more details.
@@ -48,6 +53,11 @@ class Configuration:
     execute_command: typing.Callable[[str], None]
     # Name of BLAST databases used to compute MSA.
     blast_databases: typing.List[str] = None
+    # Optional, execute psiblast by other means, must return False
+    # if the search was not executed.
+    # Arguments: input file, database, output format, evalue, output file
+    search_psiblast: typing.Optional[
+        typing.Callable[[str, str, str, str, str], bool]] = None
 
 
 def _read_arguments() -> typing.Dict[str, str]:
@@ -112,20 +122,26 @@ def create_msa_configuration(
     result.maximum_sequences_for_msa = config.msa_maximum_sequences
     result.blast_databases = config.blast_databases
     result.working_dir = working_dir
-    result.execute_psiblast = _create_execute_psiblast(config.execute_command)
+    result.execute_psiblast = _create_execute_psiblast(
+        config.execute_command, config.search_psiblast)
     result.execute_blastdb = _create_execute_blastdbcmd(config.execute_command)
     result.execute_cdhit = _create_execute_cdhit(config.execute_command)
     result.execute_muscle = _create_execute_muscle(config.execute_command)
     return result
 
 
-def _create_execute_psiblast(execute_command):
+def _create_execute_psiblast(execute_command, search_psiblast=None):
     """Search for similar sequences using PSI-BLAST."""
 
     def execute_psiblast(input_file: str, output_file: str, database: str):
         output_format = "6 sallseqid qcovs pident"
-        cmd = "{} < {} -db {} -outfmt '{}' -evalue 1e-5 > {}".format(
-            PSIBLAST_CMD, input_file, database, output_format, output_file)
+        evalue = "1e-5"
+        if search_psiblast is not None and search_psiblast(
+                input_file, database, output_format, evalue, output_file):
+            return
+        cmd = "{} < {} -db {} -outfmt '{}' -evalue {} > {}".format(
+            PSIBLAST_CMD, input_file, database, output_format, evalue,
+            output_file)
         execute_command(cmd)
 
     return execute_psiblast
@@ -164,6 +180,9 @@ def compute_jensen_shannon_divergence(
         input_file: str, output_file: str, config: Configuration
 ) -> str:
     """Input sequence must be on the first position."""
+    if JSD_ENGINE != "legacy":
+        logging.info("Computing Jense Shannon Divergence ...")
+        return jsd.compute_jensen_shannon_divergence(input_file, output_file)
     sanitized_input_file = input_file + ".sanitized"
     _sanitize_jensen_shannon_divergence_input(input_file, sanitized_input_file)
     cmd = "cd {} && python2 score_conservation.py {} > {}".format(
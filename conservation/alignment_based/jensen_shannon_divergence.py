@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Jensen-Shannon divergence conservation scoring, follows the defaults of
+# score_conservation.py from https://compbio.cs.princeton.edu/conservation/
+#   * js_divergence scoring with BLOSUM62 background distribution
+#   * window size 3 with lambda 0.5
+#   * gap cutoff 0.3 and weighted gap penalty
+#   * position-based sequence weights
+# The computation is vectorized using NumPy and runs in-process.
+#
+import typing
+
+import numpy
+
+# Order and background distribution as used by score_conservation.py .
+AMINO_ACIDS = "ARNDCQEGHILKMFPSTWYV"
+
+BLOSUM62_BACKGROUND = numpy.array([
+    0.078, 0.051, 0.041, 0.052, 0.024, 0.034, 0.059, 0.083, 0.025, 0.062,
+    0.092, 0.056, 0.024, 0.044, 0.043, 0.059, 0.055, 0.014, 0.034, 0.072])
+
+GAP = len(AMINO_ACIDS)
+
+# Valid characters other than amino acids, they are ignored.
+OTHER = GAP + 1
+
+IUPAC_ALPHABET = "ABCDEFGHIKLMNPQRSTUVWYZX*-"
+
+PSEUDOCOUNT = 0.0000001
+
+WINDOW_SIZE = 3
+
+WINDOW_LAMBDA = 0.5
+
+GAP_CUTOFF = 0.3
+
+GAP_SCORE = -1000.0
+
+
+def _create_encoding() -> numpy.ndarray:
+    result = numpy.full(256, GAP, dtype=numpy.uint8)
+    for residue in IUPAC_ALPHABET:
+        result[ord(residue)] = OTHER
+    for index, residue in enumerate(AMINO_ACIDS):
+        result[ord(residue)] = index
+    # Same replacement as in score_conservation.py .
+    result[ord("B")] = AMINO_ACIDS.index("D")
+    result[ord("Z")] = AMINO_ACIDS.index("Q")
+    result[ord("X")] = GAP
+    result[ord("-")] = GAP
+    return result
+
+
+_ENCODING = _create_encoding()
+
+_DECODING = numpy.frombuffer(
+    (AMINO_ACIDS + "-").encode("ascii"), dtype=numpy.uint8)
+
+
+def read_fasta_alignment(path: str) \
+        -> typing.Tuple[typing.List[str], numpy.ndarray, numpy.ndarray]:
+    """Return names, encoded alignment and alignment characters."""
+    names = []
+    sequences = []
+    with open(path) as stream:
+        for line in stream:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith(";"):
+                continue
+            if line.startswith(">"):
+                names.append(line[1:])
+                sequences.append([])
+            elif sequences:
+                sequences[-1].append(line.strip())
+    raw = numpy.array([
+        numpy.frombuffer("".join(sequence).upper().encode("ascii"),
+                         dtype=numpy.uint8)
+        for sequence in sequences
+    ], dtype=numpy.uint8).reshape(len(sequences), -1)
+    return names, _ENCODING[raw], _characters(raw)
+
+
+def _characters(raw: numpy.ndarray) -> numpy.ndarray:
+    """Characters as seen by the scoring, i.e. after replacements."""
+    encoded = _ENCODING[raw]
+    result = raw.copy()
+    is_amino_acid_or_gap = encoded <= GAP
+    result[is_amino_acid_or_gap] = _DECODING[encoded[is_amino_acid_or_gap]]
+    return result
+
+
+def sequence_weights(alignment: numpy.ndarray) -> numpy.ndarray:
+    """Position-based weights, averaged over columns."""
+    sequence_count, column_count = alignment.shape
+    counts = _counts(alignment, numpy.ones(sequence_count))
+    observed_types = (counts[:, :GAP] > 0).sum(axis=1)
+    is_amino_acid = alignment < GAP
+    columns = numpy.broadcast_to(
+        numpy.arange(column_count), alignment.shape)
+    denominator = numpy.zeros(alignment.shape)
+    denominator[is_amino_acid] = \
+        counts[columns[is_amino_acid], alignment[is_amino_acid]] * \
+        numpy.broadcast_to(observed_types, alignment.shape)[is_amino_acid]
+    with numpy.errstate(divide="ignore"):
+        contributions = numpy.where(denominator > 0, 1.0 / denominator, 0.0)
+    return contributions.sum(axis=1) / column_count
+
+
+def _counts(alignment: numpy.ndarray, weights: numpy.ndarray) \
+        -> numpy.ndarray:
+    """Weighted counts with shape (columns, amino acids + gap)."""
+    result = numpy.zeros((alignment.shape[1], GAP + 1))
+    for symbol in range(GAP + 1):
+        result[:, symbol] = weights @ (alignment == symbol)
+    return result
+
+
+def js_divergence(alignment: numpy.ndarray, weights: numpy.ndarray) \
+        -> numpy.ndarray:
+    """Return score for every column, without the window smoothing."""
+    sequence_count = alignment.shape[0]
+    total_weight = weights.sum()
+    frequencies = (_counts(alignment, weights) + PSEUDOCOUNT) / \
+        (total_weight + (GAP + 1) * PSEUDOCOUNT)
+    # The background lacks the gap, so we remove it as well.
+    frequencies = frequencies[:, :GAP]
+    frequencies /= frequencies.sum(axis=1)[:, numpy.newaxis]
+    background = BLOSUM62_BACKGROUND[numpy.newaxis, :]
+    mixture = 0.5 * frequencies + 0.5 * background
+    divergence = 0.5 * numpy.sum(
+        frequencies * numpy.log2(frequencies / mixture)
+        + background * numpy.log2(background / mixture),
+        axis=1)
+    is_gap = alignment == GAP
+    gap_penalty = 1 - (weights @ is_gap) / total_weight
+    scores = divergence * gap_penalty
+    gap_percentage = is_gap.sum(axis=0) / sequence_count
+    return numpy.where(gap_percentage <= GAP_CUTOFF, scores, GAP_SCORE)
+
+
+def window_score(
+        scores: numpy.ndarray, window: int = WINDOW_SIZE,
+        lam: float = WINDOW_LAMBDA) -> numpy.ndarray:
+    """Mix the score with average of valid scores in the window."""
+    result = scores.copy()
+    if len(scores) <= 2 * window:
+        return result
+    is_valid = scores >= 0
+    kernel = numpy.ones(2 * window + 1)
+    kernel[window] = 0
+    sums = numpy.convolve(numpy.where(is_valid, scores, 0.0), kernel, "same")
+    counts = numpy.convolve(is_valid.astype(float), kernel, "same")
+    # Same as in score_conservation.py, borders are not smoothed.
+    inner = numpy.zeros(len(scores), dtype=bool)
+    inner[window:len(scores) - window] = True
+    update = inner & is_valid & (counts > 0)
+    result[update] = (1 - lam) * scores[update] + \
+        lam * sums[update] / counts[update]
+    return result
+
+
+def score_alignment(alignment: numpy.ndarray) -> numpy.ndarray:
+    if alignment.shape[0] == 0:
+        return numpy.zeros(0)
+    weights = sequence_weights(alignment)
+    if weights.sum() == 0:
+        weights = numpy.ones(alignment.shape[0])
+    return window_score(js_divergence(alignment, weights))
+
+
+def compute_jensen_shannon_divergence(input_file: str, output_file: str):
+    names, alignment, characters = read_fasta_alignment(input_file)
+    scores = score_alignment(alignment)
+    with open(output_file, "w", newline="\n") as stream:
+        stream.write(
+            f"# {input_file} -- js_divergence"
+            f" - window_size: {WINDOW_SIZE}"
+            f" - window lambda: {WINDOW_LAMBDA:.2f}"
+            " - background: blosum62 - seq. weighting: True"
+            " - gap penalty: 1 - normalized: False\n")
+        stream.write("# align_column_number\tscore\tcolumn\n")
+        for index, score in enumerate(scores):
+            column = characters[:, index].tobytes().decode("ascii")
+            stream.write(f"{index}\t{score:.5f}\t{column}\n")
+    return output_file
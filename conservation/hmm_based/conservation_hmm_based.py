@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import argparse
+import itertools
+import logging
 import os
 import subprocess
 import random
@@ -10,6 +12,17 @@ HMMER_DIR = os.environ.get("HMMER_DIR", "")
 
 HMM_SEQUENCE_FILE = os.environ.get("HMM_SEQUENCE_FILE", None)
 
+# Engine used to compute the information content, one of:
+#   hmmer    - use esl-weight and esl-alistat
+#   native   - use information_content module, see the module for details
+#   validate - use hmmer, compute native and fail if they differ by more
+#              than HMM_IC_VALIDATE_TOLERANCE
+HMM_IC_ENGINE = os.environ.get("HMM_IC_ENGINE", "hmmer")
+
+# Maximum absolute difference of a value between the engines.
+HMM_IC_VALIDATE_TOLERANCE = float(
+    os.environ.get("HMM_IC_VALIDATE_TOLERANCE", 0.1))
+
 
 def _read_arguments() -> typing.Dict[str, str]:
     parser = argparse.ArgumentParser(
@@ -45,6 +58,10 @@ def _read_arguments() -> typing.Dict[str, str]:
         "--mask_output", action="store_true",
         help="if set mask certain IC values based on the corresponding "
              "frequencies of the gap (-) character (see readme file).")
+    parser.add_argument(
+        "--ic_engine", default=HMM_IC_ENGINE,
+        choices=["hmmer", "native", "validate"],
+        help="engine used to compute the IC values (see readme file).")
 
     return vars(parser.parse_args())
 
@@ -67,26 +84,32 @@ def compute_conservation(
         execute_command: typing.Callable[[str], None],
         mask_output: bool,
         max_seqs: int,
+        ic_engine: str = HMM_IC_ENGINE,
+        execute_phmmer: typing.Optional[
+            typing.Callable[[str, str, str], bool]] = None,
 ):
+    """Function execute_phmmer can be used to execute the search by other
+    means, it must return False if the search was not executed."""
     unweighted_msa_file = _generate_msa(
-        fasta_file, database_file, working_directory, execute_command)
+        fasta_file, database_file, working_directory, execute_command,
+        execute_phmmer)
 
     if max_seqs:
-        sample_file = _select_sequences(unweighted_msa_file, max_seqs)
-        if sample_file:
-            # We have more sequences than we need, so we got file with selected
-            # ones, but only names, so we need to prepare the file.
-            unweighted_msa_file = _generate_msa_sample(
-                unweighted_msa_file, sample_file, execute_command)
+        unweighted_msa_file = _sample_msa(unweighted_msa_file, max_seqs)
+
+    if ic_engine == "native":
+        information_content, freqgap = _compute_native_information_content(
+            unweighted_msa_file)
+        weighted_msa_file = unweighted_msa_file
+    else:
+        weighted_msa_file, information_content, freqgap = \
+            _compute_hmmer_information_content(
+                unweighted_msa_file, execute_command)
+        if ic_engine == "validate":
+            _validate_native_information_content(
+                unweighted_msa_file, information_content, freqgap)
 
-    # No matter what we calculate the weights.
-    weighted_msa_file = _calculate_sequence_weights(
-        unweighted_msa_file, execute_command)
-
-    ic_file, r_file = _calculate_information_content(
-        weighted_msa_file, execute_command)
     fasta_file_header, fasta_file_sequence = _read_fasta_file(fasta_file)
-    information_content, freqgap = _read_information_content(ic_file, r_file)
 
     original_target_file = target_file
     if mask_output:
@@ -116,45 +139,243 @@ def compute_conservation(
     return weighted_msa_file
 
 
+def _compute_hmmer_information_content(
+        unweighted_msa_file: str,
+        execute_command: typing.Callable[[str], None]):
+    # No matter what we calculate the weights.
+    weighted_msa_file = _calculate_sequence_weights(
+        unweighted_msa_file, execute_command)
+
+    ic_file, r_file = _calculate_information_content(
+        weighted_msa_file, execute_command)
+    information_content, freqgap = _read_information_content(ic_file, r_file)
+    return weighted_msa_file, information_content, freqgap
+
+
+def _compute_native_information_content(unweighted_msa_file: str):
+    """Return information content and gap frequency as lists of strings,
+    or None, None if no MSA was generated."""
+    # Import here, so numpy is required only for the native engine.
+    import information_content as ic
+    if not os.path.exists(unweighted_msa_file) or \
+            os.path.getsize(unweighted_msa_file) == 0:
+        return None, None
+    msa = ic.read_stockholm(unweighted_msa_file)
+    if len(msa.names) == 0:
+        return None, None
+    information_content, freqgap = ic.compute_information_content(msa)
+    return ic.format_values(information_content), ic.format_values(freqgap)
+
+
+def _validate_native_information_content(
+        unweighted_msa_file: str,
+        expected_information_content, expected_freqgap):
+    """Compare the native and HMMER engine, raise an error if the values
+    differ by more than HMM_IC_VALIDATE_TOLERANCE."""
+    actual_information_content, actual_freqgap = \
+        _compute_native_information_content(unweighted_msa_file)
+    for name, expected, actual in [
+        ("IC", expected_information_content, actual_information_content),
+        ("freqgap", expected_freqgap, actual_freqgap),
+    ]:
+        if expected is None or actual is None:
+            if expected is not actual:
+                raise RuntimeError(
+                    f"Native {name} validation failed for "
+                    f"'{unweighted_msa_file}', expected {expected} "
+                    f"actual {actual}")
+            continue
+        if len(expected) != len(actual):
+            raise RuntimeError(
+                f"Native {name} validation failed for "
+                f"'{unweighted_msa_file}', length expected {len(expected)} "
+                f"actual {len(actual)}")
+        differences = [
+            abs(float(left) - float(right))
+            for left, right in zip(expected, actual)
+        ]
+        max_difference = max(differences, default=0.0)
+        logging.info(
+            "Native %s validation for '%s' max difference %.5f "
+            "mean difference %.5f",
+            name, unweighted_msa_file, max_difference,
+            sum(differences) / max(len(differences), 1))
+        if max_difference > HMM_IC_VALIDATE_TOLERANCE:
+            raise RuntimeError(
+                f"Native {name} validation failed for "
+                f"'{unweighted_msa_file}', max difference "
+                f"{max_difference:.5f} is over the tolerance "
+                f"{HMM_IC_VALIDATE_TOLERANCE}")
+
+
 def _generate_msa(
         fasta_file: str, database_file: str, working_directory: str,
-        execute_command: typing.Callable[[str], None]
+        execute_command: typing.Callable[[str], None],
+        execute_phmmer: typing.Optional[
+            typing.Callable[[str, str, str], bool]] = None
 ):
     unweighted_msa_file = os.path.join(
         working_directory, os.path.basename(fasta_file)) + ".sto"
+    if execute_phmmer is not None and \
+            execute_phmmer(fasta_file, database_file, unweighted_msa_file):
+        return unweighted_msa_file
     cmd = "{}phmmer -o /dev/null -A {} {} {}".format(
         HMMER_DIR, unweighted_msa_file, fasta_file, database_file)
     execute_command(cmd)
     return unweighted_msa_file
 
 
-def _select_sequences(unweighted_msa_file: str, max_seqs: int):
-    """Return path to file with sequences, may select only some sequences."""
-    sequence_names = []
-    with open(unweighted_msa_file) as stream:
-        for line in stream:
-            if line.startswith("#=GS"):
-                sequence_names.append(line.split()[1])
-    if len(sequence_names) <= max_seqs:
-        return None
-    selected_sequences_file = unweighted_msa_file + ".ss"
-    with open(selected_sequences_file, mode="w") as stream:
-        random.seed(666)
-        for index in random.sample(sequence_names, k=max_seqs):
-            stream.write(index + "\n")
-    return selected_sequences_file
-
-
-def _generate_msa_sample(
-        unweighted_msa_file: str, ss_file: str,
+def generate_msa_batch(
+        fasta_files: typing.List[str], database_file: str,
+        working_directory: str,
         execute_command: typing.Callable[[str], None]
-):
-    unweighted_msa_sample_file = unweighted_msa_file + ".sample"
-    cmd = "{}esl-alimanip -o {} --seq-k {} {}".format(
-        HMMER_DIR, unweighted_msa_sample_file, ss_file,
-        unweighted_msa_file)
+) -> typing.Dict[str, str]:
+    """Search for all given sequences using a single phmmer execution, so
+    the database is read only once. Return MSA file for each FASTA file,
+    the content is the same as produced by _generate_msa for the file."""
+    query_file = os.path.join(working_directory, "batch-queries.fasta")
+    queries = {}
+    result = {}
+    with open(query_file, "w") as stream:
+        for index, fasta_file in enumerate(fasta_files):
+            header, sequence = _read_fasta_file(fasta_file)
+            # Names in the FASTA files may not be unique, so we use our own.
+            query_name = f"query-{index}"
+            name, *description = header[1:].split(maxsplit=1)
+            stream.write(">" + " ".join([query_name, *description]) + "\n")
+            stream.write(sequence + "\n")
+            msa_file = os.path.join(
+                working_directory, f"batch-{index}.sto")
+            queries[query_name] = (name, msa_file)
+            result[fasta_file] = msa_file
+    batch_msa_file = os.path.join(working_directory, "batch.sto")
+    cmd = "{}phmmer -o /dev/null -A {} {} {}".format(
+        HMMER_DIR, batch_msa_file, query_file, database_file)
     execute_command(cmd)
-    return unweighted_msa_sample_file
+    _split_msa_batch(batch_msa_file, queries)
+    os.remove(query_file)
+    if os.path.exists(batch_msa_file):
+        os.remove(batch_msa_file)
+    return result
+
+
+def _split_msa_batch(
+        batch_msa_file: str,
+        queries: typing.Dict[str, typing.Tuple[str, str]]):
+    """Split phmmer output with multiple alignments into a file per query,
+    the alignments are identified by the query name in the '#=GF ID' line.
+    No alignment is written for query without hits, in such case
+    we create an empty file."""
+    written = set()
+    if os.path.exists(batch_msa_file):
+        with open(batch_msa_file) as input_stream:
+            pending_lines = []
+            output_stream = None
+            try:
+                for line in input_stream:
+                    if output_stream is None:
+                        if not line.startswith("#=GF ID"):
+                            pending_lines.append(line)
+                            continue
+                        query_name = line.split()[2]
+                        name, msa_file = queries[query_name]
+                        output_stream = open(msa_file, "w")
+                        output_stream.writelines(pending_lines)
+                        pending_lines = []
+                        written.add(query_name)
+                        line = line.replace(query_name, name, 1)
+                    output_stream.write(line)
+                    if line.startswith("//"):
+                        output_stream.close()
+                        output_stream = None
+            finally:
+                if output_stream is not None:
+                    output_stream.close()
+    for query_name, (_, msa_file) in queries.items():
+        if query_name not in written:
+            open(msa_file, "w").close()
+
+
+def _sample_msa(unweighted_msa_file: str, max_seqs: int) -> str:
+    """Return path to MSA with at most max_seqs randomly selected sequences.
+
+    The input is streamed, only the header is stored in a file and only
+    names of selected sequences are kept in memory. The selection is the
+    same as random.sample on the list of names, as the selection depends
+    only on the number of the names.
+    """
+    if not os.path.exists(unweighted_msa_file):
+        return unweighted_msa_file
+    sample_file = unweighted_msa_file + ".sample"
+    header_file = sample_file + ".header"
+    with open(unweighted_msa_file) as input_stream:
+        # All #=GS lines are in the header, before the first block.
+        sequence_count = 0
+        first_block_line = None
+        with open(header_file, "w") as header_stream:
+            for line in input_stream:
+                if _is_sequence_line(line):
+                    first_block_line = line
+                    break
+                if line.startswith("#=GS"):
+                    sequence_count += 1
+                header_stream.write(line)
+        if sequence_count <= max_seqs:
+            os.remove(header_file)
+            return unweighted_msa_file
+        # Own generator instance, so parallel computations do not interfere,
+        # the selection is the same as with random.seed(666).
+        generator = random.Random(666)
+        selected_indices = set(
+            generator.sample(range(sequence_count), k=max_seqs))
+        with open(header_file) as header_stream, \
+                open(sample_file, "w") as output_stream:
+            selected_names = _write_sampled_header(
+                header_stream, output_stream, selected_indices)
+            if first_block_line is not None:
+                _write_sampled_lines(
+                    itertools.chain([first_block_line], input_stream),
+                    output_stream, selected_names)
+    os.remove(header_file)
+    return sample_file
+
+
+def _is_sequence_line(line: str) -> bool:
+    return not line.startswith("#") and not line.startswith("//") \
+        and line.strip() != ""
+
+
+def _write_sampled_header(
+        input_stream, output_stream,
+        selected_indices: typing.Set[int]) -> typing.Set[str]:
+    """Copy the header with only the selected #=GS lines, return names
+    of selected sequences."""
+    selected_names = set()
+    index = 0
+    for line in input_stream:
+        if line.startswith("#=GS"):
+            if index in selected_indices:
+                selected_names.add(line.split()[1])
+                output_stream.write(line)
+            index += 1
+        else:
+            output_stream.write(line)
+    return selected_names
+
+
+def _write_sampled_lines(
+        lines: typing.Iterable[str], output_stream,
+        selected_names: typing.Set[str]):
+    for line in lines:
+        if _is_sequence_line(line):
+            name = line.split(maxsplit=1)[0]
+        elif line.startswith("#=GR") or line.startswith("#=GS"):
+            name = line.split(maxsplit=2)[1]
+        else:
+            output_stream.write(line)
+            continue
+        if name in selected_names:
+            output_stream.write(line)
 
 
 def _calculate_sequence_weights(
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Compute per-column information content (IC) and gap frequency for
+# a Stockholm MSA in-process. This is an alternative to the
+# esl-weight / esl-alistat chain.
+#
+# Differences to the HMMER tools:
+#   * Sequence weights are position-based (Henikoff & Henikoff), as with
+#     'esl-weight -p', esl-weight uses GSC tree weights by default.
+#   * IC is log2(20) minus the entropy of the weighted residue
+#     distribution in the column, gaps are ignored.
+# Use the 'validate' engine in conservation_hmm_based.py to compare
+# the values with the HMMER tools.
+#
+import typing
+
+import numpy
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+GAP = len(AMINO_ACIDS)
+
+# Everything else, degenerate or unknown residues.
+OTHER = GAP + 1
+
+# Weight of degenerate residues is split among the residues.
+DEGENERATE = {
+    "B": "DN",
+    "Z": "EQ",
+    "J": "IL",
+    "X": AMINO_ACIDS,
+}
+
+_GAP_CHARACTERS = "-._~"
+
+
+def _create_encoding() -> numpy.ndarray:
+    result = numpy.full(256, OTHER, dtype=numpy.uint8)
+    for index, residue in enumerate(AMINO_ACIDS):
+        result[ord(residue)] = index
+        result[ord(residue.lower())] = index
+    for gap in _GAP_CHARACTERS:
+        result[ord(gap)] = GAP
+    return result
+
+
+_ENCODING = _create_encoding()
+
+
+class Msa:
+
+    def __init__(self, names: typing.List[str], residues: numpy.ndarray,
+                 raw: numpy.ndarray, reference: typing.Optional[str]):
+        # Sequence names in order of appearance.
+        self.names = names
+        # Matrix (sequences x columns) of encoded residues.
+        self.residues = residues
+        # Matrix (sequences x columns) of original characters.
+        self.raw = raw
+        # Optional '#=GC RF' annotation.
+        self.reference = reference
+
+
+def read_stockholm(path: str) -> Msa:
+    """Read the first alignment in a Stockholm file, supports blocks."""
+    sequences: typing.Dict[str, typing.List[str]] = {}
+    reference = []
+    with open(path) as stream:
+        for line in stream:
+            if line.startswith("//"):
+                break
+            if line.startswith("#=GC RF"):
+                reference.append(line.split()[2])
+                continue
+            if line.startswith("#") or not line.strip():
+                continue
+            name, sequence = line.split()
+            sequences.setdefault(name, []).append(sequence)
+    names = list(sequences.keys())
+    raw = numpy.array([
+        numpy.frombuffer("".join(sequences[name]).encode("ascii"),
+                         dtype=numpy.uint8)
+        for name in names
+    ], dtype=numpy.uint8).reshape(len(names), -1)
+    return Msa(
+        names, _ENCODING[raw], raw,
+        "".join(reference) if reference else None)
+
+
+def position_based_weights(residues: numpy.ndarray) -> numpy.ndarray:
+    """Henikoff position-based weights, normalized to sum to nseq."""
+    sequence_count, column_count = residues.shape
+    if sequence_count == 0:
+        return numpy.zeros(0)
+    is_residue = residues < GAP
+    weights = numpy.zeros(sequence_count)
+    # counts[column, residue]
+    counts = _count(residues, numpy.ones(sequence_count))
+    types = (counts[:, :GAP] > 0).sum(axis=1)
+    columns = numpy.arange(column_count)
+    for row in range(sequence_count):
+        mask = is_residue[row]
+        residue_counts = counts[columns[mask], residues[row, mask]]
+        weights[row] = numpy.sum(1.0 / (types[mask] * residue_counts))
+    total = weights.sum()
+    if total == 0:
+        return numpy.ones(sequence_count)
+    return weights * (sequence_count / total)
+
+
+def _count(residues: numpy.ndarray, weights: numpy.ndarray) -> numpy.ndarray:
+    """Return weighted counts with shape (columns, OTHER + 1)."""
+    result = numpy.zeros((residues.shape[1], OTHER + 1))
+    for symbol in range(OTHER + 1):
+        result[:, symbol] = weights @ (residues == symbol)
+    return result
+
+
+def _residue_counts(
+        msa: Msa, weights: numpy.ndarray) -> numpy.ndarray:
+    """Return weighted residue counts (columns x 20), with degenerate
+    residues split among the residues they represent."""
+    counts = _count(msa.residues, weights)[:, :GAP]
+    is_other = msa.residues == OTHER
+    if not is_other.any():
+        return counts
+    for code, residues in DEGENERATE.items():
+        is_code = (msa.raw == ord(code)) | (msa.raw == ord(code.lower()))
+        column_weight = weights @ (is_code & is_other)
+        for residue in residues:
+            counts[:, AMINO_ACIDS.index(residue)] += \
+                column_weight / len(residues)
+    return counts
+
+
+def match_columns(msa: Msa) -> numpy.ndarray:
+    """Indices of columns corresponding to the reference annotation."""
+    if msa.reference is None:
+        return numpy.arange(msa.residues.shape[1])
+    return numpy.array([
+        index for index, value in enumerate(msa.reference)
+        if value not in _GAP_CHARACTERS
+    ], dtype=numpy.int64)
+
+
+def compute_information_content(msa: Msa) \
+        -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """Return information content and gap frequency for match columns."""
+    weights = position_based_weights(msa.residues)
+    counts = _residue_counts(msa, weights)
+    gaps = weights @ (msa.residues == GAP)
+    columns = match_columns(msa)
+    counts = counts[columns]
+    gaps = gaps[columns]
+    non_gap = counts.sum(axis=1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        frequencies = counts / non_gap[:, numpy.newaxis]
+        entropy = -numpy.nansum(
+            numpy.where(frequencies > 0,
+                        frequencies * numpy.log2(frequencies), 0.0),
+            axis=1)
+    information_content = numpy.where(
+        non_gap > 0, numpy.log2(len(AMINO_ACIDS)) - entropy, 0.0)
+    total = weights.sum()
+    freqgap = gaps / total if total > 0 else numpy.zeros(len(columns))
+    return information_content, freqgap
+
+
+def format_values(values: numpy.ndarray) -> typing.List[str]:
+    return [f"{value:.5f}" for value in values]
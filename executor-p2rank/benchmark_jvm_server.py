@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Measure latency of P2Rank and java-tools stages executed as one-shot
+# processes and using the JVM server, see jvm_server.py .
+#
+import argparse
+import os
+import subprocess
+import time
+import typing
+
+import jvm_server
+
+
+def _read_arguments() -> typing.Dict[str, str]:
+    this_directory = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Benchmark stages with and without the JVM server.")
+    parser.add_argument(
+        "--structure", required=True,
+        help="Structure file to use.")
+    parser.add_argument(
+        "--working", required=True,
+        help="Directory for output files.")
+    parser.add_argument(
+        "--repeat", type=int, default=5,
+        help="Number of executions for each stage.")
+    parser.add_argument(
+        "--p2rank", default=os.path.join(this_directory, "p2rank.sh"),
+        help="Path to executable p2rank script.")
+    parser.add_argument(
+        "--java-tools", default=os.environ.get("JAVA_TOOLS_CMD", None),
+        help="Path to executable java-tools script.")
+    return vars(parser.parse_args())
+
+
+def main(arguments):
+    if jvm_server.SOCKET_PATH is None:
+        print("JVM_SERVER_SOCKET is not set, only one-shot is measured.")
+    structure = os.path.abspath(arguments["structure"])
+    working = os.path.abspath(arguments["working"])
+    stages = [
+        ("fasta-masked", "p2rank", [
+            "analyze", "fasta-masked", "-f", structure,
+            "-o", os.path.join(working, "fasta")]),
+        ("predict", "p2rank", [
+            "predict", "-c", "default", "-threads", "1", "-f", structure,
+            "-o", os.path.join(working, "p2rank-output"),
+            "-log_to_console", "1"]),
+        ("structure-info", "java-tools", [
+            "structure-info", f"--input={structure}",
+            f"--output={os.path.join(working, 'structure-info.json')}"]),
+    ]
+    executables = {
+        "p2rank": arguments["p2rank"],
+        "java-tools": arguments["java_tools"],
+    }
+    print("stage\tone-shot mean [s]\tserver mean [s]")
+    for name, tool, stage_arguments in stages:
+        one_shot = _measure(arguments["repeat"], lambda: subprocess.run(
+            [executables[tool], *stage_arguments],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            check=True))
+        server = _measure(arguments["repeat"], lambda: _execute_on_server(
+            tool, stage_arguments))
+        print(f"{name}\t{_format(one_shot)}\t{_format(server)}")
+
+
+def _measure(repeat: int, action: typing.Callable) \
+        -> typing.Optional[typing.List[float]]:
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if action() is None:
+            return None
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def _execute_on_server(tool: str, arguments: typing.List[str]):
+    exit_code = jvm_server.execute(tool, arguments)
+    if exit_code is None:
+        return None
+    if exit_code != 0:
+        raise RuntimeError(f"Command failed with exit code {exit_code}.")
+    return exit_code
+
+
+def _format(values: typing.Optional[typing.List[float]]) -> str:
+    if values is None:
+        return "-"
+    return f"{sum(values) / len(values):.3f}"
+
+
+if __name__ == "__main__":
+    main(_read_arguments())
@@ -0,0 +1,32 @@
+#!/bin/bash
+#
+# Start prediction workers for the interactive and bulk lanes.
+#
+# The shared worker consumes both lanes, so either lane can use all its
+# slots. The interactive worker consumes only the interactive lane, so
+# user predictions get a slot even when the bulk lane is full. Both
+# workers share the CPU budget, so an idle interactive worker does not
+# take CPUs from bulk predictions.
+#
+
+# Only the shared worker exposes metrics, the metrics of both are
+# collected using PROMETHEUS_MULTIPROC_DIR. Metrics of previous runs are
+# removed here, before any of the workers writes to the directory.
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+celery --app=celery_p2rank worker \
+  --queues=p2rank-interactive,p2rank \
+  --concurrency="${WORKER_CONCURRENCY:-4}" \
+  --hostname=executor-p2rank &
+
+env -u METRICS_PORT celery --app=celery_p2rank worker \
+  --queues=p2rank-interactive \
+  --concurrency="${INTERACTIVE_CONCURRENCY:-1}" \
+  --hostname=executor-p2rank-interactive &
+
+# Exit when any of the workers exits, so the container is restarted.
+wait -n
+exit $?
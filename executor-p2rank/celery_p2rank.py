@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 from contextlib import contextmanager
-from datetime import datetime
 import os
-import json
+import uuid
 
 import celery.signals
+import instrumentation
 import run_p2rank_task
+import single_flight
 
 prankweb = celery.Celery("prankweb")
 
@@ -27,6 +28,16 @@ elif "CELERY_BROKER_PATH" in os.environ:
     })
 
 
+prankweb.conf.update({
+    # Acknowledge the task after the execution, so the task is delivered
+    # again when the worker is killed. The execution is resumed from
+    # the checkpoints.
+    "task_acks_late": True,
+    "task_reject_on_worker_lost": True,
+    "worker_prefetch_multiplier": 1,
+})
+
+
 @celery.signals.setup_logging.connect
 def setup_celery_logging(**kwargs):
     # We do nothing here to disable logging.
@@ -37,35 +48,105 @@ def setup_celery_logging(**kwargs):
 prankweb.log.setup()
 
 
-@prankweb.task(name="prediction")
-def celery_run_prediction(directory: str):
+@celery.signals.worker_init.connect
+def start_metrics_server(**kwargs):
+    # Started in the main process, the metrics are collected from all
+    # pool processes.
+    if "METRICS_PORT" in os.environ:
+        instrumentation.start_metrics_server(int(os.environ["METRICS_PORT"]))
+
+
+# Queues of the lanes, the web-server selects the lane for each task.
+LANE_QUEUES = {
+    "interactive": "p2rank-interactive",
+    "bulk": "p2rank",
+}
+
+# Delay before a task executed by another worker is checked again.
+RETRY_SECONDS = int(os.environ.get("TASK_RETRY_SECONDS", 60))
+
+
+def prediction_task_id(directory: str, created: str) -> str:
+    """Return task identifier derived from the prediction, keep in sync
+    with web-server/src/celery_client.py ."""
+    name = os.path.normpath(directory) + "#" + created
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+
+@prankweb.task(name="prediction", bind=True, max_retries=None)
+def celery_run_prediction(self, directory: str):
+    directory = os.path.normpath(directory)
+    if not os.path.isdir(directory):
+        print(f"Given directory does not exist {directory}")
+        return
+    if run_p2rank_task.is_directory_task_finished(directory):
+        print(f"Task is already finished {directory} ({self.request.id})")
+        return
+    # The same task can be delivered more than once, only one worker
+    # executes it. The other deliveries are retried, so the task is
+    # executed again should the worker die.
+    if run_p2rank_task.is_directory_task_alive(directory):
+        print(f"Task is already running {directory} ({self.request.id})")
+        raise self.retry(countdown=RETRY_SECONDS)
+    with execution_lock_file(directory) as claimed:
+        if not claimed:
+            print(f"Task is already claimed {directory} ({self.request.id})")
+            raise self.retry(countdown=RETRY_SECONDS)
+        if run_p2rank_task.is_directory_task_finished(directory):
+            print(f"Task is already finished {directory} ({self.request.id})")
+            return
+        queue = self.request.delivery_info.get(
+            "routing_key", LANE_QUEUES["bulk"])
+        _observe_queue_wait(directory, queue)
+        # Used by the watchdog to queue the task again.
+        run_p2rank_task.save_task_queue(directory, queue)
+        run_p2rank_task.execute_directory_task(
+            directory, keep_working=False)
+
+
+def _observe_queue_wait(directory: str, queue: str):
+    lane = "bulk"
+    for name, lane_queue in LANE_QUEUES.items():
+        if lane_queue == queue:
+            lane = name
+    seconds = run_p2rank_task.queued_seconds(directory)
+    if seconds is not None:
+        instrumentation.observe_queue_wait(lane, seconds)
+
+
+@prankweb.task(name="prefetch")
+def celery_run_prefetch(directory: str):
     directory = os.path.normpath(directory)
     if os.path.isdir(directory):
-        with execution_lock_file(directory):
-            run_p2rank_task.execute_directory_task(
-                directory, keep_working=False)
+        run_p2rank_task.prefetch_directory_task(directory)
     else:
         print(f"Given directory does not exist {directory}")
 
 
 @contextmanager
 def execution_lock_file(task_directory: str):
-    """Create a lock file that is removed after execution is finished."""
-    lock_file = None
+    """Claim the task using a lock file that is removed after execution
+    is finished. Yield False if the task is claimed by another worker.
+    Lock of a killed worker is removed once it is stale."""
+    with single_flight.exclusive(_execution_lock_file(task_directory)) \
+            as claimed:
+        yield claimed
+
+
+def break_execution_lock(task_directory: str, max_age: float) -> bool:
+    """Remove claim of a task whose worker is dead, so the task can be
+    claimed when queued again. Return False if the claim was touched
+    in given time."""
+    return single_flight.break_lock(
+        _execution_lock_file(task_directory), max_age)
+
+
+def _execution_lock_file(task_directory: str) -> str:
+    task_directory = os.path.normpath(task_directory)
     if "LOCK_DIRECTORY" in os.environ:
         lock_directory = os.environ["LOCK_DIRECTORY"]
         os.makedirs(lock_directory, exist_ok=True)
-        lock_file = os.path.join(
+        return os.path.join(
             lock_directory,
             task_directory.replace(os.sep, "_"))
-    if lock_file is not None:
-        with open(lock_file, "w") as stream:
-            json.dump({
-                "start": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-                "directory": task_directory
-            }, stream)
-    try:
-        yield
-    finally:
-        if lock_file is not None:
-            os.remove(lock_file)
+    return os.path.join(task_directory, "execution.lock")
@@ -5,10 +5,11 @@
 import hashlib
 import json
 import os
-import collections
 import typing
 import logging
 
+import conservation_store
+
 
 def create_hom_from_cache(
         cache_directory: typing.Optional[str],
@@ -29,6 +30,16 @@ def create_hom_from_cache(
     return True
 
 
+def is_in_cache(
+        cache_directory: typing.Optional[str], fasta_file: str) -> bool:
+    if cache_directory is None:
+        return False
+    sequences = _load_fasta_file(fasta_file)
+    if len(sequences) != 1:
+        return False
+    return load_from_cache(cache_directory, sequences[0][1]) is not None
+
+
 def _load_fasta_file(input_file: str) \
         -> typing.List[typing.Tuple[str, str]]:
     header = None
@@ -54,6 +65,11 @@ def _load_fasta_file(input_file: str) \
 def load_from_cache(cache_directory: str, sequence: str):
     if cache_directory is None:
         return None
+    conservation = conservation_store.get(cache_directory, sequence)
+    if conservation is not None:
+        return conservation
+    # Fallback for cache directories not yet migrated to the store,
+    # see administration/migrate_conservation_cache.py .
     group_hash = _hash_sequence(sequence)
     return _read_sequence_from_cache_file(cache_directory, group_hash, sequence)
 
@@ -106,18 +122,18 @@ def create_conservation_from_hom_file(path: str) -> typing.Dict:
     }
 
 
-def add_to_cache(cache_directory: str, items: typing.List):
-    grouped_by_hash = collections.defaultdict(list)
-    for item in items:
-        grouped_by_hash[_hash_sequence(item["sequence"])].append(item)
-    for group_hash, items in grouped_by_hash.items():
-        content = _read_cache_file(cache_directory, group_hash)
-        # Add only new one.
-        sequences = {item["sequence"] for item in content}
-        content.extend([
-            item for item in items
-            if item["sequence"] not in sequences])
-        write_cache_file(cache_directory, group_hash, content)
+def add_to_cache(cache_directory: str, items: typing.List) -> int:
+    """Add items to the cache store, return number of new items."""
+    return conservation_store.put_many(cache_directory, items)
+
+
+def read_legacy_cache_directory(cache_directory: str) -> typing.Iterator:
+    """Yield all items stored in the per-hash JSONL files."""
+    for file_name in sorted(os.listdir(cache_directory)):
+        if not file_name.endswith(".jsonl"):
+            continue
+        group_hash = file_name[:-len(".jsonl")]
+        yield from _read_cache_file(cache_directory, group_hash)
 
 
 def _read_cache_file(cache_directory: str, group_hash: str):
@@ -129,14 +145,3 @@ def _read_cache_file(cache_directory: str, group_hash: str):
             json.loads(line)
             for line in stream
         ]
-
-
-def write_cache_file(cache_directory: str, group_hash: str, content):
-    os.makedirs(cache_directory, exist_ok=True)
-    path = os.path.join(cache_directory, group_hash + ".jsonl")
-    swap_path = path + ".swp"
-    with open(swap_path, "w", encoding="utf-8") as stream:
-        for record in content:
-            json.dump(record, stream, ensure_ascii=False)
-            stream.write("\n")
-    os.replace(swap_path, path)
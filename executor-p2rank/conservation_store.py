@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+#
+# Single-file conservation store used by the conservation cache.
+#
+# The store consists of three files in the cache directory:
+#   conservation.data  - append-only file with encoded records
+#   conservation.index - open-addressing hash table, can be memory-mapped
+#   conservation.lock  - used to serialize writers
+#
+# The index is keyed by MD5 of the sequence and points to a record in
+# the data file. A record contains the sequence and the scores, so the
+# lookup can verify the sequence before using the scores.
+#
+import array
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+import typing
+
+DATA_FILE = "conservation.data"
+
+INDEX_FILE = "conservation.index"
+
+LOCK_FILE = "conservation.lock"
+
+_INDEX_MAGIC = b"PWCIDX01"
+
+# magic, capacity, count
+_INDEX_HEADER = struct.Struct("<8sQQ8x")
+
+# digest, offset, length
+_INDEX_SLOT = struct.Struct("<16sQI4x")
+
+_INITIAL_CAPACITY = 1024
+
+# Resize the index once it is more than half full.
+_MAX_LOAD_FACTOR = 0.5
+
+# encoding, sequence length
+_RECORD_HEADER = struct.Struct("<BI")
+
+# Scores are stored as int32 with the number of decimal places in the
+# lowest four bits, so "-1000.0" is stored as (-10000 << 4) | 1.
+_ENCODING_PACKED = 1
+
+# Fallback for scores we can not pack without change in the text form.
+_ENCODING_TEXT = 2
+
+_PACKED_SCORE_PATTERN = re.compile(r"^-?\d+(\.\d{1,15})?$")
+
+_EMPTY_DIGEST = bytes(16)
+
+
+def exists(cache_directory: str) -> bool:
+    return os.path.exists(os.path.join(cache_directory, INDEX_FILE))
+
+
+def digest_sequence(sequence: str) -> bytes:
+    return hashlib.md5(sequence.encode("ascii")).digest()
+
+
+def get(cache_directory: str, sequence: str) \
+        -> typing.Optional[typing.Dict]:
+    """Return conservation for given sequence or None."""
+    index_path = os.path.join(cache_directory, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    digest = digest_sequence(sequence)
+    with open(index_path, "rb") as stream, \
+            mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as index:
+        slot = _find_slot(index, digest)
+        if slot is None:
+            return None
+        _, offset, length = _INDEX_SLOT.unpack_from(index, slot)
+    try:
+        record = read_record(cache_directory, offset, length)
+    except (struct.error, ValueError, UnicodeDecodeError):
+        # The slot may be written, while the record is not yet visible.
+        return None
+    if record["sequence"] != sequence:
+        # MD5 collision, we keep only the first sequence.
+        return None
+    return record
+
+
+def put_many(cache_directory: str, items: typing.Iterable[typing.Dict]) -> int:
+    """Add records that are not in the store, return number of added."""
+    os.makedirs(cache_directory, exist_ok=True)
+    added = 0
+    with _writer_lock(cache_directory):
+        index = _IndexWriter(cache_directory)
+        try:
+            with open(os.path.join(cache_directory, DATA_FILE), "ab") \
+                    as data_stream:
+                for item in items:
+                    digest = digest_sequence(item["sequence"])
+                    if index.contains(digest):
+                        continue
+                    content = _encode_record(item["sequence"], item["score"])
+                    offset = data_stream.tell()
+                    data_stream.write(content)
+                    # Data must be in the file before the index points to it.
+                    data_stream.flush()
+                    index.insert(digest, offset, len(content))
+                    added += 1
+        finally:
+            index.close()
+    return added
+
+
+@contextlib.contextmanager
+def _writer_lock(cache_directory: str):
+    with open(os.path.join(cache_directory, LOCK_FILE), "a") as stream:
+        fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+
+
+# region Index
+
+def _find_slot(index, digest: bytes) -> typing.Optional[int]:
+    """Return position of the slot with given digest or None."""
+    magic, capacity, _ = _INDEX_HEADER.unpack_from(index, 0)
+    if magic != _INDEX_MAGIC:
+        raise ValueError("Invalid conservation index file.")
+    for position in _probe(digest, capacity):
+        slot_digest = index[position:position + 16]
+        if slot_digest == digest:
+            return position
+        if slot_digest == _EMPTY_DIGEST:
+            return None
+    return None
+
+
+def _probe(digest: bytes, capacity: int) -> typing.Iterator[int]:
+    """Linear probing, yield positions of slots to check."""
+    start = int.from_bytes(digest[:8], "little") & (capacity - 1)
+    for step in range(capacity):
+        slot = (start + step) & (capacity - 1)
+        yield _INDEX_HEADER.size + slot * _INDEX_SLOT.size
+
+
+class _IndexWriter:
+    """Must be used only while holding the writer lock."""
+
+    def __init__(self, cache_directory: str):
+        self.path = os.path.join(cache_directory, INDEX_FILE)
+        if not os.path.exists(self.path):
+            _create_index_file(self.path, _INITIAL_CAPACITY, [])
+        self._open()
+
+    def _open(self):
+        self.stream = open(self.path, "r+b")
+        self.index = mmap.mmap(self.stream.fileno(), 0)
+        _, self.capacity, self.count = \
+            _INDEX_HEADER.unpack_from(self.index, 0)
+
+    def close(self):
+        self.index.flush()
+        self.index.close()
+        self.stream.close()
+
+    def contains(self, digest: bytes) -> bool:
+        return _find_slot(self.index, digest) is not None
+
+    def insert(self, digest: bytes, offset: int, length: int):
+        if (self.count + 1) > self.capacity * _MAX_LOAD_FACTOR:
+            self._resize(self.capacity * 2)
+        for position in _probe(digest, self.capacity):
+            if self.index[position:position + 16] != _EMPTY_DIGEST:
+                continue
+            # Write the pointer first, the digest makes the slot visible.
+            _INDEX_SLOT.pack_into(
+                self.index, position, _EMPTY_DIGEST, offset, length)
+            self.index[position:position + 16] = digest
+            self.count += 1
+            _INDEX_HEADER.pack_into(
+                self.index, 0, _INDEX_MAGIC, self.capacity, self.count)
+            return
+        raise RuntimeError("Conservation index is full.")
+
+    def _resize(self, capacity: int):
+        slots = [
+            _INDEX_SLOT.unpack_from(self.index, position)
+            for position in range(
+                _INDEX_HEADER.size,
+                _INDEX_HEADER.size + self.capacity * _INDEX_SLOT.size,
+                _INDEX_SLOT.size)
+        ]
+        self.close()
+        # Readers with the old file opened keep using the old content.
+        swap_path = self.path + ".swp"
+        _create_index_file(
+            swap_path, capacity,
+            [slot for slot in slots if slot[0] != _EMPTY_DIGEST])
+        os.replace(swap_path, self.path)
+        self._open()
+
+
+def _create_index_file(path: str, capacity: int, slots: typing.List):
+    content = bytearray(_INDEX_HEADER.size + capacity * _INDEX_SLOT.size)
+    _INDEX_HEADER.pack_into(content, 0, _INDEX_MAGIC, capacity, len(slots))
+    for digest, offset, length in slots:
+        for position in _probe(digest, capacity):
+            if content[position:position + 16] == _EMPTY_DIGEST:
+                _INDEX_SLOT.pack_into(content, position, digest, offset, length)
+                break
+    with open(path, "wb") as stream:
+        stream.write(content)
+
+
+def iterate_index(cache_directory: str) \
+        -> typing.Iterator[typing.Tuple[bytes, int, int]]:
+    """Yield (digest, offset, length) for all records in the index."""
+    with open(os.path.join(cache_directory, INDEX_FILE), "rb") as stream, \
+            mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as index:
+        _, capacity, _ = _INDEX_HEADER.unpack_from(index, 0)
+        for slot in range(capacity):
+            position = _INDEX_HEADER.size + slot * _INDEX_SLOT.size
+            digest, offset, length = _INDEX_SLOT.unpack_from(index, position)
+            if digest != _EMPTY_DIGEST:
+                yield digest, offset, length
+
+
+# endregion
+
+# region Records
+
+def _encode_record(sequence: str, scores: typing.List[str]) -> bytes:
+    sequence_bytes = sequence.encode("ascii")
+    packed = _pack_scores(scores)
+    if packed is not None:
+        return _RECORD_HEADER.pack(_ENCODING_PACKED, len(sequence_bytes)) + \
+            sequence_bytes + packed
+    return _RECORD_HEADER.pack(_ENCODING_TEXT, len(sequence_bytes)) + \
+        sequence_bytes + "\t".join(scores).encode("utf-8")
+
+
+def _decode_record(content: bytes) -> typing.Dict:
+    encoding, sequence_length = _RECORD_HEADER.unpack_from(content, 0)
+    start = _RECORD_HEADER.size
+    sequence = content[start:start + sequence_length].decode("ascii")
+    payload = content[start + sequence_length:]
+    if encoding == _ENCODING_PACKED:
+        score = _unpack_scores(payload)
+    elif encoding == _ENCODING_TEXT:
+        score = payload.decode("utf-8").split("\t") if payload else []
+    else:
+        raise ValueError(f"Unknown record encoding: {encoding}")
+    return {
+        "sequence": sequence,
+        "score": score,
+    }
+
+
+def _pack_scores(scores: typing.List[str]) -> typing.Optional[bytes]:
+    """Return packed scores or None if they can not be packed exactly."""
+    values = array.array("i")
+    for score in scores:
+        value = _pack_score(score)
+        if value is None:
+            return None
+        values.append(value)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _pack_score(score: str) -> typing.Optional[int]:
+    if not _PACKED_SCORE_PATTERN.match(score):
+        return None
+    if "." in score:
+        decimals = len(score) - score.index(".") - 1
+    else:
+        decimals = 0
+    mantissa = int(score.replace(".", ""))
+    if not -(1 << 27) <= mantissa < (1 << 27):
+        return None
+    value = (mantissa << 4) | decimals
+    # Leading zeros, "-0.0" and similar do not survive the round trip.
+    if _unpack_score(value) != score:
+        return None
+    return value
+
+
+def _unpack_scores(payload: bytes) -> typing.List[str]:
+    values = array.array("i")
+    values.frombytes(payload)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return [_unpack_score(value) for value in values]
+
+
+def _unpack_score(value: int) -> str:
+    decimals = value & 0xF
+    mantissa = value >> 4
+    if decimals == 0:
+        return str(mantissa)
+    sign = "-" if mantissa < 0 else ""
+    digits = str(abs(mantissa)).rjust(decimals + 1, "0")
+    return f"{sign}{digits[:-decimals]}.{digits[-decimals:]}"
+
+
+def read_record(cache_directory: str, offset: int, length: int) \
+        -> typing.Dict:
+    with open(os.path.join(cache_directory, DATA_FILE), "rb") as stream:
+        return _decode_record(os.pread(stream.fileno(), length, offset))
+
+# endregion
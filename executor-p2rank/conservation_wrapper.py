@@ -3,14 +3,32 @@
 # Wrap conservation pipeline to provide simple API.
 #
 
+import concurrent.futures
+import hashlib
 import os
+import shutil
 import typing
+import logging
 
-from conservation_cache import create_hom_from_cache, update_cache_from_hom_file
+from conservation_cache import create_hom_from_cache, \
+    update_cache_from_hom_file, is_in_cache
 from conservation_hmm_based import \
-    compute_conservation as compute_hmm_conservation
+    compute_conservation as compute_hmm_conservation, generate_msa_batch, \
+    HMM_IC_ENGINE
 from conservation_alignment_based import \
     compute_conservation as compute_alignment_conservation, Configuration
+from memory_cache import LruCache
+import search_service
+import single_flight
+
+logger = logging.getLogger("prankweb.conservation")
+logger.setLevel(logging.DEBUG)
+
+# Worker-wide cache in front of the conservation cache and computation,
+# the key is a conservation type and a sequence.
+_memory_cache = LruCache(
+    int(os.environ.get("CONSERVATION_MEMORY_CACHE_SIZE", 1024)),
+    int(os.environ.get("CONSERVATION_MEMORY_CACHE_BYTES", 64 * 1024 * 1024)))
 
 
 def compute_hmm_based_conservation(
@@ -18,18 +36,102 @@ def compute_hmm_based_conservation(
         working_dir: str,
         output_file: str,
         execute_command: typing.Callable[[str], None]):
-    cache_directory = os.environ.get("HMM_CONSERVATION_CACHE", None)
-    if create_hom_from_cache(cache_directory, fasta_file, output_file):
+    key = (_hmm_conservation_type(), _read_sequence(fasta_file))
+    if _create_hom_from_memory(key, output_file):
         return
-    compute_hmm_conservation(
-        fasta_file,
-        os.environ.get("HMM_SEQUENCE_FILE", None),
-        working_dir,
-        output_file,
-        execute_command,
-        True,
-        1000)
-    update_cache_from_hom_file(cache_directory, output_file)
+    cache_directory = _hmm_cache_directory()
+
+    def compute():
+        compute_hmm_conservation(
+            fasta_file,
+            os.environ.get("HMM_SEQUENCE_FILE", None),
+            working_dir,
+            output_file,
+            execute_command,
+            True,
+            1000,
+            execute_phmmer=search_service.execute_phmmer)
+        update_cache_from_hom_file(cache_directory, output_file)
+
+    _compute_once(cache_directory, key, fasta_file, output_file, compute)
+    _add_to_memory(key, output_file)
+
+
+def compute_hmm_based_conservation_batch(
+        fasta_files: typing.List[str],
+        working_dir: str,
+        execute_command: typing.Callable[[str], None],
+        workers: int = 1) -> int:
+    """Compute conservation for sequences not in the cache using a single
+    search in the sequence database. The results are stored in the cache,
+    so compute_hmm_based_conservation only loads them.
+    Return number of computed sequences."""
+    cache_directory = _hmm_cache_directory()
+    if cache_directory is None:
+        logger.warning(
+            "Batch conservation requires HMM_CONSERVATION_CACHE, skipping.")
+        return 0
+    pending = {}
+    for fasta_file in fasta_files:
+        sequence = _read_sequence(fasta_file)
+        if sequence in pending or is_in_cache(cache_directory, fasta_file):
+            continue
+        pending[sequence] = fasta_file
+    if not pending:
+        return 0
+    logger.info(f"Computing batch conservation for {len(pending)} sequences.")
+    os.makedirs(working_dir, exist_ok=True)
+    database_file = os.environ.get("HMM_SEQUENCE_FILE", None)
+    pending_files = list(pending.values())
+    msa_files = generate_msa_batch(
+        pending_files, database_file, working_dir, execute_command)
+
+    def compute(index: int, fasta_file: str):
+        directory = os.path.join(working_dir, f"conservation-{index}")
+        os.makedirs(directory, exist_ok=True)
+        output_file = os.path.join(directory, "conservation")
+        compute_hmm_conservation(
+            fasta_file,
+            database_file,
+            directory,
+            output_file,
+            execute_command,
+            True,
+            1000,
+            execute_phmmer=_use_msa_file(msa_files[fasta_file]))
+        update_cache_from_hom_file(cache_directory, output_file)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, workers)) as pool:
+        # Consume the results to propagate exceptions.
+        list(pool.map(compute, range(len(pending_files)), pending_files))
+    return len(pending_files)
+
+
+def _hmm_conservation_type() -> str:
+    # The validate engine produces values of the HMMER engine.
+    if HMM_IC_ENGINE == "native":
+        return "hmm-native"
+    return "hmm"
+
+
+def _hmm_cache_directory() -> typing.Optional[str]:
+    """The native engine produces different values, so it must not share
+    the cache with the HMMER engine."""
+    cache_directory = os.environ.get("HMM_CONSERVATION_CACHE", None)
+    if cache_directory is None or HMM_IC_ENGINE != "native":
+        return cache_directory
+    return os.path.join(cache_directory, "native")
+
+
+def _use_msa_file(msa_file: str) -> typing.Callable[[str, str, str], bool]:
+    """Return phmmer replacement that provides already computed MSA."""
+
+    def execute_phmmer(fasta_file: str, database_file: str, output_file: str):
+        shutil.move(msa_file, output_file)
+        return True
+
+    return execute_phmmer
 
 
 def compute_alignment_based_conservation(
@@ -37,15 +139,71 @@ def compute_alignment_based_conservation(
         working_dir: str,
         output_file: str,
         execute_command: typing.Callable[[str], None]):
+    key = ("alignment", _read_sequence(fasta_file))
+    if _create_hom_from_memory(key, output_file):
+        return
     cache_directory = os.environ.get("ALIGNMENT_CONSERVATION_CACHE", None)
-    if create_hom_from_cache(cache_directory, fasta_file, output_file):
+
+    def compute():
+        configuration = Configuration()
+        configuration.execute_command = execute_command
+        configuration.blast_databases = ["swissprot", "uniref50", "uniref90"]
+        configuration.search_psiblast = search_service.execute_psiblast
+        compute_alignment_conservation(
+            fasta_file,
+            working_dir,
+            output_file,
+            configuration)
+        update_cache_from_hom_file(cache_directory, output_file)
+
+    _compute_once(cache_directory, key, fasta_file, output_file, compute)
+    _add_to_memory(key, output_file)
+
+
+def _compute_once(
+        cache_directory: typing.Optional[str], key,
+        fasta_file: str, output_file: str,
+        compute: typing.Callable[[], None]):
+    """Load from the cache or compute, with the cache directory shared by
+    workers only one of them computes conservation for given sequence."""
+    if cache_directory is None:
+        lock_directory = None
+    else:
+        lock_directory = os.path.join(cache_directory, "locks")
+    conservation_type, sequence = key
+    lock_name = conservation_type + "-" + \
+        hashlib.md5(sequence.encode("utf-8")).hexdigest()
+    single_flight.run_once(
+        lock_directory, lock_name,
+        lambda: create_hom_from_cache(cache_directory, fasta_file, output_file),
+        compute)
+
+
+def _read_sequence(fasta_file: str) -> str:
+    """Return content of the FASTA file without the header."""
+    with open(fasta_file) as stream:
+        stream.readline()
+        return stream.read()
+
+
+def _create_hom_from_memory(key, output_file: str) -> bool:
+    content = _memory_cache.get(key)
+    if content is None:
+        return False
+    logger.info(
+        "Using conservation from memory cache %s.",
+        _memory_cache.statistics())
+    with open(output_file, "wb") as stream:
+        stream.write(content)
+    return True
+
+
+def _add_to_memory(key, output_file: str):
+    if not os.path.exists(output_file):
         return
-    configuration = Configuration()
-    configuration.execute_command = execute_command
-    configuration.blast_databases = ["swissprot", "uniref50", "uniref90"]
-    compute_alignment_conservation(
-        fasta_file,
-        working_dir,
-        output_file,
-        configuration)
-    update_cache_from_hom_file(cache_directory, output_file)
+    with open(output_file, "rb") as stream:
+        _memory_cache.put(key, stream.read())
+
+
+def memory_cache_statistics() -> typing.Dict[str, int]:
+    return _memory_cache.statistics()
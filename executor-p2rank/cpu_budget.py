@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+#
+# Share CPUs of a node among the tasks executed on it.
+#
+# Every running task holds one CPU. When a stage can use more threads,
+# e.g. P2Rank predict or conservation, it asks for an allocation. The
+# allocation is limited by CPUs not held by other tasks. As Celery
+# workers run tasks in separate processes, the allocations are stored
+# in a file shared by all processes on the node.
+#
+import contextlib
+import fcntl
+import gzip
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import typing
+
+logger = logging.getLogger("prankweb.cpu_budget")
+logger.setLevel(logging.DEBUG)
+
+# Number of CPUs shared by all tasks on the node.
+CPU_BUDGET = max(1, int(os.environ.get("CPU_BUDGET", os.cpu_count() or 1)))
+
+# File with allocations, must be shared by all workers on the node.
+CPU_BUDGET_FILE = os.environ.get(
+    "CPU_BUDGET_FILE",
+    os.path.join(tempfile.gettempdir(), "prankweb-cpu-budget.json"))
+
+# Upper limit for a single P2Rank execution.
+P2RANK_MAX_THREADS = int(os.environ.get("P2RANK_MAX_THREADS", CPU_BUDGET))
+
+# Structures smaller than this get one thread, larger get one thread
+# for each this many atoms.
+ATOMS_PER_THREAD = int(os.environ.get("P2RANK_ATOMS_PER_THREAD", 10000))
+
+# Allocation held by a running task between the stages.
+_TASK_THREADS = 1
+
+
+def _owner() -> str:
+    return f"{os.getpid()}-{threading.get_ident()}"
+
+
+@contextlib.contextmanager
+def task():
+    """Register a running task for the current thread."""
+    owner = _owner()
+    _update(lambda allocations: allocations.__setitem__(owner, _TASK_THREADS))
+    try:
+        yield
+    finally:
+        _update(lambda allocations: allocations.pop(owner, None))
+
+
+@contextlib.contextmanager
+def allocate(stage: str, wanted: int) -> typing.Iterator[int]:
+    """Allocate up to given number of threads, yield the number of
+    allocated threads which is at least one."""
+    owner = _owner()
+    previous = None
+    allocation = {}
+
+    def acquire(allocations: typing.Dict[str, int]):
+        nonlocal previous
+        previous = allocations.get(owner, None)
+        others = {key: value for key, value in allocations.items()
+                  if key != owner}
+        free = CPU_BUDGET - sum(others.values())
+        allocation["threads"] = max(1, min(wanted, free))
+        allocation["tasks"] = len(others) + 1
+        allocation["free"] = free
+        allocations[owner] = allocation["threads"]
+
+    def release(allocations: typing.Dict[str, int]):
+        if previous is None:
+            allocations.pop(owner, None)
+        else:
+            allocations[owner] = previous
+
+    _update(acquire)
+    threads = allocation["threads"]
+    logger.info(
+        f"CPU allocation for '{stage}': {threads} threads, "
+        f"wanted {wanted}, free {allocation['free']} of {CPU_BUDGET}, "
+        f"tasks in flight {allocation['tasks']}.")
+    try:
+        yield threads
+    finally:
+        _update(release)
+
+
+def _update(action: typing.Callable[[typing.Dict[str, int]], None]):
+    """Load allocations, drop allocations of terminated processes,
+    apply the action and save the allocations."""
+    try:
+        with open(CPU_BUDGET_FILE + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            allocations = {
+                key: value for key, value in _load().items()
+                if _is_alive(int(key.split("-")[0]))
+            }
+            action(allocations)
+            _save(allocations)
+    except OSError:
+        # Without the file we can't coordinate, so we act as the only task.
+        logger.warning("Can't update CPU allocations.", exc_info=True)
+        action({})
+
+
+def _load() -> typing.Dict[str, int]:
+    try:
+        with open(CPU_BUDGET_FILE, encoding="utf-8") as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(allocations: typing.Dict[str, int]):
+    path_swp = CPU_BUDGET_FILE + ".swp"
+    with open(path_swp, "w", encoding="utf-8") as stream:
+        json.dump(allocations, stream)
+    os.replace(path_swp, CPU_BUDGET_FILE)
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def p2rank_threads(structure_file: str) -> int:
+    """Number of threads P2Rank can use for given structure."""
+    atoms = count_atoms(structure_file)
+    wanted = max(1, math.ceil(atoms / ATOMS_PER_THREAD))
+    logger.info(f"Structure has {atoms} atoms, asking for {wanted} threads.")
+    return min(wanted, max(1, P2RANK_MAX_THREADS))
+
+
+def count_atoms(structure_file: str) -> int:
+    """Count ATOM and HETATM records in PDB or mmCIF file."""
+    open_file = gzip.open if structure_file.endswith(".gz") else open
+    count = 0
+    with open_file(structure_file, "rb") as stream:
+        for line in stream:
+            if line.startswith(b"ATOM") or line.startswith(b"HETATM"):
+                count += 1
+    return count
@@ -2,14 +2,26 @@
 #
 # Given a configuration executes p2rank and all components.
 #
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import dataclasses
 import json
 import os
 import logging
-import requests
+import resource
+import shlex
 import shutil
 import subprocess
+import time
 
 import conservation_wrapper
+import cpu_budget
+import instrumentation
+import jvm_server
+import stage_store
+import structure_cache
 from model import *
 from output_prankweb import prepare_output_prankweb
 from output_p2rank import prepare_output_p2rank
@@ -17,23 +29,136 @@ from output_p2rank import prepare_output_p2rank
 logger = logging.getLogger("prankweb.executor")
 logger.setLevel(logging.DEBUG)
 
+PDB_DOWNLOAD_URL = os.environ.get(
+    "PDB_DOWNLOAD_URL", "https://files.rcsb.org/download")
+
+ALPHAFOLD_API_URL = os.environ.get(
+    "ALPHAFOLD_API_URL", "https://alphafold.ebi.ac.uk/api")
+
+# Execution whose stage is running in execute_batch, None for stages
+# shared by all executions of the batch. Used to route logs to tasks.
+current_execution: contextvars.ContextVar[typing.Optional[Execution]] = \
+    contextvars.ContextVar("current_execution", default=None)
+
 
 def execute(configuration: Execution) -> ExecutionResult:
     # TODO Add configuration validation ...
 
+    checkpoint = _load_checkpoint(configuration, "output")
+    if checkpoint is not None:
+        return ExecutionResult(**checkpoint)
+    recorder = configuration.recorder
+    with cpu_budget.task():
+        structure, conservation, p2rank_input = \
+            _prepare_prediction(configuration)
+        p2rank_output = _p2rank_output_directory(configuration)
+        if _load_checkpoint(configuration, "p2rank") is None:
+            # Remove output of an interrupted execution.
+            shutil.rmtree(p2rank_output, ignore_errors=True)
+            with recorder.stage("p2rank"):
+                _execute_p2rank(p2rank_input, p2rank_output, configuration)
+            _save_checkpoint(configuration, "p2rank")
+    with recorder.stage("output"):
+        result = _prepare_output(
+            p2rank_output, structure, conservation, configuration)
+    _save_checkpoint(configuration, "output", dataclasses.asdict(result))
+    logger.info("All done")
+    return result
+
+
+def execute_batch(
+        configurations: typing.List[Execution], working_directory: str,
+        threads: int) -> typing.List[typing.Union[ExecutionResult, Exception]]:
+    """Execute predictions using a single P2Rank run for each P2Rank
+    executable and configuration. Return result or exception for each
+    configuration, so a failure affects only a single prediction.
+    While a stage of a single prediction runs, current_execution is set
+    to its configuration."""
+    results = [None] * len(configurations)
+    prepared = {}
+    for index, configuration in enumerate(configurations):
+        with _current_execution(configuration):
+            try:
+                prepared[index] = _prepare_prediction(configuration)
+            except Exception as error:
+                logger.exception(
+                    f"Preparation of prediction {index} failed.")
+                results[index] = error
+
+    by_p2rank_configuration = collections.defaultdict(list)
+    for index, (_, _, p2rank_input) in prepared.items():
+        configuration = configurations[index]
+        key = (configuration.p2rank, configuration.p2rank_configuration)
+        by_p2rank_configuration[key].append(
+            (index, p2rank_input, _p2rank_output_directory(configuration)))
+    for group_index, items in enumerate(by_p2rank_configuration.values()):
+        batch_directory = os.path.join(
+            working_directory, f"p2rank-batch-{group_index}")
+        try:
+            _execute_p2rank_batch(
+                items, batch_directory, threads,
+                [configurations[index] for index, _, _ in items])
+        except Exception:
+            # Each prediction is executed on its own below.
+            logger.exception("P2Rank batch execution failed.")
+        finally:
+            shutil.rmtree(batch_directory, ignore_errors=True)
+
+    for index, (structure, conservation, p2rank_input) in prepared.items():
+        configuration = configurations[index]
+        p2rank_output = _p2rank_output_directory(configuration)
+        with _current_execution(configuration):
+            try:
+                if not _has_p2rank_output(p2rank_output, configuration):
+                    logger.info(
+                        f"Missing batch output for prediction {index}, "
+                        "executing P2Rank for the prediction.")
+                    _execute_p2rank(
+                        p2rank_input, p2rank_output, configuration)
+                results[index] = _prepare_output(
+                    p2rank_output, structure, conservation, configuration)
+            except Exception as error:
+                logger.exception(f"Prediction {index} failed.")
+                results[index] = error
+    logger.info("All done")
+    return results
+
+
+@contextlib.contextmanager
+def _current_execution(configuration: Execution):
+    token = current_execution.set(configuration)
+    try:
+        yield
+    finally:
+        current_execution.reset(token)
+
+
+def _prepare_prediction(configuration: Execution) \
+        -> typing.Tuple[Structure, typing.Dict[str, str], str]:
+    """Prepare everything for P2Rank, return structure, conservation
+    and P2Rank input file."""
     _prepare_directories(configuration)
     _create_execute_command(configuration)
-    structure = _prepare_structure(configuration)
-    conservation = _prepare_conservation(structure, configuration)
+    recorder = configuration.recorder
+    with recorder.stage("structure"):
+        structure = _prepare_structure(configuration)
+    with recorder.stage("conservation"):
+        conservation = _prepare_conservation(structure, configuration)
     p2rank_input = _prepare_p2rank_input(
         structure, configuration, conservation)
-    p2rank_output = os.path.join(
-        configuration.working_directory, "p2rank-output")
-    _execute_p2rank(p2rank_input, p2rank_output, configuration)
-    result = _prepare_output(
-        p2rank_output, structure, conservation, configuration)
-    logger.info("All done")
-    return result
+    return structure, conservation, p2rank_input
+
+
+def _p2rank_output_directory(configuration: Execution) -> str:
+    return os.path.join(configuration.working_directory, "p2rank-output")
+
+
+def prepare_sequences(configuration: Execution) -> typing.Dict[str, str]:
+    """Prepare the structure and return FASTA file for each chain.
+    Use lazy execution to reuse the structure in following execute."""
+    _prepare_directories(configuration)
+    _create_execute_command(configuration)
+    return _prepare_structure(configuration).sequence_files
 
 
 def _prepare_directories(configuration: Execution):
@@ -46,36 +171,100 @@ def _create_execute_command(configuration: Execution):
 
     def execute_command(command: str, ignore_return_code: bool = True):
         logger.debug(f"Executing '{command}' ...")
-        result = subprocess.run(
-            command,
-            shell=True,
-            env=os.environ.copy(),
-            stdout=configuration.stdout,
-            stderr=configuration.stderr,
-        )
+        start = time.time()
+        return_code = _execute_on_jvm_server(command, configuration)
+        if return_code is None:
+            return_code, usage = _execute_process(command, configuration)
+            configuration.recorder.command(command, start, return_code, usage)
+        else:
+            configuration.recorder.command(
+                command, start, return_code, jvm_server=True)
         # Throw for non-zero (failure) return code.
-        if not ignore_return_code:
-            result.check_returncode()
+        if not ignore_return_code and return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command)
         logger.debug(f"Executing '{command}' ... done")
 
     configuration.execute_command = execute_command
 
 
+def _execute_process(command: str, configuration: Execution) \
+        -> typing.Tuple[int, resource.struct_rusage]:
+    """Execute the command, return exit code and resource usage
+    of the process including its children."""
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        env=os.environ.copy(),
+        stdout=configuration.stdout,
+        stderr=configuration.stderr,
+    )
+    # Unlike getrusage, wait4 gives usage of the single process, so it
+    # works with commands executed in parallel.
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+
+def _execute_on_jvm_server(
+        command: str, configuration: Execution) -> typing.Optional[int]:
+    """Try to execute P2Rank or java-tools command using the JVM server,
+    return None if the command was not executed."""
+    if any(character in command for character in "|<>;&"):
+        # Shell is required.
+        return None
+    for tool, executable in [
+        ("p2rank", configuration.p2rank),
+        ("java-tools", configuration.java_tools),
+    ]:
+        if executable and command.startswith(executable + " "):
+            arguments = shlex.split(command[len(executable) + 1:])
+            return jvm_server.execute(
+                tool, arguments, configuration.stdout)
+    return None
+
+
 # region Prepare structure
 
 def _prepare_structure(configuration: Execution) -> Structure:
-    metadata = {}
     logger.info("Preparing structure ...")
-    raw_structure_file = _prepare_raw_structure_file(configuration, metadata)
-    structure_file = _filter_raw_structure_file(
-        raw_structure_file, configuration)
-    # Use raw file as we need all chains for the visualisation.
-    fasta_files = _prepare_fasta_files(raw_structure_file, configuration)
+    fasta_files = None
+    checkpoint = _load_checkpoint(configuration, "structure")
+    if checkpoint is None:
+        metadata = {}
+        prefetched = _take_prefetched_structure(configuration, metadata)
+        if prefetched is None:
+            with configuration.recorder.stage("download"):
+                raw_structure_file = _prepare_raw_structure_file(
+                    configuration, metadata)
+        else:
+            raw_structure_file, fasta_files = prefetched
+        structure_file = _filter_raw_structure_file(
+            raw_structure_file, configuration)
+        checkpoint = {
+            "rawStructureFile": raw_structure_file,
+            "structureFile": structure_file,
+            "structureExtension": configuration.structure_extension,
+            "metadata": metadata,
+        }
+        _save_checkpoint(configuration, "structure", checkpoint)
+    raw_structure_file = checkpoint["rawStructureFile"]
+    configuration.structure_extension = checkpoint["structureExtension"]
+
+    if fasta_files is None:
+        fasta_checkpoint = _load_checkpoint(configuration, "fasta")
+        if fasta_checkpoint is None:
+            # Use raw file as we need all chains for the visualisation.
+            fasta_files = _prepare_fasta_files(
+                raw_structure_file, configuration)
+        else:
+            fasta_files = fasta_checkpoint["sequenceFiles"]
+    _save_checkpoint(configuration, "fasta", {"sequenceFiles": fasta_files})
+
     return Structure(
         raw_structure_file,
-        structure_file,
+        checkpoint["structureFile"],
         fasta_files,
-        metadata=metadata
+        metadata=checkpoint["metadata"]
     )
 
 
@@ -106,17 +295,9 @@ def _prepare_raw_structure_file(
 
 
 def _download_from_pdb(code: str, destination: str) -> None:
-    url = f"https://files.rcsb.org/download/{code}.cif"
-    _download(url, destination)
-
-
-def _download(url: str, destination: str) -> None:
-    logger.debug(f"Downloading '{url}' to '{destination}' ...")
-    response = requests.get(url)
-    if not 199 < response.status_code < 299:
-        raise Exception(f"Download failed with code: {response.status_code}")
-    with open(destination, "wb") as stream:
-        stream.write(response.content)
+    url = f"{PDB_DOWNLOAD_URL}/{code}.cif"
+    # The same entry is used by all databases and chain selections.
+    structure_cache.download("pdb", code.upper() + ".cif", url, destination)
 
 
 def _extension(file_name: str) -> str:
@@ -126,16 +307,22 @@ def _extension(file_name: str) -> str:
 
 def _download_from_alpha_fold(
         code: str, destination: str, metadata: typing.Dict[str, any]) -> any:
-    entry_url = f"https://alphafold.ebi.ac.uk/api/prediction/{code}"
-    entry_response = requests.get(entry_url)
-    entry_content = json.loads(entry_response.content)
+    entry_url = f"{ALPHAFOLD_API_URL}/prediction/{code}"
+    entry_file = destination + ".json"
+    structure_cache.download(
+        "alphafold-entry", code.upper() + ".json", entry_url, entry_file)
+    with open(entry_file, encoding="utf-8") as stream:
+        entry_content = json.load(stream)
+    os.remove(entry_file)
     metadata["alpha-fold"] = entry_content
     if len(entry_content) == 0:
         raise Exception(f"No Alphafold entry found for: {code}")
     if len(entry_content) != 1:
         logger.warning(f"One entry expected for AlphaFold, found {len(entry_content)}! Using the first entry.")
     cif_url = entry_content[0]["cifUrl"]
-    _download(cif_url, destination)
+    # The file name contains the model version.
+    structure_cache.download(
+        "alphafold", os.path.basename(cif_url), cif_url, destination)
 
 
 def _filter_raw_structure_file(
@@ -153,7 +340,15 @@ def _filter_raw_structure_file(
         command += "-chains " + ",".join(configuration.chains)
     else:
         assert False, "Structure is not sealed and no chains were selected."
-    configuration.execute_command(command)
+    stage_store.memoize(
+        "reduce-to-chains",
+        {
+            "structure": stage_store.file_digest(raw_file),
+            "name": os.path.basename(raw_file),
+            "chains": configuration.chains,
+        },
+        result,
+        lambda: configuration.execute_command(command))
     return result
 
 
@@ -162,18 +357,143 @@ def _prepare_fasta_files(
         -> typing.Dict[str, str]:
     output = os.path.join(configuration.working_directory, "fasta")
     os.makedirs(output, exist_ok=True)
-    configuration.execute_command(
-        f"{configuration.p2rank} analyze fasta-masked"
-        f" -f {structure_file}"
-        f" -o {output}"
-    )
+    stage_store.memoize(
+        "fasta-masked",
+        {
+            "structure": stage_store.file_digest(structure_file),
+            "name": os.path.basename(structure_file),
+        },
+        output,
+        lambda: configuration.execute_command(
+            f"{configuration.p2rank} analyze fasta-masked"
+            f" -f {structure_file}"
+            f" -o {output}"
+        ))
+    return _list_fasta_files(output)
+
+
+def _list_fasta_files(directory: str) -> typing.Dict[str, str]:
     return {
         # The fifth one is the code, for example: 2W83_A.fasta
-        name[name.rindex("_") + 1:name.rindex(".")]: os.path.join(output, name)
-        for name in os.listdir(output) if name.endswith(".fasta")
+        name[name.rindex("_") + 1:name.rindex(".")]:
+            os.path.join(directory, name)
+        for name in os.listdir(directory) if name.endswith(".fasta")
     }
 
 
+# endregion
+
+# region Prefetch structure
+
+def prefetch_structure(
+        configuration: Execution, extract_fasta: bool = False) -> bool:
+    """Download the structure, and optionally extract FASTA files, into
+    the prefetch directory of the task. The files are used when the task
+    is executed. Return False if there is nothing to prefetch."""
+    if configuration.structure_code is None \
+            and configuration.structure_uniprot is None:
+        return False
+    started = time.time()
+    prefetch_configuration = dataclasses.replace(
+        configuration,
+        working_directory=_prefetch_directory(configuration),
+        lazy_execution=False)
+    _prepare_directories(prefetch_configuration)
+    metadata = {}
+    raw_structure_file = _prepare_raw_structure_file(
+        prefetch_configuration, metadata)
+    if extract_fasta:
+        _create_execute_command(prefetch_configuration)
+        _prepare_fasta_files(raw_structure_file, prefetch_configuration)
+    # Existence of this file marks the prefetch as finished.
+    _save_json(
+        os.path.join(prefetch_configuration.working_directory, "prefetch.json"),
+        {
+            "structure": os.path.basename(raw_structure_file),
+            "fasta": extract_fasta,
+            "metadata": metadata,
+            "started": started,
+            "finished": time.time(),
+        })
+    return True
+
+
+def _prefetch_directory(configuration: Execution) -> str:
+    return os.path.join(configuration.working_directory, "prefetch")
+
+
+def _take_prefetched_structure(
+        configuration: Execution, metadata: typing.Dict[str, any]) \
+        -> typing.Optional[typing.Tuple[str, typing.Optional[
+            typing.Dict[str, str]]]]:
+    """Move prefetched files into the working directory, return raw
+    structure file and FASTA files if they were prefetched."""
+    directory = _prefetch_directory(configuration)
+    if not os.path.exists(directory):
+        return None
+    prefetch_file = os.path.join(directory, "prefetch.json")
+    if not os.path.exists(prefetch_file):
+        logger.info("Structure prefetch is not finished, ignoring it.")
+        instrumentation.observe_prefetch_missed()
+        return None
+    with open(prefetch_file, encoding="utf-8") as stream:
+        prefetch = json.load(stream)
+    raw_structure_file = os.path.join(
+        configuration.working_directory, prefetch["structure"])
+    os.replace(
+        os.path.join(directory, prefetch["structure"]), raw_structure_file)
+    configuration.structure_extension = _extension(raw_structure_file)
+    metadata.update(prefetch["metadata"])
+    fasta_files = None
+    if prefetch["fasta"]:
+        fasta_directory = os.path.join(configuration.working_directory, "fasta")
+        os.replace(os.path.join(directory, "fasta"), fasta_directory)
+        fasta_files = _list_fasta_files(fasta_directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    hidden = prefetch["finished"] - prefetch["started"]
+    queue_wait = time.time() - prefetch["started"]
+    logger.info(
+        f"Using prefetched structure, {hidden:.1f} s of preparation "
+        f"hidden in {queue_wait:.1f} s of queue wait.")
+    instrumentation.observe_prefetch_used(hidden)
+    return raw_structure_file, fasta_files
+
+
+def _save_json(path: str, content: any):
+    path_swp = path + ".swp"
+    with open(path_swp, "w", encoding="utf-8") as stream:
+        json.dump(content, stream)
+    os.replace(path_swp, path)
+
+
+# endregion
+
+# region Checkpoints
+
+def _load_checkpoint(
+        configuration: Execution, stage: str) -> typing.Optional[typing.Dict]:
+    """Return content of the checkpoint of a completed stage, or None when
+    the stage must be executed."""
+    if not configuration.resume:
+        return None
+    path = os.path.join(
+        configuration.working_directory, "checkpoints", stage + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as stream:
+        content = json.load(stream)
+    logger.info(f"Stage '{stage}' is already completed, resuming.")
+    return content
+
+
+def _save_checkpoint(
+        configuration: Execution, stage: str,
+        content: typing.Optional[typing.Dict] = None):
+    directory = os.path.join(configuration.working_directory, "checkpoints")
+    os.makedirs(directory, exist_ok=True)
+    _save_json(os.path.join(directory, stage + ".json"), content or {})
+
+
 # endregion
 
 # region Compute conservation
@@ -188,29 +508,53 @@ def _prepare_conservation(
         configuration.working_directory,
         "conservation")
     os.makedirs(output_directory, exist_ok=True)
-    result = {}
     # We employ local cache on level of protein, where we remember the output
-    # file. As there is other method of caching in the conservation_cache
-    # we may remove this in the future. Yet the overhead should be small,
-    # and it is faster than the other cache.
-    cache = {}
+    # file. Repeated sequences across tasks are handled by the worker-wide
+    # memory cache in conservation_wrapper and by the conservation_cache.
+    chains_by_fasta = collections.defaultdict(list)
     for chain, fasta_file in structure.sequence_files.items():
+        chains_by_fasta[_read_fasta(fasta_file)].append(chain)
+
+    def output_file_for_chain(chain: str) -> str:
+        return os.path.join(output_directory, f"conservation-{chain}")
+
+    def compute_for_chains(chains: typing.List[str]):
+        chain = chains[0]
         working_directory = os.path.join(
             configuration.working_directory,
             f"conservation-{chain}")
         os.makedirs(working_directory, exist_ok=True)
-        output_file = os.path.join(output_directory, f"conservation-{chain}")
-        fasta = _read_fasta(fasta_file)
-        if fasta in cache:
+        _prepare_conservation_for_chain(
+            structure.sequence_files[chain], working_directory,
+            output_file_for_chain(chain), configuration)
+
+    # Chains with distinct sequences are computed in parallel, the work
+    # is done by external commands, so threads are sufficient.
+    wanted = min(
+        max(1, configuration.conservation_workers), len(chains_by_fasta))
+    with cpu_budget.allocate("conservation", wanted) as workers:
+        logger.info(
+            f"Computing conservation for {len(chains_by_fasta)} unique "
+            f"sequences using {workers} workers.")
+        # Keep the current execution in the workers, see execute_batch.
+        context = contextvars.copy_context()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as pool:
+            # Consume the results to propagate exceptions.
+            list(pool.map(
+                lambda chains: context.copy().run(compute_for_chains, chains),
+                chains_by_fasta.values()))
+
+    for chains in chains_by_fasta.values():
+        for chain in chains[1:]:
             logger.info(f"We already have conservation for '{chain}'.")
-            shutil.copy(cache[fasta], output_file)
-        else:
-            _prepare_conservation_for_chain(
-                fasta_file, working_directory, output_file,
-                configuration)
-            cache[fasta] = output_file
-        result[chain] = output_file
-    return result
+            shutil.copy(
+                output_file_for_chain(chains[0]),
+                output_file_for_chain(chain))
+    return {
+        chain: output_file_for_chain(chain)
+        for chain in structure.sequence_files.keys()
+    }
 
 
 def _prepare_conservation_for_chain(
@@ -221,6 +565,11 @@ def _prepare_conservation_for_chain(
     if os.path.exists(output_file) and configuration.lazy_execution:
         logger.info("I'm lazy and conservation file already exists.")
         return
+    # For example 'conservation-A'.
+    checkpoint = os.path.basename(output_file)
+    if os.path.exists(output_file) and \
+            _load_checkpoint(configuration, checkpoint) is not None:
+        return
     conservation_type = configuration.conservation
     if conservation_type == ConservationType.ALIGNMENT:
         conservation_wrapper.compute_alignment_based_conservation(
@@ -232,6 +581,7 @@ def _prepare_conservation_for_chain(
             configuration.execute_command)
     else:
         raise Exception(f"Unknown conservation type '{conservation_type}' !")
+    _save_checkpoint(configuration, checkpoint)
 
 
 def _read_fasta(path):
@@ -263,15 +613,136 @@ def _prepare_p2rank_input(
 def _execute_p2rank(
         input_structure: str, output_directory: str,
         configuration: Execution):
+    wanted = cpu_budget.p2rank_threads(input_structure)
+    with cpu_budget.allocate("p2rank predict", wanted) as threads:
+        command = (
+            f"{configuration.p2rank} predict "
+            f"-c {configuration.p2rank_configuration} "
+            f"-threads {threads} "
+            f"-f {input_structure} "
+            f"-o {output_directory} "
+            f"-log_to_console 1"
+        )
+        configuration.execute_command(command)
+
+
+def _has_p2rank_output(
+        output_directory: str, configuration: Execution) -> bool:
+    return os.path.exists(os.path.join(
+        output_directory,
+        f"structure.{configuration.structure_extension}_predictions.csv"))
+
+
+def _execute_p2rank_batch(
+        items: typing.List[typing.Tuple[int, str, str]],
+        batch_directory: str, threads: int,
+        configurations: typing.List[Execution]):
+    """Predict all given (index, input structure, output directory)
+    using a single P2Rank run. The configurations must share the P2Rank
+    executable and configuration, the output of P2Rank is written to the
+    output of all of them."""
+    configuration = configurations[0]
+    assert all(
+        item.p2rank == configuration.p2rank and
+        item.p2rank_configuration == configuration.p2rank_configuration
+        for item in configurations), "P2Rank configurations differ."
+    input_directory = os.path.join(batch_directory, "input")
+    os.makedirs(input_directory, exist_ok=True)
+    # P2Rank names the output files after the input files,
+    # so each structure needs a unique name.
+    names = {}
+    for index, p2rank_input, output_directory in items:
+        name = f"task-{index}"
+        names[name] = (p2rank_input, output_directory)
+        _link_p2rank_input(p2rank_input, input_directory, name)
+    dataset_file = os.path.join(batch_directory, "dataset.ds")
+    with open(dataset_file, "w", encoding="utf-8") as stream:
+        for name, (p2rank_input, _) in names.items():
+            stream.write(f"input/{name}.{_extension(p2rank_input)}\n")
+    output_directory = os.path.join(batch_directory, "output")
+    logger.info(
+        f"Executing P2Rank for {len(items)} structures "
+        f"using {threads} threads.")
     command = (
-        f"{configuration.p2rank} predict "
+        f"{configuration.p2rank} predict {dataset_file} "
         f"-c {configuration.p2rank_configuration} "
-        f"-threads 1 "
-        f"-f {input_structure} "
+        f"-threads {threads} "
         f"-o {output_directory} "
         f"-log_to_console 1"
     )
-    configuration.execute_command(command)
+    log_file = os.path.join(batch_directory, "p2rank.log")
+    try:
+        with open(log_file, "w", encoding="utf-8") as stream:
+            shared = dataclasses.replace(
+                configuration, stdout=stream, stderr=stream,
+                execute_command=None)
+            _create_execute_command(shared)
+            shared.execute_command(command)
+    finally:
+        _copy_log(log_file, configurations)
+    for name, (p2rank_input, target_directory) in names.items():
+        _split_p2rank_batch_output(
+            output_directory, name, os.path.basename(p2rank_input),
+            set(names.keys()), target_directory)
+
+
+def _copy_log(log_file: str, configurations: typing.List[Execution]):
+    if not os.path.exists(log_file):
+        return
+    with open(log_file, encoding="utf-8", errors="replace") as stream:
+        content = stream.read()
+    for configuration in configurations:
+        configuration.stdout.write(content)
+        configuration.stdout.flush()
+
+
+def _link_p2rank_input(p2rank_input: str, directory: str, name: str):
+    """Link structure and conservation files using the given name."""
+    input_directory = os.path.dirname(p2rank_input)
+    structure_name = os.path.basename(p2rank_input)
+    stem = structure_name[:structure_name.rindex(".")]
+    os.symlink(
+        p2rank_input,
+        os.path.join(directory, f"{name}.{_extension(p2rank_input)}"))
+    for file_name in os.listdir(input_directory):
+        # Conservation files are named {stem}{chain}.hom .
+        if file_name.startswith(stem) and file_name.endswith(".hom"):
+            os.symlink(
+                os.path.join(input_directory, file_name),
+                os.path.join(directory, name + file_name[len(stem):]))
+
+
+def _split_p2rank_batch_output(
+        batch_output: str, name: str, structure_name: str,
+        all_names: typing.Set[str], output_directory: str):
+    """Copy files of the structure with given name into the output
+    directory, so the content is the same as for a single structure.
+    Files shared by all structures are copied as well."""
+    batch_name = f"{name}.{_extension(structure_name)}"
+    for directory, _, file_names in os.walk(batch_output):
+        relative_directory = os.path.relpath(directory, batch_output)
+        target_directory = os.path.normpath(
+            os.path.join(output_directory, relative_directory))
+        for file_name in file_names:
+            if file_name.startswith(batch_name):
+                target_name = structure_name + file_name[len(batch_name):]
+            elif any(file_name.startswith(other + ".")
+                     for other in all_names):
+                # Belongs to another structure.
+                continue
+            else:
+                target_name = file_name
+            os.makedirs(target_directory, exist_ok=True)
+            source = os.path.join(directory, file_name)
+            target = os.path.join(target_directory, target_name)
+            if file_name.endswith(".pml"):
+                # Visualisation references other files by name.
+                with open(source, encoding="utf-8") as stream:
+                    content = stream.read()
+                with open(target, "w", encoding="utf-8") as stream:
+                    stream.write(content.replace(batch_name, structure_name))
+            else:
+                shutil.copy(source, target)
 
 
 # endregion
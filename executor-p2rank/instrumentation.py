@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+#
+# Record wall time and resource usage of pipeline stages and external
+# commands. Records of a task are saved to 'timings.json', aggregated
+# values are exposed as Prometheus histograms when prometheus_client
+# is available.
+#
+# Celery executes tasks in child processes, so the metrics use
+# the prometheus_client multiprocess mode with PROMETHEUS_MULTIPROC_DIR.
+#
+import contextlib
+import json
+import logging
+import os
+import re
+import resource
+import threading
+import time
+import typing
+
+try:
+    import prometheus_client
+    import prometheus_client.multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger("prankweb.instrumentation")
+logger.setLevel(logging.DEBUG)
+
+# From a second to hours for large structures with conservation.
+_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600, 7200)
+
+_RSS_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(4, 15))
+
+if prometheus_client is not None:
+    _STAGE_SECONDS = prometheus_client.Histogram(
+        "prankweb_stage_duration_seconds",
+        "Wall time of a prediction stage.",
+        ["stage"], buckets=_BUCKETS)
+    _STAGE_CPU_SECONDS = prometheus_client.Histogram(
+        "prankweb_stage_cpu_seconds",
+        "User and system CPU time of a prediction stage.",
+        ["stage"], buckets=_BUCKETS)
+    _COMMAND_SECONDS = prometheus_client.Histogram(
+        "prankweb_command_duration_seconds",
+        "Wall time of an external command.",
+        ["command"], buckets=_BUCKETS)
+    _COMMAND_MAX_RSS_BYTES = prometheus_client.Histogram(
+        "prankweb_command_max_rss_bytes",
+        "Peak resident set size of an external command.",
+        ["command"], buckets=_RSS_BUCKETS)
+    _QUEUE_WAIT_SECONDS = prometheus_client.Histogram(
+        "prankweb_queue_wait_seconds",
+        "Time a prediction waited in the queue.",
+        ["lane"], buckets=_BUCKETS)
+    _PREFETCH_TASKS = prometheus_client.Counter(
+        "prankweb_prefetch_tasks",
+        "Tasks with a structure prefetch, 'missed' when the task started "
+        "before the prefetch was finished.",
+        ["result"])
+    _PREFETCH_HIDDEN_SECONDS = prometheus_client.Histogram(
+        "prankweb_prefetch_hidden_seconds",
+        "Structure preparation time hidden in the queue wait by prefetch.",
+        buckets=_BUCKETS)
+
+
+class Recorder:
+    """Collect records of a single execution."""
+
+    def __init__(self):
+        self.stages: typing.List[typing.Dict] = []
+        self.commands: typing.List[typing.Dict] = []
+        self._stage: typing.Optional[str] = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Measure the stage, CPU time includes all child processes."""
+        previous = self._stage
+        self._stage = name
+        start = time.time()
+        start_self = resource.getrusage(resource.RUSAGE_SELF)
+        start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            end_self = resource.getrusage(resource.RUSAGE_SELF)
+            end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self._stage = previous
+            user = (end_self.ru_utime - start_self.ru_utime) + \
+                (end_children.ru_utime - start_children.ru_utime)
+            system = (end_self.ru_stime - start_self.ru_stime) + \
+                (end_children.ru_stime - start_children.ru_stime)
+            record = {
+                "stage": name,
+                "start": start,
+                "wallSeconds": time.time() - start,
+                "userSeconds": user,
+                "systemSeconds": system,
+            }
+            with self._lock:
+                self.stages.append(record)
+            logger.debug(
+                f"Stage '{name}' took {record['wallSeconds']:.1f} s, "
+                f"CPU {user + system:.1f} s.")
+            if prometheus_client is not None:
+                _STAGE_SECONDS.labels(name).observe(record["wallSeconds"])
+                _STAGE_CPU_SECONDS.labels(name).observe(user + system)
+
+    def command(
+            self, command: str, start: float, return_code: int,
+            usage: typing.Optional[resource.struct_rusage] = None,
+            jvm_server: bool = False):
+        """Record an executed command, usage is not available for commands
+        executed by the JVM server."""
+        name = command_name(command)
+        record = {
+            "stage": self._stage,
+            "command": name,
+            "start": start,
+            "wallSeconds": time.time() - start,
+            "returnCode": return_code,
+            "jvmServer": jvm_server,
+        }
+        if usage is not None:
+            record["userSeconds"] = usage.ru_utime
+            record["systemSeconds"] = usage.ru_stime
+            # Linux reports the value in kilobytes.
+            record["maxRssBytes"] = usage.ru_maxrss * 1024
+        with self._lock:
+            self.commands.append(record)
+        if prometheus_client is not None:
+            _COMMAND_SECONDS.labels(name).observe(record["wallSeconds"])
+            if usage is not None:
+                _COMMAND_MAX_RSS_BYTES.labels(name).observe(
+                    record["maxRssBytes"])
+
+    def save(self, path: str):
+        with self._lock:
+            content = {"stages": self.stages, "commands": self.commands}
+        path_swp = path + ".swp"
+        with open(path_swp, "w", encoding="utf-8") as stream:
+            json.dump(content, stream, indent=2)
+        os.replace(path_swp, path)
+
+
+def observe_queue_wait(lane: str, seconds: float):
+    logger.debug(f"Task waited {seconds:.1f} s in the '{lane}' lane.")
+    if prometheus_client is not None:
+        _QUEUE_WAIT_SECONDS.labels(lane).observe(seconds)
+
+
+def observe_prefetch_used(hidden_seconds: float):
+    if prometheus_client is not None:
+        _PREFETCH_TASKS.labels("used").inc()
+        _PREFETCH_HIDDEN_SECONDS.observe(hidden_seconds)
+
+
+def observe_prefetch_missed():
+    if prometheus_client is not None:
+        _PREFETCH_TASKS.labels("missed").inc()
+
+
+def command_name(command: str) -> str:
+    """Return executable name with the sub-command, if any, e.g.
+    'p2rank.sh predict', so the name can be used as a metric label."""
+    tokens = command.split()
+    if not tokens:
+        return ""
+    result = os.path.basename(tokens[0])
+    if len(tokens) > 1 and re.fullmatch(r"[a-z][\w-]*", tokens[1]):
+        result += " " + tokens[1]
+    return result
+
+
+def start_metrics_server(port: int):
+    """Start HTTP server with metrics of all worker processes."""
+    if prometheus_client is None:
+        logger.warning("Missing prometheus_client, metrics are disabled.")
+        return
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR", None)
+    if directory is None:
+        logger.warning("Missing PROMETHEUS_MULTIPROC_DIR, metrics are disabled.")
+        return
+    # Metrics of previous runs are removed by the entrypoint before any
+    # worker starts, see celery-workers.sh, as the workers share
+    # the directory.
+    os.makedirs(directory, exist_ok=True)
+    registry = prometheus_client.CollectorRegistry()
+    prometheus_client.multiprocess.MultiProcessCollector(registry)
+    prometheus_client.start_http_server(port, registry=registry)
+    logger.info(f"Metrics are available on port {port}.")
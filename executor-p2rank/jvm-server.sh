@@ -0,0 +1,12 @@
+#!/bin/bash
+#
+# Start JVM server executing java-tools and P2Rank commands, see jvm_server.py .
+# The socket path is given by JVM_SERVER_SOCKET.
+#
+
+# Heap for P2Rank as in p2rank.sh and java-tools commands.
+export JAVA_OPTS="$JAVA_OPTS -Xmx6g"
+# Allow the server to turn System.exit in P2Rank into an exit code.
+export JAVA_OPTS="$JAVA_OPTS -Djava.security.manager=allow"
+
+exec "$JAVA_TOOLS_CMD" server --socket "$JVM_SERVER_SOCKET" --p2rank "/opt/p2rank/"
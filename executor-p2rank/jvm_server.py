@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Client for the JVM server, see 'server' command in java-tools.
+#
+# The server executes java-tools and P2Rank commands in a long-running JVM,
+# so the JVM start-up and class loading are not paid for every command.
+# P2Rank still loads the model for every prediction.
+# Start the server using jvm-server.sh and set JVM_SERVER_SOCKET.
+# When the server is not available, or it is busy with another P2Rank
+# command, the caller should execute the command on its own. Once the
+# request is sent, the server may be executing the command, so a failure
+# to get the response is a failure of the command.
+#
+import json
+import logging
+import os
+import socket
+import time
+import typing
+
+logger = logging.getLogger("prankweb.jvm_server")
+logger.setLevel(logging.DEBUG)
+
+SOCKET_PATH = os.environ.get("JVM_SERVER_SOCKET", None)
+
+# P2Rank predictions of large structures may take long.
+CLIENT_TIMEOUT_SECONDS = 60 * 60
+
+# Used when the command was sent, but we have not got the response.
+NO_RESPONSE_EXIT_CODE = 1
+
+
+def execute(
+        tool: str, arguments: typing.List[str],
+        output: typing.Optional[typing.TextIO] = None,
+        socket_path: typing.Optional[str] = SOCKET_PATH) \
+        -> typing.Optional[int]:
+    """Execute 'java-tools' or 'p2rank' command, return exit code or None
+    when the command was not executed. Standard output and error of
+    the command are written to the output."""
+    if socket_path is None or not os.path.exists(socket_path):
+        return None
+    start = time.monotonic()
+    request = {"tool": tool, "arguments": arguments}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CLIENT_TIMEOUT_SECONDS)
+        try:
+            client.connect(socket_path)
+            client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        except OSError:
+            logger.warning("JVM server is not available.", exc_info=True)
+            return None
+        try:
+            with client.makefile("rb") as stream:
+                line = stream.readline()
+        except OSError:
+            logger.error(
+                f"No response from JVM server for '{tool}'.", exc_info=True)
+            return NO_RESPONSE_EXIT_CODE
+    if not line:
+        logger.error(f"JVM server closed connection for '{tool}'.")
+        return NO_RESPONSE_EXIT_CODE
+    response = json.loads(line)
+    status = response.get("status", None)
+    if status == "busy":
+        logger.debug(f"JVM server is busy, can't execute '{tool}'.")
+        return None
+    if status != "ok":
+        # The server reports an error only when the command was not
+        # executed, e.g. P2Rank is not configured.
+        logger.warning(f"JVM server failed: {response.get('message', None)}")
+        return None
+    if output is not None:
+        output.write(response.get("output", ""))
+        output.flush()
+    logger.debug(
+        f"JVM server executed '{tool}' in {time.monotonic() - start:.1f} s.")
+    return response["exitCode"]
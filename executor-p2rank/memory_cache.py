@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#
+# Bounded in-process LRU cache, the content lives as long as the worker.
+#
+import collections
+import threading
+import typing
+
+
+class LruCache:
+    """Keep at most max_items values with total size at most max_bytes."""
+
+    def __init__(self, max_items: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        self._content: typing.OrderedDict[typing.Hashable, bytes] = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable) -> typing.Optional[bytes]:
+        with self._lock:
+            value = self._content.get(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._content.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: typing.Hashable, value: bytes):
+        if len(value) > self.max_bytes or self.max_items < 1:
+            return
+        with self._lock:
+            previous = self._content.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._content[key] = value
+            self._size += len(value)
+            while len(self._content) > self.max_items \
+                    or self._size > self.max_bytes:
+                _, evicted = self._content.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def statistics(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "items": len(self._content),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -2,6 +2,8 @@ import typing
 import enum
 from dataclasses import dataclass, field
 
+from instrumentation import Recorder
+
 
 class ConservationType(enum.Enum):
     ALIGNMENT = "alignment"
@@ -56,6 +58,13 @@ class Execution:
     # If true and files produced by external command, the command is not
     # executed.
     lazy_execution: bool = False
+    # Number of chains to compute conservation for in parallel.
+    conservation_workers: int = 1
+    # If true, stages completed by a previous execution in the same
+    # working directory are not executed again.
+    resume: bool = False
+    # Collects wall time and resource usage of stages and commands.
+    recorder: Recorder = field(default_factory=Recorder)
     # For internal use, represent structure type using extension
     structure_extension = ""
 
@@ -9,6 +9,7 @@ import gzip
 import shutil
 
 from model import *
+import stage_store
 
 logger = logging.getLogger("prankweb.output_prankweb")
 logger.setLevel(logging.DEBUG)
@@ -100,11 +101,18 @@ def _prepare_prediction_file(
     parameters_file = os.path.join(
         p2rank_output, "params.txt")
 
-    configuration.execute_command(
-        f"{configuration.java_tools} structure-info"
-        f" --input={structure.raw_structure_file}"
-        f" --output={structure_file}"
-    )
+    stage_store.memoize(
+        "structure-info",
+        {
+            "structure": stage_store.file_digest(structure.raw_structure_file),
+            "name": os.path.basename(structure.raw_structure_file),
+        },
+        structure_file,
+        lambda: configuration.execute_command(
+            f"{configuration.java_tools} structure-info"
+            f" --input={structure.raw_structure_file}"
+            f" --output={structure_file}"
+        ))
 
     with open(output_file, "w", encoding="utf-8") as stream:
         json.dump({
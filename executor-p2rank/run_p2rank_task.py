@@ -4,15 +4,20 @@
 #
 import os
 import argparse
+import contextlib
 import sys
 import json
 import datetime
 import subprocess
 import logging
 import shutil
+import threading
+import time
 
 from model import *
-from executor import execute
+from executor import execute, execute_batch, prepare_sequences, \
+    prefetch_structure, current_execution
+import status_index
 
 
 class Status(enum.Enum):
@@ -25,6 +30,13 @@ class Status(enum.Enum):
 logging.getLogger().setLevel(logging.DEBUG)
 logger = logging.getLogger("prankweb")
 
+# How often a running task touches the heartbeat file.
+HEARTBEAT_SECONDS = 60
+
+# Running task without a heartbeat for this time is considered dead.
+HEARTBEAT_TIMEOUT_SECONDS = int(
+    os.environ.get("TASK_HEARTBEAT_TIMEOUT", 10 * 60))
+
 
 def _read_arguments() -> typing.Dict[str, any]:
     parser = argparse.ArgumentParser()
@@ -64,8 +76,7 @@ def execute_directory_task(
         keep_working: bool = False,
         lazy_execution: bool = False,
         stdout: bool = False):
-    log_file = os.path.join(directory, "log")
-    with open(log_file, "w", encoding="utf-8") as stream:
+    with _open_log(directory) as stream:
         if stdout:
             stream = sys.stdout
         handler = _create_log_handler(stream)
@@ -97,16 +108,285 @@ def _execute_directory_task(
 
     # We can check here if the task is running but, we assume that
     # should we run given task it is regardless of the initial state.
+    _log_start(directory)
 
     status["status"] = Status.RUNNING.value
     _save_status_file(status_file, status)
 
+    execution = _create_execution(directory, stream, lazy_execution)
+    with _heartbeat(directory):
+        try:
+            result = execute(execution)
+        except BaseException as error:
+            result = error
+    _finish_directory_task(directory, status, execution, result, keep_working)
+
+
+def _has_checkpoints(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, "working", "checkpoints"))
+
+
+def _preparation_file(directory: str) -> str:
+    """Existence of the file marks a task prepared before the execution,
+    see prepare_directory_sequences."""
+    return os.path.join(directory, "working", "preparation")
+
+
+def _open_log(directory: str) -> typing.TextIO:
+    # Keep the log of the preparation or the interrupted execution.
+    append = _has_checkpoints(directory) or \
+        os.path.exists(_preparation_file(directory))
+    return open(
+        os.path.join(directory, "log"), "a" if append else "w",
+        encoding="utf-8")
+
+
+def _log_start(directory: str):
+    preparation_file = _preparation_file(directory)
+    if os.path.exists(preparation_file):
+        logger.info("Using prepared structure.")
+        # Following executions are resumed from the checkpoints.
+        os.remove(preparation_file)
+    elif _has_checkpoints(directory):
+        logger.info("Resuming interrupted execution.")
+
+
+def _heartbeat_file(directory: str) -> str:
+    return os.path.join(directory, "working", "heartbeat")
+
+
+@contextlib.contextmanager
+def _heartbeat(*directories: str):
+    """Periodically touch the heartbeat files while in the context."""
+    heartbeat_files = [_heartbeat_file(directory) for directory in directories]
+    stop = threading.Event()
+
+    def touch():
+        while True:
+            for heartbeat_file in heartbeat_files:
+                try:
+                    os.makedirs(
+                        os.path.dirname(heartbeat_file), exist_ok=True)
+                    with open(heartbeat_file, "w"):
+                        pass
+                except OSError:
+                    logger.warning("Can't update heartbeat.", exc_info=True)
+            if stop.wait(HEARTBEAT_SECONDS):
+                return
+
+    thread = threading.Thread(target=touch, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def is_directory_task_alive(directory: str) -> bool:
+    """Return true if the task is running and its heartbeat is recent."""
+    status = _load_json(os.path.join(directory, "info.json"))
+    if status["status"] != Status.RUNNING.value:
+        return False
+    try:
+        last_heartbeat = os.stat(_heartbeat_file(directory)).st_mtime
+    except FileNotFoundError:
+        return False
+    return time.time() - last_heartbeat < HEARTBEAT_TIMEOUT_SECONDS
+
+
+def is_directory_task_finished(directory: str) -> bool:
+    """Return true if the task has already been executed."""
+    status = _load_json(os.path.join(directory, "info.json"))
+    return status["status"] in (
+        Status.SUCCESSFUL.value, Status.FAILED.value)
+
+
+def queued_seconds(directory: str) -> typing.Optional[float]:
+    """Return time since the queued task was queued."""
+    status = _load_json(os.path.join(directory, "info.json"))
+    if status["status"] != Status.QUEUED.value or "lastChange" not in status:
+        return None
+    queued = datetime.datetime.strptime(
+        status["lastChange"], "%Y-%m-%dT%H:%M:%S")
+    return (datetime.datetime.today() - queued).total_seconds()
+
+
+def save_task_queue(directory: str, queue: str):
+    working_directory = os.path.join(directory, "working")
+    os.makedirs(working_directory, exist_ok=True)
+    with open(os.path.join(working_directory, "queue"), "w",
+              encoding="utf-8") as stream:
+        stream.write(queue)
+
+
+def load_task_queue(directory: str) -> typing.Optional[str]:
+    """Return queue the task was delivered from."""
+    path = os.path.join(directory, "working", "queue")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as stream:
+        return stream.read().strip()
+
+
+def requeue_directory_task(directory: str, max_attempts: int) -> bool:
+    """Prepare a task, which is no longer alive, to be queued again.
+    Return False and mark the task as failed, if the task was already
+    queued given number of times."""
+    attempts_file = os.path.join(directory, "working", "attempts")
+    attempts = 0
+    if os.path.exists(attempts_file):
+        with open(attempts_file, encoding="utf-8") as stream:
+            attempts = int(stream.read())
+    status_file = os.path.join(directory, "info.json")
+    status = _load_json(status_file)
+    if attempts >= max_attempts:
+        status["status"] = Status.FAILED.value
+        _save_status_file(status_file, status)
+        shutil.rmtree(os.path.join(directory, "working"), ignore_errors=True)
+        return False
+    os.makedirs(os.path.dirname(attempts_file), exist_ok=True)
+    with open(attempts_file, "w", encoding="utf-8") as stream:
+        stream.write(str(attempts + 1))
+    status["status"] = Status.QUEUED.value
+    _save_status_file(status_file, status)
+    return True
+
+
+def _finish_directory_task(
+        directory: str, status, execution: Execution,
+        result: typing.Union[ExecutionResult, BaseException],
+        keep_working: bool):
+    status_file = os.path.join(directory, "info.json")
+    execution.recorder.save(os.path.join(directory, "timings.json"))
+    if isinstance(result, ExecutionResult):
+        status["status"] = Status.SUCCESSFUL.value
+        status["metadata"] = {
+            **status.get("metadata", {}),
+            "predictionName": _output_name(execution),
+            "structureName": result.output_structure_file,
+        }
+    elif isinstance(result, subprocess.CalledProcessError):
+        status["status"] = Status.FAILED.value
+        logger.error("External process failed.", exc_info=result)
+    else:
+        status["status"] = Status.FAILED.value
+        logger.error("Execution failed.", exc_info=result)
+
+    _save_status_file(status_file, status)
+
+    if not keep_working:
+        # A missed prefetch may still write into the working directory,
+        # it removes its files once it sees the task finished.
+        shutil.rmtree(os.path.join(directory, "working"), ignore_errors=True)
+
+
+def execute_directory_tasks(
+        directories: typing.List[str],
+        working_directory: str,
+        threads: int,
+        keep_working: bool = False,
+        lazy_execution: bool = False):
+    """Execute tasks using a single P2Rank run, see executor.execute_batch.
+    Each log contains logs of its task and logs shared by the batch,
+    i.e. the P2Rank run."""
+    with contextlib.ExitStack() as stack:
+        statuses = []
+        executions = []
+        for directory in directories:
+            stream = stack.enter_context(_open_log(directory))
+            execution = _create_execution(directory, stream, lazy_execution)
+            handler = _create_log_handler(stream)
+            handler.addFilter(_create_batch_log_filter(execution))
+            logging.getLogger().addHandler(handler)
+            stack.callback(logging.getLogger().removeHandler, handler)
+            with _batch_task(execution):
+                _log_start(directory)
+            status_file = os.path.join(directory, "info.json")
+            status = _load_json(status_file)
+            status["status"] = Status.RUNNING.value
+            _save_status_file(status_file, status)
+            statuses.append(status)
+            executions.append(execution)
+        logger.info(f"Executing {len(directories)} tasks in a batch.")
+        # The tasks are running, so the watchdog must see them alive.
+        with _heartbeat(*directories):
+            results = execute_batch(executions, working_directory, threads)
+        for directory, status, execution, result in zip(
+                directories, statuses, executions, results):
+            with _batch_task(execution):
+                _finish_directory_task(
+                    directory, status, execution, result, keep_working)
+
+
+def _create_batch_log_filter(execution: Execution):
+    """Accept logs of the execution and logs shared by the batch."""
+
+    def accept(record: logging.LogRecord) -> bool:
+        current = current_execution.get()
+        return current is None or current is execution
+
+    return accept
+
+
+@contextlib.contextmanager
+def _batch_task(execution: Execution):
+    token = current_execution.set(execution)
+    try:
+        yield
+    finally:
+        current_execution.reset(token)
+
+
+def prefetch_directory_task(directory: str):
+    """Prefetch structure for a queued task, see executor.prefetch_structure.
+    Failures are only logged as the task downloads the structure itself."""
+    status_file = os.path.join(directory, "info.json")
+    if _load_json(status_file)["status"] != Status.QUEUED.value:
+        logger.info(f"Task '{directory}' is not queued, skipping prefetch.")
+        return
+    extract_fasta = os.environ.get("PREFETCH_FASTA", "0") == "1"
+    working_directory = os.path.join(directory, "working")
+    prefetch_directory = os.path.join(working_directory, "prefetch")
+    os.makedirs(prefetch_directory, exist_ok=True)
+    with open(os.path.join(prefetch_directory, "log"), "w",
+              encoding="utf-8") as stream:
+        execution = _create_execution(directory, stream, False)
+        try:
+            prefetch_structure(execution, extract_fasta)
+        except Exception:
+            logger.exception(f"Prefetch of '{directory}' failed.")
+    status = _load_json(status_file)["status"]
+    if status in (Status.SUCCESSFUL.value, Status.FAILED.value):
+        # The task was executed without the prefetched files.
+        shutil.rmtree(prefetch_directory, ignore_errors=True)
+        if os.path.isdir(working_directory) and \
+                not os.listdir(working_directory):
+            os.rmdir(working_directory)
+
+
+def prepare_directory_sequences(directory: str) -> typing.List[str]:
+    """Prepare structure for the task and return FASTA files of its chains.
+    The structure is kept in the working directory, so it is reused when
+    the task is executed with lazy execution."""
+    preparation_file = _preparation_file(directory)
+    os.makedirs(os.path.dirname(preparation_file), exist_ok=True)
+    with open(preparation_file, "w", encoding="utf-8"):
+        pass
+    with open(os.path.join(directory, "log"), "w", encoding="utf-8") \
+            as stream:
+        execution = _create_execution(directory, stream, True)
+        return list(prepare_sequences(execution).values())
+
+
+def _create_execution(
+        directory: str, stream, lazy_execution: bool) -> Execution:
     configuration = _load_json(
         os.path.join(directory, "input", "configuration.json"))
 
     this_directory = os.path.dirname(os.path.realpath(__file__))
 
-    execution = Execution(
+    return Execution(
         p2rank=os.path.join(this_directory, "p2rank.sh"),
         java_tools=os.environ.get("JAVA_TOOLS_CMD", None),
         working_directory=os.path.join(directory, "working"),
@@ -121,27 +401,12 @@ def _execute_directory_task(
         structure_sealed=configuration.get("structure_sealed", False),
         chains=configuration.get("chains", []),
         conservation=_conservation_type(configuration),
-        lazy_execution=lazy_execution
+        lazy_execution=lazy_execution,
+        conservation_workers=_conservation_workers(),
+        # The working directory belongs to the task, so any checkpoints
+        # were created by an interrupted execution of this task.
+        resume=True,
     )
-    try:
-        result = execute(execution)
-        status["status"] = Status.SUCCESSFUL.value
-        status["metadata"] = {
-            **status.get("metadata", {}),
-            "predictionName": _output_name(execution),
-            "structureName": result.output_structure_file,
-        }
-    except subprocess.CalledProcessError:
-        status["status"] = Status.FAILED.value
-        logger.exception("External process failed.")
-    except:
-        status["status"] = Status.FAILED.value
-        logger.exception("Execution failed.")
-
-    _save_status_file(status_file, status)
-
-    if not keep_working:
-        shutil.rmtree(os.path.join(directory, "working"))
 
 
 def _load_json(path: str):
@@ -153,6 +418,7 @@ def _save_status_file(path: str, status: any):
     now = datetime.datetime.today()
     status["lastChange"] = now.strftime('%Y-%m-%dT%H:%M:%S')
     _save_json(path, status)
+    status_index.update(os.path.dirname(path), status)
 
 
 def _save_json(path: str, content: any):
@@ -179,6 +445,12 @@ def _conservation_type(configuration):
     return ConservationType.NONE
 
 
+def _conservation_workers() -> int:
+    """Maximum number of parallel conservation computations for a single
+    task. The actual number is limited by free CPUs, see cpu_budget."""
+    return max(1, int(os.environ.get("CONSERVATION_WORKERS", 1)))
+
+
 def _output_name(execution: Execution):
     if execution.structure_file:
         file = execution.structure_file
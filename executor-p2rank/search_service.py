@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+#
+# Long-running search service for conservation pipelines.
+#
+# The service keeps the sequence databases resident in memory, so searches
+# do not compete for disk with cold scans of multi-GB files. The files are
+# memory-mapped and locked in memory if possible, otherwise they are
+# periodically read to keep them in the page cache. The searches are
+# executed by the service with bounded concurrency.
+#
+# Clients communicate over a Unix socket, request and response are single
+# lines with JSON. Supported commands are 'phmmer', 'psiblast' and
+# 'statistics'. When the service is not available the client functions
+# return False and the caller should execute the search on its own.
+# Once the request is sent the service may be writing the output file,
+# so a missing response is an error. The service stops the search when
+# the client disconnects.
+#
+# Only the databases given on the command line can be searched and the
+# query and output files must be under the working root.
+#
+import argparse
+import collections
+import ctypes
+import json
+import logging
+import mmap
+import os
+import select
+import socket
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
+import typing
+
+import cpu_budget
+
+logger = logging.getLogger("prankweb.search_service")
+logger.setLevel(logging.DEBUG)
+
+SOCKET_PATH = os.environ.get("CONSERVATION_SEARCH_SOCKET", None)
+
+HMMER_DIR = os.environ.get("HMMER_DIR", "")
+
+PSIBLAST_CMD = os.environ.get("PSIBLAST_CMD", None)
+
+# Directory with query and output files, i.e. the executor's data.
+WORKING_ROOT = os.environ.get("CONSERVATION_SEARCH_ROOT", None)
+
+# BLAST databases used by the alignment based conservation.
+BLAST_DATABASES = ["swissprot", "uniref50", "uniref90"]
+
+# Number of latencies used to compute the percentiles.
+LATENCY_WINDOW = 1000
+
+# Searches may take long, but we do not want to wait forever.
+CLIENT_TIMEOUT_SECONDS = 4 * 60 * 60
+
+# How often the service checks that the client is still connected.
+DISCONNECT_CHECK_SECONDS = 5
+
+
+def _read_arguments() -> typing.Dict[str, str]:
+    parser = argparse.ArgumentParser(
+        description="Run search service for conservation pipelines.")
+    parser.add_argument(
+        "--socket", default=SOCKET_PATH,
+        help="Path to the Unix socket.")
+    parser.add_argument(
+        "--database", nargs="*", default=[],
+        help="Database files to keep in memory.")
+    parser.add_argument(
+        "--blast-database", nargs="*", default=BLAST_DATABASES,
+        help="BLAST databases psiblast can search.")
+    parser.add_argument(
+        "--root", default=WORKING_ROOT,
+        help="Directory with query and output files.")
+    parser.add_argument(
+        "--threads", type=int, default=1,
+        help="Number of threads used by a single search.")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Maximum number of concurrent searches, "
+             "by default CPU_BUDGET divided by the number of threads.")
+    parser.add_argument(
+        "--refresh", type=int, default=15 * 60,
+        help="Seconds between re-reading of databases not locked in memory.")
+    return vars(parser.parse_args())
+
+
+def main(arguments):
+    _init_logging()
+    if arguments["socket"] is None:
+        raise RuntimeError("Missing socket path.")
+    if arguments["root"] is None:
+        raise RuntimeError("Missing working root.")
+    threads = max(1, arguments["threads"])
+    workers = arguments["workers"]
+    if workers is None:
+        workers = max(1, cpu_budget.CPU_BUDGET // threads)
+    logger.info(
+        f"Running up to {workers} searches with {threads} threads each.")
+    resident = [_ResidentFile(path) for path in arguments["database"]]
+    threading.Thread(
+        target=_keep_resident, args=(resident, arguments["refresh"]),
+        daemon=True).start()
+    service = _SearchService(
+        workers, threads, arguments["root"],
+        [item.path for item in resident], arguments["blast_database"])
+    if os.path.exists(arguments["socket"]):
+        os.remove(arguments["socket"])
+    with _Server(arguments["socket"], service) as server:
+        logger.info(f"Listening on '{arguments['socket']}' ...")
+        server.serve_forever()
+
+
+def _init_logging():
+    formatter = logging.Formatter(
+        "%(asctime)s %(name)s [%(levelname)s] : %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(formatter)
+
+    logger.addHandler(handler)
+
+
+# region Server
+
+class _ResidentFile:
+    """Memory-mapped file we try to keep in memory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stream = open(path, "rb")
+        self.content = mmap.mmap(
+            self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+        self.locked = False
+        start = time.monotonic()
+        self.touch()
+        logger.info(
+            f"Loaded '{path}' ({len(self.content) / (1024 ** 3):.2f} GB) "
+            f"in {time.monotonic() - start:.1f} s.")
+        self.locked = _lock_in_memory(
+            self.stream.fileno(), len(self.content))
+
+    def touch(self):
+        """Read every page of the file."""
+        page_size = mmap.PAGESIZE
+        for offset in range(0, len(self.content), page_size):
+            self.content[offset]
+
+
+def _lock_in_memory(descriptor: int, size: int) -> bool:
+    """Try to map the file and lock the pages in memory, this requires
+    CAP_IPC_LOCK or large enough RLIMIT_MEMLOCK. The mapping is never
+    released."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return False
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [
+        ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int,
+        ctypes.c_int, ctypes.c_long]
+    libc.mlock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    address = libc.mmap(
+        None, size, mmap.PROT_READ, mmap.MAP_SHARED, descriptor, 0)
+    if address is None or address == ctypes.c_void_p(-1).value:
+        return False
+    if libc.mlock(address, size) != 0:
+        logger.info(
+            "Can't lock database in memory, "
+            f"errno: {ctypes.get_errno()}, using periodic refresh.")
+        return False
+    return True
+
+
+def _keep_resident(resident: typing.List[_ResidentFile], refresh: int):
+    while True:
+        time.sleep(refresh)
+        for item in resident:
+            if not item.locked:
+                item.touch()
+
+
+class _SearchService:
+
+    def __init__(
+            self, workers: int, threads: int, root: str,
+            databases: typing.List[str], blast_databases: typing.List[str]):
+        self.semaphore = threading.Semaphore(max(1, workers))
+        self.threads = threads
+        self.root = os.path.realpath(root)
+        self.databases = {os.path.realpath(path) for path in databases}
+        self.blast_databases = set(blast_databases)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.waits = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def handle(
+            self, request: typing.Dict,
+            is_disconnected: typing.Callable[[], bool]) -> typing.Dict:
+        command = request.get("command", None)
+        if command == "statistics":
+            return {"status": "ok", "statistics": self.statistics()}
+        if command == "phmmer":
+            return self._execute(
+                self._phmmer_command(request), is_disconnected)
+        if command == "psiblast":
+            return self._execute(
+                self._psiblast_command(request), is_disconnected)
+        return {"status": "error", "message": f"Unknown command '{command}'."}
+
+    def _execute(
+            self, command: typing.List[str],
+            is_disconnected: typing.Callable[[], bool]) -> typing.Dict:
+        submitted = time.monotonic()
+        with self.lock:
+            self.waiting += 1
+        with self.semaphore:
+            started = time.monotonic()
+            with self.lock:
+                self.waiting -= 1
+                self.running += 1
+            try:
+                return_code, stderr = _run(command, is_disconnected)
+            finally:
+                finished = time.monotonic()
+                with self.lock:
+                    self.running -= 1
+                    self.waits.append(started - submitted)
+                    self.latencies.append(finished - started)
+        with self.lock:
+            if return_code is None:
+                self.cancelled += 1
+            elif return_code == 0:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if return_code is None:
+            return {"status": "error", "message": "Client disconnected."}
+        if return_code != 0:
+            return {"status": "error", "message": stderr}
+        return {"status": "ok"}
+
+    def _phmmer_command(self, request: typing.Dict) -> typing.List[str]:
+        database_file = os.path.realpath(request["database_file"])
+        if database_file not in self.databases:
+            raise ValueError(f"Database '{database_file}' is not served.")
+        return [
+            HMMER_DIR + "phmmer", "-o", "/dev/null",
+            "--cpu", str(self.threads),
+            "-A", self._working_file(request["output_file"]),
+            self._working_file(request["query_file"]), database_file,
+        ]
+
+    def _psiblast_command(self, request: typing.Dict) -> typing.List[str]:
+        if request["database"] not in self.blast_databases:
+            raise ValueError(
+                f"Database '{request['database']}' is not served.")
+        return [
+            PSIBLAST_CMD,
+            "-query", self._working_file(request["query_file"]),
+            "-db", request["database"],
+            "-outfmt", request["output_format"],
+            "-evalue", str(float(request["evalue"])),
+            "-num_threads", str(self.threads),
+            "-out", self._working_file(request["output_file"]),
+        ]
+
+    def _working_file(self, path: str) -> str:
+        """Return the path if it is under the working root."""
+        path = os.path.realpath(path)
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Path '{path}' is outside of the working root.")
+        return path
+
+    def statistics(self) -> typing.Dict:
+        with self.lock:
+            return {
+                "waiting": self.waiting,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "latency": _summary(self.latencies),
+                "wait": _summary(self.waits),
+            }
+
+
+def _run(
+        command: typing.List[str],
+        is_disconnected: typing.Callable[[], bool]) \
+        -> typing.Tuple[typing.Optional[int], str]:
+    """Execute the command, return exit code and standard error. Kill
+    the command and return None when the client disconnects."""
+    if is_disconnected():
+        return None, ""
+    # Use a file, as we do not read the pipe while waiting.
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=stderr)
+        while True:
+            try:
+                return_code = process.wait(DISCONNECT_CHECK_SECONDS)
+                break
+            except subprocess.TimeoutExpired:
+                if not is_disconnected():
+                    continue
+                logger.info(f"Client disconnected, killing '{command[0]}'.")
+                process.kill()
+                process.wait()
+                return None, ""
+        stderr.seek(0)
+        return return_code, stderr.read().decode("utf-8", errors="replace")
+
+
+def _summary(values: typing.Iterable[float]) -> typing.Dict[str, float]:
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            response = self.server.service.handle(
+                json.loads(line), self._is_disconnected)
+        except Exception as error:
+            logger.exception("Request failed.")
+            response = {"status": "error", "message": str(error)}
+        try:
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        except OSError:
+            logger.info("Client disconnected before the response.")
+
+    def _is_disconnected(self) -> bool:
+        """The client sends only the request, so readable connection
+        means the client closed it."""
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: _SearchService):
+        super().__init__(path, _Handler)
+        self.service = service
+
+
+# endregion
+
+# region Client
+
+def execute_phmmer(
+        query_file: str, database_file: str, output_file: str) -> bool:
+    """Return True when the search was executed by the service."""
+    return _send({
+        "command": "phmmer",
+        "query_file": os.path.abspath(query_file),
+        "database_file": database_file,
+        "output_file": os.path.abspath(output_file),
+    })
+
+
+def execute_psiblast(
+        query_file: str, database: str, output_format: str, evalue: str,
+        output_file: str) -> bool:
+    """Return True when the search was executed by the service."""
+    return _send({
+        "command": "psiblast",
+        "query_file": os.path.abspath(query_file),
+        "database": database,
+        "output_format": output_format,
+        "evalue": evalue,
+        "output_file": os.path.abspath(output_file),
+    })
+
+
+def statistics() -> typing.Optional[typing.Dict]:
+    try:
+        response = _request({"command": "statistics"})
+    except RuntimeError:
+        logger.warning("Search service did not respond.", exc_info=True)
+        return None
+    if response is None:
+        return None
+    return response.get("statistics", None)
+
+
+def _send(request: typing.Dict) -> bool:
+    """Return False when the search was not executed, raise when it is not
+    known whether the search was executed."""
+    start = time.monotonic()
+    response = _request(request)
+    if response is None:
+        return False
+    if response.get("status", None) != "ok":
+        logger.warning(
+            f"Search service failed: {response.get('message', None)}")
+        return False
+    logger.debug(
+        f"Search service '{request['command']}' done in "
+        f"{time.monotonic() - start:.1f} s.")
+    return True
+
+
+def _request(request: typing.Dict) -> typing.Optional[typing.Dict]:
+    """Return None when the service is not available."""
+    if SOCKET_PATH is None or not os.path.exists(SOCKET_PATH):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CLIENT_TIMEOUT_SECONDS)
+        try:
+            client.connect(SOCKET_PATH)
+            client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        except OSError:
+            logger.warning("Search service is not available.", exc_info=True)
+            return None
+        # Closing the connection stops the search in the service.
+        try:
+            with client.makefile("rb") as stream:
+                line = stream.readline()
+        except OSError as error:
+            raise RuntimeError(
+                f"No response from search service for "
+                f"'{request['command']}'.") from error
+    if not line:
+        raise RuntimeError(
+            f"Search service closed connection for '{request['command']}'.")
+    return json.loads(line)
+
+# endregion
+
+
+if __name__ == "__main__":
+    main(_read_arguments())
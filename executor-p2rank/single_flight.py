@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# Make sure only one worker computes given result at a time, others wait
+# for the result. The coordination is done using lock files in a shared
+# directory, the owner of a lock periodically touches the file. A lock
+# file that has not been touched for given time is considered stale
+# and removed, so a crashed worker does not block others.
+#
+import contextlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import typing
+
+logger = logging.getLogger("prankweb.single_flight")
+logger.setLevel(logging.DEBUG)
+
+# Lock not touched for this time is considered stale.
+STALE_LOCK_SECONDS = int(os.environ.get("SINGLE_FLIGHT_STALE_SECONDS", 600))
+
+# How often the owner touches the lock file.
+HEARTBEAT_SECONDS = max(1, STALE_LOCK_SECONDS // 10)
+
+# How often waiting workers check for the result.
+POLL_SECONDS = 5
+
+_statistics_lock = threading.Lock()
+
+_statistics = {
+    # Results computed by this process.
+    "computed": 0,
+    # Results computed by another worker while we were waiting.
+    "avoided": 0,
+    # Stale locks removed by this process.
+    "stale": 0,
+    # Seconds spent waiting for other workers.
+    "waitSeconds": 0.0,
+}
+
+
+def run_once(
+        lock_directory: typing.Optional[str], key: str,
+        load_result: typing.Callable[[], bool],
+        compute: typing.Callable[[], None]):
+    """Use load_result if possible, otherwise call compute.
+
+    Function load_result must return True when the result is available.
+    """
+    if lock_directory is None:
+        compute()
+        _increase("computed")
+        return
+    os.makedirs(lock_directory, exist_ok=True)
+    lock_file = os.path.join(lock_directory, key + ".lock")
+    wait_start = None
+    while True:
+        if load_result():
+            if wait_start is not None:
+                _increase("avoided")
+                _increase("waitSeconds", time.monotonic() - wait_start)
+                logger.info(
+                    f"Result for '{key}' computed by other worker, "
+                    f"statistics: {statistics()}")
+            return
+        if _try_acquire(lock_file):
+            try:
+                # The other worker may have finished just before we
+                # acquired the lock.
+                if load_result():
+                    return
+                with _heartbeat(lock_file):
+                    compute()
+                _increase("computed")
+                return
+            finally:
+                _release(lock_file)
+        if wait_start is None:
+            logger.info(f"Waiting for other worker to compute '{key}' ...")
+            wait_start = time.monotonic()
+        if _remove_if_stale(lock_file):
+            continue
+        time.sleep(POLL_SECONDS)
+
+
+@contextlib.contextmanager
+def exclusive(lock_file: str):
+    """Yield True when the lock was acquired, False when it is held by
+    another worker. The acquired lock is touched while in the context."""
+    acquired = _try_acquire(lock_file) or \
+        (_remove_if_stale(lock_file) and _try_acquire(lock_file))
+    if not acquired:
+        yield False
+        return
+    try:
+        with _heartbeat(lock_file):
+            yield True
+    finally:
+        _release(lock_file)
+
+
+def _try_acquire(lock_file: str) -> bool:
+    try:
+        descriptor = os.open(
+            lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(descriptor, "w") as stream:
+        json.dump({
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "created": time.time(),
+        }, stream)
+    return True
+
+
+def _release(lock_file: str):
+    try:
+        os.remove(lock_file)
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def _heartbeat(lock_file: str):
+    """Periodically touch the lock file while in the context."""
+    stop = threading.Event()
+
+    def touch():
+        while not stop.wait(HEARTBEAT_SECONDS):
+            try:
+                os.utime(lock_file)
+            except FileNotFoundError:
+                logger.warning(f"Lock file '{lock_file}' was removed.")
+                return
+
+    thread = threading.Thread(target=touch, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def break_lock(lock_file: str, max_age: float) -> bool:
+    """Remove the lock if it was not touched for given time, e.g. when its
+    owner is known to be dead. Return False when the lock is held."""
+    return _remove_if_stale(lock_file, max_age) and \
+        not os.path.exists(lock_file)
+
+
+def _remove_if_stale(
+        lock_file: str, stale_seconds: float = STALE_LOCK_SECONDS) -> bool:
+    try:
+        stat = os.stat(lock_file)
+    except FileNotFoundError:
+        # Lock was released, try again.
+        return True
+    age = time.time() - stat.st_mtime
+    if age < stale_seconds:
+        return False
+    # Another worker may have removed the stale lock and created a new
+    # one in the meantime. So we atomically move the lock away and check
+    # that we moved the stale one.
+    removed_file = \
+        f"{lock_file}.{socket.gethostname()}-{os.getpid()}" \
+        f"-{threading.get_ident()}.stale"
+    try:
+        os.rename(lock_file, removed_file)
+    except FileNotFoundError:
+        return True
+    removed_stat = os.stat(removed_file)
+    # Inode numbers can be reused, so we also check the age.
+    if removed_stat.st_ino != stat.st_ino or \
+            time.time() - removed_stat.st_mtime < stale_seconds:
+        # We moved a new lock, put it back unless there is another one.
+        try:
+            os.link(removed_file, lock_file)
+        except FileExistsError:
+            logger.warning(f"Lock '{lock_file}' was replaced.")
+        _release(removed_file)
+        return True
+    logger.warning(
+        f"Removing stale lock '{lock_file}' not touched for {age:.0f} s.")
+    _release(removed_file)
+    _increase("stale")
+    return True
+
+
+def _increase(name: str, value=1):
+    with _statistics_lock:
+        _statistics[name] += value
+
+
+def statistics() -> typing.Dict[str, typing.Union[int, float]]:
+    with _statistics_lock:
+        return dict(_statistics)
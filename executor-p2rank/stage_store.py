@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#
+# Content-addressed store of pipeline stage outputs shared by all tasks.
+#
+# An output, file or directory, is stored under a hash of the stage name
+# and its parameters. Input files are part of the parameters using hash
+# of their content, so e.g. 'reduce-to-chains' of the same structure is
+# computed only once for all databases. Stored files are hardlinked into
+# the working directories when possible and must not be modified.
+# Least recently used entries are removed once the store is larger than
+# STAGE_STORE_MAX_BYTES.
+#
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import typing
+
+import single_flight
+
+logger = logging.getLogger("prankweb.stage_store")
+logger.setLevel(logging.DEBUG)
+
+STAGE_STORE = os.environ.get("STAGE_STORE", None)
+
+# Zero means no limit.
+MAX_BYTES = int(os.environ.get("STAGE_STORE_MAX_BYTES", 0))
+
+
+def _read_version() -> str:
+    """Change STAGE_STORE_VERSION to invalidate all stored outputs, e.g.
+    with new P2Rank version. Content of STAGE_STORE_VERSION_FILES, e.g.
+    the java-tools build hash, is part of the version as well."""
+    result = [os.environ.get("STAGE_STORE_VERSION", "")]
+    files = os.environ.get("STAGE_STORE_VERSION_FILES", "")
+    for path in filter(None, files.split(os.pathsep)):
+        with open(path, encoding="utf-8") as stream:
+            result.append(stream.read().strip())
+    return "|".join(result)
+
+
+VERSION = _read_version()
+
+# How often we check the size of the store.
+EVICTION_INTERVAL_SECONDS = 10 * 60
+
+_OUTPUT = "output"
+
+_statistics_lock = threading.Lock()
+
+_statistics = {
+    "hit": 0,
+    "miss": 0,
+    "evicted": 0,
+}
+
+
+def file_digest(path: str) -> str:
+    """Return hash of the file content."""
+    stat = os.stat(path)
+    return _file_digest(os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _file_digest(path: str, modification_time: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def memoize(
+        stage: str, parameters: typing.Dict[str, any], output: str,
+        compute: typing.Callable[[], None],
+        store_directory: typing.Optional[str] = STAGE_STORE):
+    """Create the output file or directory using the store or compute."""
+    if store_directory is None:
+        compute()
+        return
+    key = _key(stage, parameters)
+    entry = os.path.join(store_directory, key[:2], key)
+
+    def load_result() -> bool:
+        stored = os.path.join(entry, _OUTPUT)
+        if not os.path.exists(stored) or not _restore(stored, output):
+            return False
+        _touch(entry)
+        _increase("hit")
+        logger.info(f"Using stored output of '{stage}'.")
+        return True
+
+    def compute_and_store():
+        compute()
+        _store(output, entry)
+        _increase("miss")
+        _evict_if_needed(store_directory)
+
+    single_flight.run_once(
+        os.path.join(store_directory, "locks"), key,
+        load_result, compute_and_store)
+
+
+def _key(stage: str, parameters: typing.Dict[str, any]) -> str:
+    content = json.dumps(
+        {"stage": stage, "version": VERSION, "parameters": parameters},
+        sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _restore(stored: str, output: str) -> bool:
+    """Return False when the entry was evicted during the restore,
+    partially restored output is removed."""
+    try:
+        _restore_files(stored, output)
+        return True
+    except (FileNotFoundError, shutil.Error):
+        logger.info(f"Stored output '{stored}' was evicted.")
+    if os.path.isdir(output):
+        shutil.rmtree(output, ignore_errors=True)
+    elif os.path.exists(output):
+        os.remove(output)
+    return False
+
+
+def _restore_files(stored: str, output: str):
+    if os.path.isdir(stored):
+        shutil.copytree(
+            stored, output, copy_function=_link_or_copy, dirs_exist_ok=True)
+    else:
+        if os.path.exists(output):
+            os.remove(output)
+        _link_or_copy(stored, output)
+
+
+def _link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _touch(entry: str):
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+
+
+def _store(output: str, entry: str):
+    if not os.path.exists(output) or \
+            (os.path.isdir(output) and not os.listdir(output)):
+        # Nothing to store, the stage will be computed next time.
+        return
+    temporary = f"{entry}.{os.getpid()}-{threading.get_ident()}.tmp"
+    os.makedirs(temporary)
+    try:
+        stored = os.path.join(temporary, _OUTPUT)
+        if os.path.isdir(output):
+            shutil.copytree(output, stored, copy_function=_link_or_copy)
+        else:
+            _link_or_copy(output, stored)
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            # Stored by another worker.
+            pass
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def _evict_if_needed(store_directory: str):
+    if MAX_BYTES <= 0:
+        return
+    marker = os.path.join(store_directory, "eviction")
+    try:
+        if time.time() - os.stat(marker).st_mtime < EVICTION_INTERVAL_SECONDS:
+            return
+    except FileNotFoundError:
+        pass
+    with open(marker, "w"):
+        pass
+    evict(store_directory, MAX_BYTES)
+
+
+def evict(store_directory: str, max_bytes: int):
+    """Remove least recently used entries until the store fits the size."""
+    entries = []
+    total_size = 0
+    for prefix in os.scandir(store_directory):
+        if not prefix.is_dir() or len(prefix.name) != 2:
+            continue
+        for entry in os.scandir(prefix.path):
+            if entry.name.endswith(".tmp"):
+                continue
+            size = _size(entry.path)
+            entries.append((entry.stat().st_mtime, size, entry.path))
+            total_size += size
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_bytes:
+            break
+        # Tasks restoring from the entry use its path, so after the rename
+        # they fail instead of restoring only a part of the entry.
+        removed = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            os.rename(path, removed)
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(removed, ignore_errors=True)
+        total_size -= size
+        _increase("evicted")
+    logger.info(f"Stage store size after eviction is {total_size} bytes.")
+
+
+def _size(path: str) -> int:
+    result = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                result += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return result
+
+
+def _increase(name: str, value=1):
+    with _statistics_lock:
+        _statistics[name] += value
+
+
+def statistics() -> typing.Dict[str, int]:
+    with _statistics_lock:
+        return dict(_statistics)
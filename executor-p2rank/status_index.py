@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#
+# Index of prediction status stored in SQLite database.
+#
+# The index mirrors 'info.json' files of the predictions, so status queries
+# do not need to walk the prediction directories. The 'info.json' files
+# remain the source of truth, the index can be recreated using
+# administration/rebuild_status_index.py .
+#
+# The web-server has own copy of the schema and the lookup in
+# web-server/src/status_index.py, keep them in sync.
+#
+import contextlib
+import logging
+import os
+import sqlite3
+import typing
+
+logger = logging.getLogger("prankweb.status_index")
+logger.setLevel(logging.DEBUG)
+
+# Path to the index file, the index is not used when not set.
+STATUS_INDEX = os.environ.get("PRANKWEB_STATUS_INDEX", None)
+
+_TIMEOUT_SECONDS = 30
+
+# Identifiers of predictions linked to a prediction directory,
+# keep in sync with the web-server database_v4.
+ALIASES_FILE = "aliases"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prediction (
+  database TEXT NOT NULL,
+  identifier TEXT NOT NULL,
+  directory TEXT NOT NULL,
+  status TEXT NOT NULL,
+  created TEXT,
+  last_change TEXT,
+  PRIMARY KEY (database, identifier)
+);
+CREATE INDEX IF NOT EXISTS prediction_status
+  ON prediction (database, status);
+CREATE INDEX IF NOT EXISTS prediction_last_change
+  ON prediction (database, last_change);
+"""
+
+_COLUMNS = "database, identifier, directory, status, created, last_change"
+
+
+def is_available(index_file: typing.Optional[str] = STATUS_INDEX) -> bool:
+    return index_file is not None and os.path.exists(index_file)
+
+
+def _create(index_file: str):
+    """Create the schema, the journal mode is stored in the file."""
+    connection = sqlite3.connect(index_file, timeout=_TIMEOUT_SECONDS)
+    try:
+        # WAL allows readers while a writer is active.
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+    finally:
+        connection.close()
+
+
+@contextlib.contextmanager
+def _connect(index_file: typing.Optional[str], create: bool = False):
+    """Connect to existing index, with create=True the index is created
+    when missing."""
+    if index_file is None:
+        raise RuntimeError(
+            "Status index is not configured, set PRANKWEB_STATUS_INDEX.")
+    if not os.path.exists(index_file):
+        if not create:
+            raise RuntimeError(
+                f"Status index '{index_file}' does not exist, "
+                "use administration/rebuild_status_index.py to create it.")
+        _create(index_file)
+    # Open in read-write mode, so a missing file is not created empty.
+    connection = sqlite3.connect(
+        f"file:{index_file}?mode=rw", uri=True, timeout=_TIMEOUT_SECONDS)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def update(
+        directory: str, info: typing.Dict,
+        index_file: typing.Optional[str] = STATUS_INDEX):
+    """Store status from the info.json content. Failure is only logged,
+    as the info.json file is the source of truth."""
+    if index_file is None:
+        return
+    rows = [_to_row(directory, info)]
+    # Uploads sharing the prediction, see the web-server database_v4.
+    parent = os.path.dirname(os.path.normpath(directory))
+    for alias in read_aliases(directory):
+        link = os.path.join(parent, alias)
+        if os.path.islink(link):
+            rows.append(_to_row(link, {**info, "id": alias}))
+    try:
+        with _connect(index_file, create=True) as connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO prediction ({_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows)
+    except (sqlite3.Error, KeyError):
+        logger.exception("Can't update status index.")
+
+
+def read_aliases(directory: str) -> typing.List[str]:
+    """Return identifiers of predictions linked to the given directory."""
+    try:
+        with open(os.path.join(directory, ALIASES_FILE),
+                  encoding="utf-8") as stream:
+            return [line.strip() for line in stream if line.strip()]
+    except OSError:
+        return []
+
+
+def _to_row(directory: str, info: typing.Dict) -> typing.Tuple:
+    return (
+        info["database"],
+        info["id"],
+        os.path.abspath(directory),
+        info["status"],
+        info.get("created", None),
+        info.get("lastChange", None),
+    )
+
+
+def _from_row(row: typing.Tuple) -> typing.Dict:
+    database, identifier, directory, status, created, last_change = row
+    return {
+        "id": identifier,
+        "database": database,
+        "directory": directory,
+        "status": status,
+        "created": created,
+        "lastChange": last_change,
+    }
+
+
+def get(
+        database: str, identifier: str,
+        index_file: typing.Optional[str] = STATUS_INDEX) \
+        -> typing.Optional[typing.Dict]:
+    if not is_available(index_file):
+        return None
+    with _connect(index_file) as connection:
+        row = connection.execute(
+            f"SELECT {_COLUMNS} FROM prediction "
+            "WHERE database = ? AND identifier = ?",
+            (database, identifier)).fetchone()
+    return None if row is None else _from_row(row)
+
+
+def remove(
+        database: str, identifier: str,
+        index_file: typing.Optional[str] = STATUS_INDEX):
+    if not is_available(index_file):
+        return
+    with _connect(index_file) as connection:
+        connection.execute(
+            "DELETE FROM prediction WHERE database = ? AND identifier = ?",
+            (database, identifier))
+
+
+def count_by_status(
+        database: str,
+        index_file: typing.Optional[str] = STATUS_INDEX) \
+        -> typing.Dict[str, int]:
+    with _connect(index_file) as connection:
+        return dict(connection.execute(
+            "SELECT status, COUNT(*) FROM prediction "
+            "WHERE database = ? GROUP BY status",
+            (database,)).fetchall())
+
+
+def iterate(
+        database: typing.Optional[str],
+        statuses: typing.Optional[typing.List[str]] = None,
+        changed_after: typing.Optional[str] = None,
+        changed_before: typing.Optional[str] = None,
+        index_file: typing.Optional[str] = STATUS_INDEX) \
+        -> typing.List[typing.Dict]:
+    """Return predictions ordered by last change, use None for all
+    databases. The time arguments use the info.json format,
+    i.e. '%Y-%m-%dT%H:%M:%S'."""
+    query = f"SELECT {_COLUMNS} FROM prediction WHERE 1 = 1"
+    parameters = []
+    if database is not None:
+        query += " AND database = ?"
+        parameters.append(database)
+    if statuses is not None:
+        query += " AND status IN ({})".format(",".join("?" * len(statuses)))
+        parameters.extend(statuses)
+    if changed_after is not None:
+        query += " AND last_change >= ?"
+        parameters.append(changed_after)
+    if changed_before is not None:
+        query += " AND last_change < ?"
+        parameters.append(changed_before)
+    query += " ORDER BY last_change"
+    with _connect(index_file) as connection:
+        return [
+            _from_row(row)
+            for row in connection.execute(query, parameters).fetchall()
+        ]
+
+
+def replace_all(
+        items: typing.Iterable[typing.Tuple[str, typing.Dict]],
+        index_file: typing.Optional[str] = STATUS_INDEX) -> int:
+    """Replace the content with given (directory, info) pairs in a single
+    transaction, return number of stored items."""
+    # Prepare the rows first to keep the transaction short.
+    rows = [_to_row(directory, info) for directory, info in items]
+    if index_file is not None:
+        _create(index_file)
+    with _connect(index_file) as connection:
+        connection.execute("DELETE FROM prediction")
+        connection.executemany(
+            f"INSERT OR REPLACE INTO prediction ({_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows)
+    return len(rows)
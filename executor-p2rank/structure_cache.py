@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# Cache of downloaded structures shared by all workers.
+#
+# Entries are stored in STRUCTURE_CACHE as {source}/{identifier} with
+# a JSON file holding the validators (ETag, Last-Modified). Entries older
+# than STRUCTURE_CACHE_MAX_AGE are revalidated with a conditional request.
+# Only one worker downloads given entry at a time, see single_flight.
+# Without STRUCTURE_CACHE the files are downloaded directly.
+#
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import typing
+
+import requests
+import requests.adapters
+
+import single_flight
+
+logger = logging.getLogger("prankweb.structure_cache")
+logger.setLevel(logging.DEBUG)
+
+STRUCTURE_CACHE = os.environ.get("STRUCTURE_CACHE", None)
+
+# Entries younger than this are used without revalidation.
+MAX_AGE_SECONDS = int(os.environ.get("STRUCTURE_CACHE_MAX_AGE", 24 * 60 * 60))
+
+TIMEOUT_SECONDS = 60
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=16, max_retries=3)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Keep-alive connections are reused by all downloads of the process.
+_session = _create_session()
+
+
+def download(
+        source: str, identifier: str, url: str, destination: str,
+        cache_directory: typing.Optional[str] = STRUCTURE_CACHE):
+    """Download the file from given url to the destination. The file is
+    cached under the source and identifier."""
+    if cache_directory is None:
+        _download(url, destination)
+        return
+    entry_directory = os.path.join(cache_directory, source)
+    os.makedirs(entry_directory, exist_ok=True)
+    name = _entry_name(identifier)
+    entry_file = os.path.join(entry_directory, name)
+
+    def load_result() -> bool:
+        metadata = _load_metadata(entry_file)
+        return metadata is not None \
+            and metadata.get("url", None) == url \
+            and time.time() - metadata["validated"] < MAX_AGE_SECONDS \
+            and os.path.exists(entry_file)
+
+    def compute():
+        _update_entry(url, entry_file)
+
+    single_flight.run_once(
+        os.path.join(cache_directory, "locks"), f"{source}-{name}",
+        load_result, compute)
+    logger.debug(f"Using cached '{source}/{identifier}'.")
+    shutil.copy(entry_file, destination)
+
+
+def _entry_name(identifier: str) -> str:
+    """Return file name for the identifier."""
+    if re.fullmatch(r"[\w.-]+", identifier):
+        return identifier
+    return hashlib.sha256(identifier.encode("utf-8")).hexdigest()
+
+
+def _load_metadata(entry_file: str) -> typing.Optional[typing.Dict]:
+    try:
+        with open(entry_file + ".json", encoding="utf-8") as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_metadata(entry_file: str, metadata: typing.Dict):
+    path_swp = entry_file + ".json.swp"
+    with open(path_swp, "w", encoding="utf-8") as stream:
+        json.dump(metadata, stream)
+    os.replace(path_swp, entry_file + ".json")
+
+
+def _update_entry(url: str, entry_file: str):
+    """Download the entry or revalidate the existing one."""
+    metadata = _load_metadata(entry_file)
+    headers = {}
+    if metadata is not None and metadata.get("url", None) == url \
+            and os.path.exists(entry_file):
+        if metadata.get("etag", None):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("lastModified", None):
+            headers["If-Modified-Since"] = metadata["lastModified"]
+    logger.debug(f"Downloading '{url}' to cache ...")
+    with _session.get(
+            url, headers=headers, stream=True,
+            timeout=TIMEOUT_SECONDS) as response:
+        if response.status_code == 304 and headers:
+            logger.debug(f"Cached '{url}' is still valid.")
+        else:
+            _check_response(response)
+            _write_response(response, entry_file)
+            metadata = {
+                "url": url,
+                "etag": response.headers.get("ETag", None),
+                "lastModified": response.headers.get("Last-Modified", None),
+            }
+    metadata["validated"] = time.time()
+    _save_metadata(entry_file, metadata)
+
+
+def _download(url: str, destination: str):
+    logger.debug(f"Downloading '{url}' to '{destination}' ...")
+    with _session.get(url, stream=True, timeout=TIMEOUT_SECONDS) as response:
+        _check_response(response)
+        _write_response(response, destination)
+
+
+def _check_response(response: requests.Response):
+    if not 199 < response.status_code < 299:
+        raise Exception(f"Download failed with code: {response.status_code}")
+
+
+def _write_response(response: requests.Response, destination: str):
+    """Stream the content into a temporary file and then replace the
+    destination, so readers never see a partial file."""
+    path_swp = destination + ".swp"
+    try:
+        with open(path_swp, "wb") as stream:
+            for chunk in response.iter_content(_CHUNK_SIZE):
+                stream.write(chunk)
+        os.replace(path_swp, destination)
+    finally:
+        if os.path.exists(path_swp):
+            os.remove(path_swp)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# Tests of the structure cache using a local HTTP server in place of
+# the PDB, run with pytest.
+#
+import http.server
+import os
+import threading
+import time
+
+import pytest
+
+import single_flight
+import structure_cache
+
+_CONTENT = b"data_1ABC\n#\n"
+
+_LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Set by the server fixture.
+    state = None
+
+    def do_GET(self):
+        state = self.state
+        with state["lock"]:
+            state["requests"].append(dict(self.headers))
+        time.sleep(state["delay"])
+        if state["status"] != 200:
+            self.send_error(state["status"])
+            return
+        if self.headers.get("If-Modified-Since", None) == _LAST_MODIFIED:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Last-Modified", _LAST_MODIFIED)
+        # Truncated response announces more content than it sends.
+        length = len(_CONTENT) * (2 if state["truncate"] else 1)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        self.wfile.write(_CONTENT)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    state = {
+        "lock": threading.Lock(),
+        "requests": [],
+        "status": 200,
+        "delay": 0,
+        "truncate": False,
+    }
+    handler = type("Handler", (_Handler,), {"state": state})
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv(
+        "PDB_DOWNLOAD_URL", f"http://127.0.0.1:{httpd.server_port}")
+    monkeypatch.setattr(single_flight, "POLL_SECONDS", 0.05)
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _download(cache: str, destination: str):
+    url = f"{os.environ['PDB_DOWNLOAD_URL']}/1abc.cif"
+    structure_cache.download("pdb", "1ABC.cif", url, destination, cache)
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as stream:
+        return stream.read()
+
+
+def test_download(server, tmp_path):
+    cache = str(tmp_path / "cache")
+    destination = str(tmp_path / "structure.cif")
+    _download(cache, destination)
+    assert _read(destination) == _CONTENT
+    assert len(server["requests"]) == 1
+    entry_file = os.path.join(cache, "pdb", "1ABC.cif")
+    metadata = structure_cache._load_metadata(entry_file)
+    assert metadata["lastModified"] == _LAST_MODIFIED
+    # Fresh entry is used without a request.
+    _download(cache, destination)
+    assert len(server["requests"]) == 1
+
+
+def test_revalidate(server, tmp_path, monkeypatch):
+    cache = str(tmp_path / "cache")
+    entry_file = os.path.join(cache, "pdb", "1ABC.cif")
+    _download(cache, str(tmp_path / "first.cif"))
+    validated = structure_cache._load_metadata(entry_file)["validated"]
+    monkeypatch.setattr(structure_cache, "MAX_AGE_SECONDS", 0)
+    destination = str(tmp_path / "second.cif")
+    _download(cache, destination)
+    assert len(server["requests"]) == 2
+    assert server["requests"][1]["If-Modified-Since"] == _LAST_MODIFIED
+    assert _read(destination) == _CONTENT
+    metadata = structure_cache._load_metadata(entry_file)
+    assert metadata["validated"] > validated
+    assert metadata["lastModified"] == _LAST_MODIFIED
+
+
+def test_failed_download(server, tmp_path):
+    server["status"] = 404
+    cache = str(tmp_path / "cache")
+    destination = str(tmp_path / "structure.cif")
+    with pytest.raises(Exception):
+        _download(cache, destination)
+    assert os.listdir(os.path.join(cache, "pdb")) == []
+    assert not os.path.exists(destination)
+    assert not os.path.exists(destination + ".swp")
+
+
+def test_truncated_download(server, tmp_path):
+    server["truncate"] = True
+    cache = str(tmp_path / "cache")
+    destination = str(tmp_path / "structure.cif")
+    with pytest.raises(Exception):
+        _download(cache, destination)
+    assert os.listdir(os.path.join(cache, "pdb")) == []
+    assert not os.path.exists(destination)
+
+
+def test_concurrent_download(server, tmp_path):
+    server["delay"] = 0.5
+    cache = str(tmp_path / "cache")
+    destinations = [str(tmp_path / f"{index}.cif") for index in range(2)]
+    threads = [
+        threading.Thread(target=_download, args=(cache, destination))
+        for destination in destinations
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(server["requests"]) == 1
+    for destination in destinations:
+        assert _read(destination) == _CONTENT
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Queue again running tasks without a heartbeat, i.e. tasks whose worker
+# was killed and the task was not delivered again by the broker.
+# The tasks are resumed from their checkpoints.
+#
+import argparse
+import logging
+import os
+import time
+import typing
+
+import celery_p2rank
+import run_p2rank_task
+import status_index
+
+logger = logging.getLogger("prankweb.watchdog")
+logger.setLevel(logging.DEBUG)
+
+
+def _read_arguments() -> typing.Dict[str, any]:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--index", default=status_index.STATUS_INDEX,
+        help="Path to the status index used to find running tasks.")
+    parser.add_argument(
+        "--max-attempts", type=int, default=3,
+        help="Number of times a task is queued again before it fails.")
+    parser.add_argument(
+        "--interval", type=int, default=0,
+        help="If set, check the tasks every given number of seconds.")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Only report the tasks.")
+    return vars(parser.parse_args())
+
+
+def main(arguments):
+    _init_logging()
+    if arguments["index"] is None:
+        logger.error("Missing status index.")
+        return
+    waiting = False
+    while True:
+        if status_index.is_available(arguments["index"]):
+            waiting = False
+            check_running_tasks(
+                arguments["index"], arguments["max_attempts"],
+                arguments["dry_run"])
+        elif arguments["interval"] <= 0:
+            logger.error("Missing status index.")
+            return
+        elif not waiting:
+            # The index is created by the first task update.
+            logger.info("Waiting for the status index to be created.")
+            waiting = True
+        if arguments["interval"] <= 0:
+            break
+        time.sleep(arguments["interval"])
+
+
+def _init_logging():
+    formatter = logging.Formatter(
+        "%(asctime)s %(name)s [%(levelname)s] : %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(formatter)
+
+    logger.addHandler(handler)
+
+
+def check_running_tasks(index_file: str, max_attempts: int, dry_run: bool):
+    running = status_index.iterate(
+        None, [run_p2rank_task.Status.RUNNING.value], index_file=index_file)
+    requeued = 0
+    for item in running:
+        directory = item["directory"]
+        # Aliases are requeued with the prediction they link to.
+        if os.path.islink(directory) or not os.path.isdir(directory) or \
+                run_p2rank_task.is_directory_task_alive(directory):
+            continue
+        logger.info(f"Task '{directory}' has no heartbeat.")
+        if dry_run:
+            continue
+        # Otherwise the queued task would wait for the lock to be stale.
+        if not celery_p2rank.break_execution_lock(
+                directory, run_p2rank_task.HEARTBEAT_TIMEOUT_SECONDS):
+            logger.warning(f"Task '{directory}' is still claimed.")
+            continue
+        if run_p2rank_task.requeue_directory_task(directory, max_attempts):
+            queue = run_p2rank_task.load_task_queue(directory) \
+                or celery_p2rank.LANE_QUEUES["bulk"]
+            task_id = None
+            if item["created"] is not None:
+                task_id = celery_p2rank.prediction_task_id(
+                    directory, item["created"])
+            celery_p2rank.prankweb.send_task(
+                "prediction", args=[directory], queue=queue,
+                task_id=task_id)
+            requeued += 1
+        else:
+            logger.warning(
+                f"Task '{directory}' failed after {max_attempts} attempts.")
+    logger.info(
+        f"Checked {len(running)} running tasks, {requeued} queued again.")
+
+
+if __name__ == "__main__":
+    main(_read_arguments())
@@ -13,20 +13,50 @@ enum UserInterface {
 }
 
 /**
- * We check more frequently at the start and slowly increase the
- * check period over time to maximum.
+ * Last change of the task known to us, the server delays the response
+ * until the task changes.
+ */
+let lastChange: string | undefined = undefined;
+
+/**
+ * While the task is running we refresh the log at least this often.
+ */
+const runningWaitSeconds = 5;
+
+/**
+ * Delay between requests, in case the server responds without waiting.
+ */
+const minimalTimeout = 500;
+
+/**
+ * Response with no change that took less than this was not delayed
+ * by the server.
+ */
+const minimalWait = 1000;
+
+/**
+ * When the server does not delay the response, we check more frequently
+ * at the start and slowly increase the check period over time to maximum.
  */
 let queuedTimeout = 500;
 
+const runningTimeout = 3000;
+
+let running = false;
+
 async function checkTaskStatus() {
   const params = getUrlQueryParams();
   if (params.database === null || params.id === null) {
     renderInvalidTask();
     return;
   }
+  const previousChange = lastChange;
+  const start = Date.now();
   let response;
   try {
-    response = await fetchPrediction(params.database, params.id);
+    response = await fetchPrediction(
+      params.database, params.id, lastChange,
+      running ? runningWaitSeconds : undefined);
   } catch (ex) {
     renderInvalidHttpResponse();
     setTimeout(checkTaskStatus, 7000);
@@ -41,11 +71,20 @@ async function checkTaskStatus() {
     renderUnexpectedResponse(response.statusCode);
     return;
   }
+  lastChange = response.content.lastChange;
+  // The server can delay the response only when we know the last change.
+  const longPolling = lastChange !== undefined && (
+    lastChange !== previousChange || Date.now() - start >= minimalWait);
   switch (response.content.status) {
     case TaskStatus.queued:
       renderQueued();
-      queuedTimeout = Math.min(queuedTimeout + 1000, 10000);
-      setTimeout(checkTaskStatus, queuedTimeout);
+      running = false;
+      if (longPolling) {
+        setTimeout(checkTaskStatus, minimalTimeout);
+      } else {
+        queuedTimeout = Math.min(queuedTimeout + 1000, 10000);
+        setTimeout(checkTaskStatus, queuedTimeout);
+      }
       return;
     case TaskStatus.successful:
       renderTaskFinished(response.content);
@@ -55,7 +94,9 @@ async function checkTaskStatus() {
       return;
     default:
       renderRunningTask(params.database, params.id);
-      setTimeout(checkTaskStatus, 3000);
+      running = true;
+      setTimeout(
+        checkTaskStatus, longPolling ? minimalTimeout : runningTimeout);
       return;
   }
 }
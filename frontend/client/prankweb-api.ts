@@ -36,13 +36,21 @@ export interface HttpWrap<T> {
  * A method to fetch the prediction info from the API.
  * @param database The database to fetch the prediction from.
  * @param id The ID of the prediction.
+ * @param since If set, the server waits until the lastChange differs.
+ * @param wait Maximum time in seconds the server waits for a change.
  * @returns A promise that resolves to the prediction info.
  */
 export async function fetchPrediction(
-  database: string, id: string
+  database: string, id: string, since?: string, wait?: number
 ): Promise<HttpWrap<PredictionInfo>> {
   // We need to navigate to the root, and then we can request the data.
-  const url = getApiEndpoint(database, id);
+  let url = getApiEndpoint(database, id);
+  if (since !== undefined) {
+    url += `?since=${encodeURIComponent(since)}`;
+    if (wait !== undefined) {
+      url += `&wait=${wait}`;
+    }
+  }
   const response = await fetch(url);
   let result;
   try {
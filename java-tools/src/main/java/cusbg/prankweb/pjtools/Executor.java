@@ -4,6 +4,7 @@ import cusbg.prankweb.pjtools.cli.CliCommand;
 import cusbg.prankweb.pjtools.cli.CliCommandParser;
 import cusbg.prankweb.pjtools.command.exec.ExecCommand;
 import cusbg.prankweb.pjtools.command.info.InfoCommand;
+import cusbg.prankweb.pjtools.command.server.ServerCommand;
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
@@ -16,7 +17,8 @@ public class Executor {
 
     public static final List<CliCommand> COMMANDS = Arrays.asList(
             new InfoCommand(),
-            new ExecCommand()
+            new ExecCommand(),
+            new ServerCommand()
     );
 
     public CliCommand getCommand(String[] args) {
@@ -0,0 +1,56 @@
+package cusbg.prankweb.pjtools.command.server;
+
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.security.Permission;
+
+/**
+ * Turn System.exit called by hosted programs into an exception,
+ * so the server keeps running.
+ */
+@SuppressWarnings("removal")
+class ExitTrap extends SecurityManager {
+
+    private static final Logger LOG = LoggerFactory.getLogger(ExitTrap.class);
+
+    public static class ExitException extends SecurityException {
+
+        private final int status;
+
+        public ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+
+        public int getStatus() {
+            return status;
+        }
+
+    }
+
+    public static void install() {
+        try {
+            System.setSecurityManager(new ExitTrap());
+        } catch (UnsupportedOperationException ex) {
+            LOG.warn("Can't install exit trap, run with " +
+                    "-Djava.security.manager=allow .");
+        }
+    }
+
+    @Override
+    public void checkExit(int status) {
+        throw new ExitException(status);
+    }
+
+    @Override
+    public void checkPermission(Permission permission) {
+        // Allow everything else.
+    }
+
+    @Override
+    public void checkPermission(Permission permission, Object context) {
+        // Allow everything else.
+    }
+
+}
@@ -0,0 +1,90 @@
+package cusbg.prankweb.pjtools.command.server;
+
+import java.io.IOException;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.util.concurrent.Callable;
+
+/**
+ * Collect System.out and System.err of a command, so it can be sent
+ * to the client. Commands are executed in parallel, so the output is
+ * routed by the thread writing it. Output of threads not executing
+ * a command goes to the original streams.
+ *
+ * Threads started by a command keep writing to the capture the command
+ * was executed with. Thread pools may outlive a command, so commands
+ * using them, i.e. P2Rank, must use the same capture for all executions.
+ */
+class OutputCapture {
+
+    private static final InheritableThreadLocal<OutputCapture> CURRENT =
+            new InheritableThreadLocal<>();
+
+    private static boolean installed = false;
+
+    private volatile OutputStream target = null;
+
+    /**
+     * Replace System.out and System.err, must be called before
+     * commands are executed.
+     */
+    public static synchronized void install() {
+        if (installed) {
+            return;
+        }
+        System.setOut(new PrintStream(new Router(System.out), true));
+        System.setErr(new PrintStream(new Router(System.err), true));
+        installed = true;
+    }
+
+    /**
+     * Execute the action with output of the current thread, and threads
+     * it starts, written to the given stream.
+     */
+    public <T> T execute(OutputStream output, Callable<T> action)
+            throws Exception {
+        target = output;
+        CURRENT.set(this);
+        try {
+            return action.call();
+        } finally {
+            System.out.flush();
+            System.err.flush();
+            CURRENT.remove();
+            target = null;
+        }
+    }
+
+    private static class Router extends OutputStream {
+
+        private final OutputStream original;
+
+        public Router(OutputStream original) {
+            this.original = original;
+        }
+
+        @Override
+        public void write(int value) throws IOException {
+            getTarget().write(value);
+        }
+
+        @Override
+        public void write(byte[] buffer, int offset, int length)
+                throws IOException {
+            getTarget().write(buffer, offset, length);
+        }
+
+        @Override
+        public void flush() throws IOException {
+            original.flush();
+        }
+
+        private OutputStream getTarget() {
+            OutputCapture capture = CURRENT.get();
+            OutputStream result = capture == null ? null : capture.target;
+            return result == null ? original : result;
+        }
+
+    }
+
+}
@@ -0,0 +1,120 @@
+package cusbg.prankweb.pjtools.command.server;
+
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.File;
+import java.io.OutputStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.concurrent.locks.ReentrantLock;
+
+/**
+ * Execute P2Rank in this JVM. P2Rank keeps global state, so only one
+ * command can run at a time and the class loader is replaced after
+ * a failed command. Only the classes stay loaded, P2Rank loads
+ * the model for every prediction.
+ */
+class P2RankRunner {
+
+    private static final Logger LOG =
+            LoggerFactory.getLogger(P2RankRunner.class);
+
+    private static final String MAIN_CLASS = "cz.siret.prank.program.Main";
+
+    /**
+     * Same arguments as used by p2rank.sh .
+     */
+    private static final String[] DEFAULT_ARGS =
+            {"-stdout_timestamp", "yyyy.MM.dd HH:mm"};
+
+    private final File p2rankHome;
+
+    private final ReentrantLock lock = new ReentrantLock();
+
+    /**
+     * P2Rank threads may outlive a command, so all commands share
+     * the capture.
+     */
+    private final OutputCapture capture = new OutputCapture();
+
+    private Method mainMethod = null;
+
+    public P2RankRunner(File p2rankHome) {
+        this.p2rankHome = p2rankHome;
+    }
+
+    /**
+     * Return exit code or null if another command is running, the output
+     * of the command is written to the given stream.
+     */
+    public Integer tryExecute(String[] args, OutputStream output)
+            throws Exception {
+        if (!lock.tryLock()) {
+            return null;
+        }
+        try {
+            int result = capture.execute(output, () -> execute(args));
+            if (result != 0) {
+                mainMethod = null;
+            }
+            return result;
+        } finally {
+            lock.unlock();
+        }
+    }
+
+    private int execute(String[] args) throws Exception {
+        Method main = getMainMethod();
+        String[] allArgs = new String[DEFAULT_ARGS.length + args.length];
+        System.arraycopy(DEFAULT_ARGS, 0, allArgs, 0, DEFAULT_ARGS.length);
+        System.arraycopy(args, 0, allArgs, DEFAULT_ARGS.length, args.length);
+        Thread thread = Thread.currentThread();
+        ClassLoader contextClassLoader = thread.getContextClassLoader();
+        thread.setContextClassLoader(main.getDeclaringClass().getClassLoader());
+        try {
+            main.invoke(null, (Object) allArgs);
+            return 0;
+        } catch (InvocationTargetException ex) {
+            if (ex.getCause() instanceof ExitTrap.ExitException exit) {
+                return exit.getStatus();
+            }
+            LOG.error("P2Rank execution failed.", ex.getCause());
+            return 1;
+        } finally {
+            thread.setContextClassLoader(contextClassLoader);
+        }
+    }
+
+    private Method getMainMethod() throws Exception {
+        if (mainMethod == null) {
+            LOG.info("Loading P2Rank from {}", p2rankHome);
+            ClassLoader loader = new URLClassLoader(
+                    collectClassPath(),
+                    // Isolate P2Rank dependencies from ours.
+                    ClassLoader.getPlatformClassLoader());
+            mainMethod = loader.loadClass(MAIN_CLASS)
+                    .getMethod("main", String[].class);
+        }
+        return mainMethod;
+    }
+
+    private URL[] collectClassPath() throws Exception {
+        List<URL> result = new ArrayList<>();
+        File bin = new File(p2rankHome, "bin");
+        result.add(new File(bin, "p2rank.jar").toURI().toURL());
+        File[] libraries = new File(bin, "lib").listFiles(
+                (directory, name) -> name.endsWith(".jar"));
+        if (libraries != null) {
+            for (File library : libraries) {
+                result.add(library.toURI().toURL());
+            }
+        }
+        return result.toArray(new URL[0]);
+    }
+
+}
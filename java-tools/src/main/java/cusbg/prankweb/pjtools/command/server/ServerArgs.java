@@ -0,0 +1,7 @@
+package cusbg.prankweb.pjtools.command.server;
+
+import java.io.File;
+import java.nio.file.Path;
+
+public record ServerArgs(Path socket, File p2rankHome) {
+}
@@ -0,0 +1,189 @@
+package cusbg.prankweb.pjtools.command.server;
+
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import com.fasterxml.jackson.databind.node.ObjectNode;
+import cusbg.prankweb.pjtools.Executor;
+import cusbg.prankweb.pjtools.cli.CliCommand;
+import cusbg.prankweb.pjtools.cli.CliCommandParser;
+import org.apache.commons.cli.Options;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.net.StandardProtocolFamily;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.Charset;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.time.Duration;
+import java.time.Instant;
+
+/**
+ * Long-running server executing java-tools and P2Rank commands, so
+ * the JVM start-up, class loading and JIT warm-up are paid only once.
+ * Nothing else is kept between commands, P2Rank loads the model for
+ * every prediction.
+ *
+ * Each connection carries a single request and response, both are JSON
+ * on a single line. Request: {"tool": "java-tools" | "p2rank",
+ * "arguments": [...]}. Response: {"status": "ok", "exitCode": 0,
+ * "output": "..."}, {"status": "busy"} or {"status": "error",
+ * "message": "..."}. The output contains standard output and error
+ * of the command. Clients should execute the command on their own unless
+ * the status is "ok".
+ *
+ * The server runs until the executing thread is interrupted.
+ */
+public class ServerCommand implements CliCommand {
+
+    private static final Logger LOG =
+            LoggerFactory.getLogger(ServerCommand.class);
+
+    private final CliCommandParser cliParser;
+
+    private final ObjectMapper objectMapper = new ObjectMapper();
+
+    private P2RankRunner p2rankRunner = null;
+
+    public ServerCommand() {
+        var options = new Options();
+        options.addOption("s", "socket", true, "Path to the Unix socket.");
+        options.addOption("p", "p2rank", true, "P2Rank home directory.");
+        cliParser = new CliCommandParser(
+                "server",
+                "Execute java-tools and P2Rank commands received using" +
+                        " a Unix socket.",
+                options
+        );
+    }
+
+    @Override
+    public CliCommandParser getCliCommandParser() {
+        return cliParser;
+    }
+
+    @Override
+    @SuppressWarnings("removal")
+    public void execute(String[] argsAsString) throws Exception {
+        var args = loadArgs(argsAsString);
+        if (args.p2rankHome() != null) {
+            p2rankRunner = new P2RankRunner(args.p2rankHome());
+        }
+        SecurityManager securityManager = System.getSecurityManager();
+        ExitTrap.install();
+        OutputCapture.install();
+        Files.deleteIfExists(args.socket());
+        // Interrupt closes the channel, so accept throws and we stop.
+        try (var server = ServerSocketChannel.open(
+                StandardProtocolFamily.UNIX)) {
+            server.bind(UnixDomainSocketAddress.of(args.socket()));
+            LOG.info("Listening on {}", args.socket());
+            while (true) {
+                SocketChannel channel = server.accept();
+                Thread thread = new Thread(() -> handle(channel));
+                thread.setDaemon(true);
+                thread.start();
+            }
+        } finally {
+            Files.deleteIfExists(args.socket());
+            if (System.getSecurityManager() instanceof ExitTrap) {
+                System.setSecurityManager(securityManager);
+            }
+        }
+    }
+
+    private ServerArgs loadArgs(String[] argsAsString) throws Exception {
+        var cmdLine = cliParser.parse(argsAsString);
+        if (cmdLine == null || !cmdLine.hasOption("socket")) {
+            throw new Exception("Can't parse command line.");
+        }
+        File p2rankHome = null;
+        if (cmdLine.hasOption("p2rank")) {
+            p2rankHome = new File(cmdLine.getOptionValue("p2rank"));
+        }
+        return new ServerArgs(
+                Path.of(cmdLine.getOptionValue("socket")), p2rankHome);
+    }
+
+    private void handle(SocketChannel channel) {
+        try (channel) {
+            var reader = new BufferedReader(new InputStreamReader(
+                    Channels.newInputStream(channel),
+                    StandardCharsets.UTF_8));
+            String line = reader.readLine();
+            ObjectNode response;
+            try {
+                response = handleRequest(objectMapper.readTree(line));
+            } catch (Exception ex) {
+                LOG.error("Request failed.", ex);
+                response = objectMapper.createObjectNode();
+                response.put("status", "error");
+                response.put("message", String.valueOf(ex.getMessage()));
+            }
+            OutputStream output = Channels.newOutputStream(channel);
+            output.write(objectMapper.writeValueAsBytes(response));
+            output.write('\n');
+            output.flush();
+        } catch (Exception ex) {
+            LOG.error("Can't handle connection.", ex);
+        }
+    }
+
+    private ObjectNode handleRequest(JsonNode request) throws Exception {
+        String tool = request.get("tool").asText();
+        JsonNode argumentsNode = request.get("arguments");
+        String[] arguments = new String[argumentsNode.size()];
+        for (int index = 0; index < arguments.length; ++index) {
+            arguments[index] = argumentsNode.get(index).asText();
+        }
+        ObjectNode response = objectMapper.createObjectNode();
+        Instant start = Instant.now();
+        var output = new ByteArrayOutputStream();
+        Integer exitCode = switch (tool) {
+            case "java-tools" -> new OutputCapture().execute(
+                    output, () -> executeJavaTools(arguments));
+            case "p2rank" -> executeP2Rank(arguments, output);
+            default -> throw new Exception("Unknown tool: " + tool);
+        };
+        if (exitCode == null) {
+            response.put("status", "busy");
+            return response;
+        }
+        LOG.info("Executed {} {} in {} ms with exit code {}",
+                tool, String.join(" ", arguments),
+                Duration.between(start, Instant.now()).toMillis(),
+                exitCode);
+        response.put("status", "ok");
+        response.put("exitCode", exitCode);
+        response.put("output", output.toString(Charset.defaultCharset()));
+        return response;
+    }
+
+    private Integer executeJavaTools(String[] arguments) {
+        Executor executor = new Executor();
+        CliCommand command = executor.getCommand(arguments);
+        if (command == null || command instanceof ServerCommand) {
+            return 1;
+        }
+        return executor.executeCommand(command, arguments);
+    }
+
+    private Integer executeP2Rank(
+            String[] arguments, ByteArrayOutputStream output)
+            throws Exception {
+        if (p2rankRunner == null) {
+            throw new Exception("P2Rank is not configured.");
+        }
+        return p2rankRunner.tryExecute(arguments, output);
+    }
+
+}
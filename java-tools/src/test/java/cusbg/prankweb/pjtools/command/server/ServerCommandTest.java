@@ -0,0 +1,121 @@
+package cusbg.prankweb.pjtools.command.server;
+
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import org.junit.jupiter.api.AfterEach;
+import org.junit.jupiter.api.Assertions;
+import org.junit.jupiter.api.BeforeEach;
+import org.junit.jupiter.api.Test;
+import org.junit.jupiter.api.Timeout;
+import org.junit.jupiter.api.io.TempDir;
+
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.net.StandardProtocolFamily;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.List;
+import java.util.Map;
+
+public class ServerCommandTest {
+
+    private final ObjectMapper objectMapper = new ObjectMapper();
+
+    @TempDir
+    Path directory;
+
+    private Path socket;
+
+    private Thread server;
+
+    @BeforeEach
+    public void startServer() throws Exception {
+        socket = directory.resolve("server.sock");
+        server = new Thread(() -> {
+            try {
+                new ServerCommand().execute(
+                        new String[]{"--socket", socket.toString()});
+            } catch (Exception ex) {
+                // Interrupted by stopServer.
+            }
+        });
+        server.start();
+        while (!Files.exists(socket)) {
+            Thread.sleep(10);
+        }
+    }
+
+    @AfterEach
+    public void stopServer() throws Exception {
+        server.interrupt();
+        server.join();
+        Assertions.assertFalse(Files.exists(socket));
+    }
+
+    @Test
+    @Timeout(value = 30)
+    public void executeJavaTools() throws Exception {
+        JsonNode response = send("java-tools", "structure-info", "-h");
+        Assertions.assertEquals("ok", response.get("status").asText());
+        // Missing arguments, the help is printed instead.
+        Assertions.assertEquals(1, response.get("exitCode").asInt());
+        Assertions.assertTrue(
+                response.get("output").asText().contains("structure-info"));
+    }
+
+    @Test
+    @Timeout(value = 30)
+    public void executeJavaToolsInParallel() throws Exception {
+        JsonNode[] responses = new JsonNode[4];
+        Thread[] clients = new Thread[responses.length];
+        for (int index = 0; index < clients.length; ++index) {
+            int clientIndex = index;
+            clients[index] = new Thread(() -> {
+                try {
+                    responses[clientIndex] =
+                            send("java-tools", "structure-info", "-h");
+                } catch (Exception ex) {
+                    throw new RuntimeException(ex);
+                }
+            });
+            clients[index].start();
+        }
+        for (Thread client : clients) {
+            client.join();
+        }
+        for (JsonNode response : responses) {
+            // Each client gets only the output of its own command.
+            String output = response.get("output").asText();
+            Assertions.assertEquals(
+                    output.indexOf("usage:"), output.lastIndexOf("usage:"));
+        }
+    }
+
+    @Test
+    @Timeout(value = 30)
+    public void rejectP2RankWhenNotConfigured() throws Exception {
+        JsonNode response = send("p2rank", "predict");
+        Assertions.assertEquals("error", response.get("status").asText());
+    }
+
+    private JsonNode send(String tool, String... arguments) throws Exception {
+        try (var channel = SocketChannel.open(StandardProtocolFamily.UNIX)) {
+            channel.connect(UnixDomainSocketAddress.of(socket));
+            OutputStream output = Channels.newOutputStream(channel);
+            output.write(objectMapper.writeValueAsBytes(
+                    Map.of("tool", tool, "arguments", List.of(arguments))));
+            output.write('\n');
+            output.flush();
+            var reader = new BufferedReader(new InputStreamReader(
+                    Channels.newInputStream(channel),
+                    StandardCharsets.UTF_8));
+            return objectMapper.readTree(reader.readLine());
+        }
+    }
+
+}
@@ -18,6 +18,10 @@ class PrankWebResponse:
 logger = logging.getLogger("prankweb")
 logger.setLevel(logging.DEBUG)
 
+# Number of codes in a single status request, the server may handle
+# less in one request.
+_BATCH_SIZE = 100
+
 _server_url = None
 
 _server_directory = None
@@ -42,22 +46,75 @@ def _retrieve_info_url(pdb_code: str) -> PrankWebResponse:
     time.sleep(2)
     url = f"{_server_url}/api/v2/prediction/{database()}/{pdb_code}"
     try:
-        response = requests.get(url)
+        # Use the bulk lane, so we do not delay predictions of users.
+        response = requests.get(url, headers={"X-Prankweb-Lane": "bulk"})
     except:
         return PrankWebResponse(-1, {})
     return PrankWebResponse(response.status_code, response.json())
 
 
 def _retrieve_info_directory(pdb_code: str) -> PrankWebResponse:
+    response = _retrieve_info_directory_file(pdb_code)
+    if response is None:
+        return _retrieve_info_url(pdb_code)
+    return response
+
+
+def _retrieve_info_directory_file(
+        pdb_code: str) -> typing.Optional[PrankWebResponse]:
     path = os.path.join(
         str(_server_directory), pdb_code[1:3].upper(), pdb_code.upper(),
         "info.json")
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as stream:
-            content = json.load(stream)
-        return PrankWebResponse(200, content)
-    else:
-        return _retrieve_info_url(pdb_code)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as stream:
+        content = json.load(stream)
+    return PrankWebResponse(200, content)
+
+
+def retrieve_infos(
+        pdb_codes: typing.List[str]) -> typing.Dict[str, PrankWebResponse]:
+    """Same as retrieve_info for multiple codes."""
+    result = {}
+    if _server_directory is not None:
+        for pdb_code in pdb_codes:
+            response = _retrieve_info_directory_file(pdb_code)
+            if response is not None:
+                result[pdb_code] = response
+    missing = [code for code in pdb_codes if code not in result]
+    for start in range(0, len(missing), _BATCH_SIZE):
+        result.update(_retrieve_infos_url(missing[start:start + _BATCH_SIZE]))
+    return result
+
+
+def _retrieve_infos_url(
+        pdb_codes: typing.List[str]) -> typing.Dict[str, PrankWebResponse]:
+    # Sleep to give prankweb some time.
+    time.sleep(2)
+    url = f"{_server_url}/api/v2/prediction/{database()}/status"
+    result = {}
+    while pdb_codes:
+        try:
+            # Use the bulk lane, so we do not delay predictions of users.
+            response = requests.post(
+                url, json={"identifiers": pdb_codes, "create": True},
+                headers={"X-Prankweb-Lane": "bulk"})
+        except:
+            break
+        if not 199 < response.status_code < 299:
+            for pdb_code in pdb_codes:
+                result[pdb_code] = PrankWebResponse(response.status_code, {})
+            return result
+        content = response.json()
+        for pdb_code, info in content["predictions"].items():
+            if info is None:
+                result[pdb_code] = PrankWebResponse(404, {})
+            else:
+                result[pdb_code] = PrankWebResponse(200, info)
+        pdb_codes = content["unprocessed"]
+    for pdb_code in pdb_codes:
+        result[pdb_code] = PrankWebResponse(-1, {})
+    return result
 
 
 def database() -> str:
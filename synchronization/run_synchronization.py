@@ -157,27 +157,45 @@ def synchronize_prankweb_with_database(database, queue_limit):
     """Synchronize database with prankweb."""
     # Check those that we track as queued.
     logger.info("Checking queued ...")
-    queued_count = 0
-    for code, record in database["data"].items():
-        if record["status"] == EntryStatus.PRANKWEB_QUEUED.value:
-            request_computation_from_prankweb_for_code(code, record)
-        if record["status"] == EntryStatus.PRANKWEB_QUEUED.value:
-            queued_count += 1
+    queued = [
+        code for code, record in database["data"].items()
+        if record["status"] == EntryStatus.PRANKWEB_QUEUED.value
+    ]
+    request_computation_from_prankweb(database, queued)
+    queued_count = sum(
+        1 for code in queued
+        if database["data"][code]["status"]
+        == EntryStatus.PRANKWEB_QUEUED.value)
     logger.info(f"Queued count: {queued_count}")
     # Start new predictions, so the queued size is under given limit.
-    for code, record in database["data"].items():
-        if queued_count >= queue_limit:
-            break
-        if record["status"] == EntryStatus.NEW.value:
-            request_computation_from_prankweb_for_code(code, record)
-        if record["status"] == EntryStatus.PRANKWEB_QUEUED.value:
-            queued_count += 1
-            logger.info(f"Started new prediction: '{code}'")
-
-
-def request_computation_from_prankweb_for_code(code: str, record):
-    """Request computation or check for status."""
-    response = prankweb_service.retrieve_info(code)
+    new = [
+        code for code, record in database["data"].items()
+        if record["status"] == EntryStatus.NEW.value
+    ]
+    while queued_count < queue_limit and new:
+        batch, new = new[:queue_limit - queued_count], \
+            new[queue_limit - queued_count:]
+        request_computation_from_prankweb(database, batch)
+        for code in batch:
+            if database["data"][code]["status"] == \
+                    EntryStatus.PRANKWEB_QUEUED.value:
+                queued_count += 1
+                logger.info(f"Started new prediction: '{code}'")
+
+
+def request_computation_from_prankweb(database, codes: typing.List[str]):
+    """Request computation or check for status of all given codes."""
+    if not codes:
+        return
+    responses = prankweb_service.retrieve_infos(codes)
+    for code in codes:
+        update_record_from_prankweb(
+            code, database["data"][code], responses[code])
+
+
+def update_record_from_prankweb(
+        code: str, record, response: prankweb_service.PrankWebResponse):
+    """Update record using the prediction status."""
     if response.status == -1:
         # This indicates error with the connection.
         logging.warning(f"Can't connect to server to check '{code}'.")
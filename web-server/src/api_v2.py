@@ -1,3 +1,5 @@
+import os
+import typing
 import flask
 from flask import Blueprint, request
 from .database_v1 import register_database_v1
@@ -7,9 +9,13 @@ from .database_v4 import register_database_v4
 
 from .docking_task import DockingTask
 from .tunnels_task import TunnelsTask
+from .status_watcher import wait_for_change, MAX_WAIT_SECONDS
 
 api_v2 = Blueprint("api_v2", __name__)
 
+# Maximum number of identifiers handled by a single status request.
+STATUS_BATCH_SIZE = int(os.environ.get("PRANKWEB_STATUS_BATCH_SIZE", 500))
+
 databases = {
     database.name(): database
     for database in [
@@ -20,6 +26,21 @@ databases = {
     ]
 }
 
+
+def _wait_for_change(info_file: typing.Optional[str]):
+    """Long-polling: when 'since' is set to the lastChange known to the
+    client, the response is delayed until the status changes, at most
+    for 'wait' seconds."""
+    since = request.args.get("since", None)
+    if since is None or info_file is None:
+        return
+    try:
+        wait = float(request.args.get("wait", MAX_WAIT_SECONDS))
+    except ValueError:
+        return
+    if wait > 0:
+        wait_for_change(info_file, since, wait)
+
 # prediction routes
 
 @api_v2.route(
@@ -30,6 +51,7 @@ def route_get_info(database_name: str, prediction_name: str):
     database = databases.get(database_name, None)
     if database is None:
         return "", 404
+    _wait_for_change(database.get_info_file(prediction_name.upper()))
     return database.get_info(prediction_name.upper())
 
 
@@ -44,6 +66,34 @@ def route_post(database_name: str):
     return database.create(flask.request.files)
 
 
+@api_v2.route(
+    "/prediction/<database_name>/status",
+    methods=["POST"]
+)
+def route_post_status(database_name: str):
+    """Get status of multiple predictions.
+    Request body should be a JSON object with the following fields:
+    - identifiers: list[str] (identifiers of the predictions)
+    - create: bool (optional, create missing predictions)
+    Only first identifiers are handled, the rest is returned
+    as 'unprocessed' and should be sent in another request."""
+    database = databases.get(database_name, None)
+    if database is None:
+        return "", 404
+    data = request.get_json(force=True, silent=True) or {}
+    identifiers = data.get("identifiers", None)
+    if not isinstance(identifiers, list) or \
+            not all(isinstance(item, str) for item in identifiers):
+        return "Field identifiers must be a list of strings.", 400
+    identifiers = [identifier.upper() for identifier in identifiers]
+    statuses = database.get_status(
+        identifiers[:STATUS_BATCH_SIZE], bool(data.get("create", False)))
+    return flask.jsonify({
+        "predictions": statuses,
+        "unprocessed": identifiers[STATUS_BATCH_SIZE:],
+    })
+
+
 @api_v2.route(
     "/prediction/<database_name>/<prediction_name>/log",
     methods=["GET"]
@@ -99,6 +149,7 @@ def route_get_docking_file_with_param(database_name: str, prediction_name: str,
 def route_get_all_docking_tasks(database_name: str, prediction_name: str):
     """Get all docking tasks from the server."""
     dt = DockingTask(database_name=database_name)
+    _wait_for_change(dt.get_info_file(prediction_name.upper()))
     return dt.get_all_tasks(prediction_name.upper())
 
 # tunnels routes
@@ -119,6 +170,7 @@ def route_get_tunnels_file_with_param(database_name: str, prediction_name: str,
 def route_get_all_tunnels_tasks(database_name: str, prediction_name: str):
     """Get all tunnels tasks from the server."""
     tt = TunnelsTask(database_name=database_name)
+    _wait_for_change(tt.get_info_file(prediction_name.upper()))
     return tt.get_all_tasks(prediction_name.upper())
 
 @api_v2.route(
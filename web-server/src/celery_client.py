@@ -1,4 +1,6 @@
 import os
+import uuid
+import contextlib
 import celery
 
 prankweb = celery.Celery("prankweb")
@@ -7,6 +9,7 @@ prankweb.conf.update({
     "task_routes": {
         # the key is the name of the task, the value is the name of the queue
         'prediction': 'p2rank',
+        'prefetch': 'p2rank-prefetch',
         'docking': 'docking',
         'tunnels': 'tunnels',
     }
@@ -28,8 +31,43 @@ elif "CELERY_BROKER_PATH" in os.environ:
     })
 
 
-def submit_directory_for_execution(directory):
-    prankweb.send_task("prediction", args=[directory])
+# Predictions requested by users.
+LANE_INTERACTIVE = "interactive"
+
+# Predictions requested in bulk, e.g. by the synchronization.
+LANE_BULK = "bulk"
+
+_LANE_QUEUES = {
+    LANE_INTERACTIVE: "p2rank-interactive",
+    LANE_BULK: "p2rank",
+}
+
+# If true, structures are downloaded by a prefetch worker while
+# the prediction waits in the queue.
+PREFETCH = os.environ.get("PRANKWEB_PREFETCH", "0") == "1"
+
+
+def prediction_task_id(directory, created):
+    """Return task identifier derived from the prediction, so repeated
+    submissions of the same prediction share the identifier."""
+    name = os.path.normpath(directory) + "#" + created
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+@contextlib.contextmanager
+def broker_connection():
+    """Yield a producer, so multiple tasks can be submitted using a single
+    connection to the broker."""
+    with prankweb.producer_or_acquire() as producer:
+        yield producer
+
+def submit_directory_for_execution(
+        directory, lane=LANE_INTERACTIVE, task_id=None, producer=None):
+    prankweb.send_task(
+        "prediction", args=[directory], queue=_LANE_QUEUES[lane],
+        task_id=task_id, producer=producer)
+
+def submit_directory_for_prefetch(directory, producer=None):
+    prankweb.send_task("prefetch", args=[directory], producer=producer)
 
 def submit_directory_for_docking(directory, taskId):
     prankweb.send_task("docking", args=[directory, taskId])
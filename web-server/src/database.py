@@ -4,7 +4,22 @@ import re
 import flask
 import werkzeug.utils
 import abc
+import json
+import concurrent.futures
 from .commons import extensions
+from .file_cache import FileCache
+
+# Small files, like info.json or prediction.json, are kept in memory.
+_file_cache = FileCache(
+    int(os.environ.get("PRANKWEB_FILE_CACHE_SIZE", 1024)),
+    int(os.environ.get("PRANKWEB_FILE_CACHE_BYTES", 64 * 1024 * 1024)),
+    int(os.environ.get("PRANKWEB_FILE_CACHE_FILE_BYTES", 1024 * 1024)))
+
+# Files of finished predictions do not change, so clients can keep them.
+PUBLIC_MAX_AGE = int(os.environ.get("PRANKWEB_PUBLIC_MAX_AGE", 365 * 24 * 3600))
+
+# Number of threads reading status files for a single request.
+STATUS_READ_THREADS = int(os.environ.get("PRANKWEB_STATUS_READ_THREADS", 8))
 
 
 class Database(metaclass=abc.ABCMeta):
@@ -31,6 +46,13 @@ class Database(metaclass=abc.ABCMeta):
     def create(self, files):
         ...
 
+    @abc.abstractmethod
+    def get_status(
+            self, identifiers: typing.List[str], create: bool
+    ) -> typing.Dict[str, typing.Optional[dict]]:
+        """Return info of given tasks, None for missing tasks."""
+        ...
+
 
 class NestedReadOnlyDatabase(Database, metaclass=abc.ABCMeta):
     """Base implementation of read-only database."""
@@ -50,6 +72,32 @@ class NestedReadOnlyDatabase(Database, metaclass=abc.ABCMeta):
             return "", 404
         return self._response_file(directory, "log", "text/plain")
 
+    def get_info_file(self, identifier: str) -> typing.Optional[str]:
+        """Return path to the status file of given task."""
+        directory = self._get_directory(identifier)
+        if directory is None:
+            return None
+        return os.path.join(directory, "info.json")
+
+    def get_status(
+            self, identifiers: typing.List[str], create: bool
+    ) -> typing.Dict[str, typing.Optional[dict]]:
+        info_files = [
+            self.get_info_file(identifier) for identifier in identifiers]
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=STATUS_READ_THREADS) as executor:
+            infos = list(executor.map(_read_info, info_files))
+        result = dict(zip(identifiers, infos))
+        if create:
+            self._create_missing(result)
+        return result
+
+    def _create_missing(
+            self, statuses: typing.Dict[str, typing.Optional[dict]]):
+        """Create missing tasks and update their statuses, the read-only
+        database does not create anything."""
+        ...
+
     def get_file(self, identifier: str, file_name: str):
         directory = self._get_directory(identifier)
         if directory is None or not os.path.isdir(directory):
@@ -57,17 +105,32 @@ class NestedReadOnlyDatabase(Database, metaclass=abc.ABCMeta):
         public_directory = os.path.join(directory, "public")
         file_name = self._secure_filename(file_name)
         file_path = os.path.join(public_directory, file_name)
+        immutable = self._is_finished(directory)
         if os.path.isfile(file_path):
-            return self._response_file(public_directory, file_name)
+            return self._response_file(
+                public_directory, file_name, immutable=immutable)
         gzip_file_name = file_name + ".gz"
         gzip_path = os.path.join(public_directory, gzip_file_name)
         if os.path.isfile(gzip_path):
             return self._response_gzip_file(
                 public_directory,
                 file_name,
-                gzip_file_name)
+                gzip_file_name,
+                immutable=immutable)
         return "", 404
 
+    @staticmethod
+    def _is_finished(directory: str) -> bool:
+        """Return true for successful prediction, such prediction does not
+        change."""
+        item = _file_cache.get(os.path.join(directory, "info.json"))
+        if item is None:
+            return False
+        try:
+            return json.loads(item.content).get("status") == "successful"
+        except ValueError:
+            return False
+
     @staticmethod
     def _secure_filename(file_name: str) -> str:
         """Sanitize given file name."""
@@ -85,20 +148,43 @@ class NestedReadOnlyDatabase(Database, metaclass=abc.ABCMeta):
 
     def _response_gzip_file(
             self, directory: str, file_name: str, gzip_name: str,
-            mimetype=None):
+            mimetype=None, immutable: bool = False):
         if mimetype is None:
             mimetype = self._mime_type(file_name)
         response = flask.send_from_directory(
             directory, gzip_name, mimetype=mimetype)
         response.headers["Content-Encoding"] = "gzip"
+        _set_cache_control(response, immutable)
         return response
 
-    def _response_file(self, directory: str, file_name: str, mimetype=None):
-        """Respond with given file."""
+    def _response_file(
+            self, directory: str, file_name: str, mimetype=None,
+            immutable: bool = False):
+        """Respond with given file, small files are served from memory.
+        Clients can use ETag to ask only for changed content."""
         if mimetype is None:
             mimetype = self._mime_type(file_name)
-        return flask.send_from_directory(
-            directory, file_name, mimetype=mimetype)
+        item = _file_cache.get(os.path.join(directory, file_name))
+        if item is None:
+            # Large file, the conditional request is handled by Flask.
+            response = flask.send_from_directory(
+                directory, file_name, mimetype=mimetype)
+            _set_cache_control(response, immutable)
+            return response
+        response = flask.Response(item.content, mimetype=mimetype)
+        response.set_etag(item.etag)
+        response.last_modified = item.last_modified
+        _set_cache_control(response, immutable)
+        return response.make_conditional(flask.request)
+
+    @staticmethod
+    def _response_json(content: dict):
+        """Respond with given content, clients can use ETag to ask only
+        for changed content."""
+        response = flask.make_response(flask.jsonify(content))
+        response.add_etag()
+        _set_cache_control(response, False)
+        return response.make_conditional(flask.request)
 
     @staticmethod
     def _mime_type(file_name: str) -> str:
@@ -112,6 +198,29 @@ class NestedReadOnlyDatabase(Database, metaclass=abc.ABCMeta):
         return get_database_directory()
 
 
+def _read_info(path: typing.Optional[str]) -> typing.Optional[dict]:
+    if path is None:
+        return None
+    item = _file_cache.get(path)
+    if item is None:
+        return None
+    try:
+        return json.loads(item.content)
+    except ValueError:
+        # The file is being written.
+        return None
+
+
+def _set_cache_control(response: flask.Response, immutable: bool):
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = PUBLIC_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Clients must revalidate, using the ETag.
+        response.cache_control.no_cache = True
+
+
 def get_database_directory() -> str:
     dc = os.environ.get(
         "PRANKWEB_DATA_PREDICTIONS",
@@ -1,5 +1,8 @@
 import os
+import contextlib
 import datetime
+import fcntl
+import hashlib
 import json
 import typing
 import flask
@@ -8,8 +11,35 @@ import time
 import uuid
 import re
 import shutil
+import tempfile
+import zlib
 from .database import Database, NestedReadOnlyDatabase
-from .celery_client import submit_directory_for_execution
+from .celery_client import submit_directory_for_execution, \
+    submit_directory_for_prefetch, prediction_task_id, broker_connection, \
+    PREFETCH, LANE_INTERACTIVE, LANE_BULK
+from .status_index import get_status, update_status
+
+
+# Must be shared by all web-server processes creating predictions.
+SUBMISSION_LOCK_DIRECTORY = os.environ.get(
+    "PRANKWEB_SUBMISSION_LOCK_DIRECTORY",
+    os.path.join(tempfile.gettempdir(), "prankweb-submission"))
+
+_SUBMISSION_LOCK_COUNT = 256
+
+# If true, uploads of the same structure with the same configuration
+# share one prediction.
+UPLOAD_DEDUPLICATION = \
+    os.environ.get("PRANKWEB_UPLOAD_DEDUPLICATION", "0") == "1"
+
+# Uploads sharing the prediction are attached to a prediction with one
+# of these statuses.
+_SHAREABLE_STATUSES = ("queued", "running", "successful")
+
+# File in a prediction directory with identifiers of uploads sharing
+# the prediction, one per line. Used to keep status index of the uploads
+# up to date and to remove them with the prediction.
+_ALIASES_FILE = "aliases"
 
 
 @dataclasses.dataclass
@@ -61,15 +91,23 @@ class DatabaseV4(NestedReadOnlyDatabase):
         if os.path.exists(directory):
             # First, we check whether the task has not already failed. 
             # In such cases, we want to remove the prediction and run it again.
-            with open(os.path.join(directory, "info.json"), "r") as f:
-                info = json.load(f)
-                if _should_rerun_prediction(info):
-                    # Remove the directory and create a new prediction.
-                    shutil.rmtree(directory)
-                else:
-                    return self._response_file(directory, "info.json")
+            info = _load_status(self.name(), identifier, directory)
+            if _should_rerun_prediction(info):
+                # Remove the directory and create a new prediction.
+                _remove_failed_prediction(self.name(), identifier, directory)
+            else:
+                return self._response_file(directory, "info.json")
+        return _create_new_prediction(
+            self._new_prediction(identifier, directory))
+
+    def _create_missing(
+            self, statuses: typing.Dict[str, typing.Optional[dict]]):
+        _create_missing_predictions(self, statuses)
+
+    def _new_prediction(
+            self, identifier: str, directory: str) -> Prediction:
         pdb_code, chains = _parser_identifier(identifier)
-        prediction = Prediction(
+        return Prediction(
             directory=directory,
             identifier=identifier,
             database=self.name(),
@@ -80,7 +118,6 @@ class DatabaseV4(NestedReadOnlyDatabase):
             chains=chains,
             metadata={},
         )
-        return _create_new_prediction(prediction)
 
 
 class DatabaseV4ConservationHmm(NestedReadOnlyDatabase):
@@ -101,15 +138,23 @@ class DatabaseV4ConservationHmm(NestedReadOnlyDatabase):
         if os.path.exists(directory):
             # First, we check whether the task has not already failed. 
             # In such cases, we want to remove the prediction and run it again.
-            with open(os.path.join(directory, "info.json"), "r") as f:
-                info = json.load(f)
-                if _should_rerun_prediction(info):
-                    # Remove the directory and create a new prediction.
-                    shutil.rmtree(directory)
-                else:
-                    return self._response_file(directory, "info.json")
+            info = _load_status(self.name(), identifier, directory)
+            if _should_rerun_prediction(info):
+                # Remove the directory and create a new prediction.
+                _remove_failed_prediction(self.name(), identifier, directory)
+            else:
+                return self._response_file(directory, "info.json")
+        return _create_new_prediction(
+            self._new_prediction(identifier, directory))
+
+    def _create_missing(
+            self, statuses: typing.Dict[str, typing.Optional[dict]]):
+        _create_missing_predictions(self, statuses)
+
+    def _new_prediction(
+            self, identifier: str, directory: str) -> Prediction:
         pdb_code, chains = _parser_identifier(identifier)
-        prediction = Prediction(
+        return Prediction(
             directory=directory,
             identifier=identifier,
             database=self.name(),
@@ -120,7 +165,6 @@ class DatabaseV4ConservationHmm(NestedReadOnlyDatabase):
             conservation="hmm",
             metadata={},
         )
-        return _create_new_prediction(prediction)
 
 
 class DatabaseV4UserUpload(NestedReadOnlyDatabase):
@@ -130,6 +174,10 @@ class DatabaseV4UserUpload(NestedReadOnlyDatabase):
         self.root = os.path.join(
             self._get_database_directory(),
             "v4-user-upload")
+        # Index of uploads, maps hash of an upload to the identifier.
+        self.uploads_root = os.path.join(
+            self._get_database_directory(),
+            "v4-user-upload-index")
 
     def name(self) -> str:
         return "v4-user-upload"
@@ -145,15 +193,71 @@ class DatabaseV4UserUpload(NestedReadOnlyDatabase):
             user_configuration, structure_name)
         if not _is_prediction_valid(prediction):
             return "", 400
-        # Create prediction directories and files.
-        os.makedirs(prediction.directory)
-        info = _prepare_prediction_directory(prediction)
-        input_directory = os.path.join(prediction.directory, "input")
-        structure_path = os.path.join(input_directory, structure_name)
-        files["structure"].save(structure_path)
-        submit_directory_for_execution(prediction.directory)
+        if not UPLOAD_DEDUPLICATION:
+            info = _create_uploaded_prediction(prediction, files["structure"])
+            return flask.make_response(flask.jsonify(info), 201)
+        key = _upload_key(prediction, files["structure"])
+        entry = os.path.join(self.uploads_root, key[:2], key)
+        with _submission_lock(entry):
+            info = self._attach_to_upload(entry, prediction)
+            if info is None:
+                info = _create_uploaded_prediction(
+                    prediction, files["structure"])
+                _save_upload_entry(entry, identifier)
         return flask.make_response(flask.jsonify(info), 201)
 
+    def get_info(self, identifier: str):
+        directory = self._get_directory(identifier)
+        if directory is None or not os.path.isdir(directory):
+            return "", 404
+        if not os.path.islink(directory):
+            return self._response_file(directory, "info.json")
+        # Upload sharing a prediction, info.json has the identifier
+        # of the prediction.
+        info = _read_directory_info(directory)
+        if info is None:
+            return "", 404
+        return self._response_json({**info, "id": identifier})
+
+    def get_status(
+            self, identifiers: typing.List[str], create: bool
+    ) -> typing.Dict[str, typing.Optional[dict]]:
+        result = super().get_status(identifiers, create)
+        # Uploads sharing a prediction report their own identifier.
+        for identifier, info in result.items():
+            if info is not None:
+                info["id"] = identifier
+        return result
+
+    def _attach_to_upload(
+            self, entry: str, prediction: Prediction) -> typing.Optional[dict]:
+        """Make the prediction an alias of the same upload, return None
+        if there is no such upload we can use."""
+        try:
+            with open(entry, encoding="utf-8") as stream:
+                existing = stream.read().strip()
+        except OSError:
+            return None
+        directory = self._get_directory(existing)
+        if directory is None:
+            return None
+        info = _read_directory_info(directory)
+        if info is None or info["status"] not in _SHAREABLE_STATUSES:
+            return None
+        # The link is relative, so it does not depend on the mount point.
+        os.symlink(existing, prediction.directory)
+        with open(os.path.join(directory, _ALIASES_FILE), "a",
+                  encoding="utf-8") as stream:
+            stream.write(prediction.identifier + "\n")
+        # Executors update the index of the aliases listed before
+        # the update, so we read the status after adding the alias.
+        info = {
+            **(_read_info_file(prediction) or info),
+            "id": prediction.identifier,
+        }
+        update_status(prediction.directory, info)
+        return info
+
     def _get_directory(self, identifier: str) -> typing.Optional[str]:
         """Return directory for task with given identifier."""
         if not re.match("[\-_,\w]+", identifier):
@@ -183,14 +287,22 @@ class DatabaseV4AlphaFold(NestedReadOnlyDatabase):
         if os.path.exists(directory):
             # First, we check whether the task has not already failed. 
             # In such cases, we want to remove the prediction and run it again.
-            with open(os.path.join(directory, "info.json"), "r") as f:
-                info = json.load(f)
-                if _should_rerun_prediction(info):
-                    # Remove the directory and create a new prediction.
-                    shutil.rmtree(directory)
-                else:
-                    return self._response_file(directory, "info.json")
-        prediction = Prediction(
+            info = _load_status(self.name(), identifier, directory)
+            if _should_rerun_prediction(info):
+                # Remove the directory and create a new prediction.
+                _remove_failed_prediction(self.name(), identifier, directory)
+            else:
+                return self._response_file(directory, "info.json")
+        return _create_new_prediction(
+            self._new_prediction(identifier, directory))
+
+    def _create_missing(
+            self, statuses: typing.Dict[str, typing.Optional[dict]]):
+        _create_missing_predictions(self, statuses)
+
+    def _new_prediction(
+            self, identifier: str, directory: str) -> Prediction:
+        return Prediction(
             directory=directory,
             identifier=identifier,
             database=self.name(),
@@ -202,7 +314,6 @@ class DatabaseV4AlphaFold(NestedReadOnlyDatabase):
                 "predictedStructure": True
             },
         )
-        return _create_new_prediction(prediction)
 
 
 class DatabaseV4AlphaFoldConservationHmm(NestedReadOnlyDatabase):
@@ -227,14 +338,22 @@ class DatabaseV4AlphaFoldConservationHmm(NestedReadOnlyDatabase):
         if os.path.exists(directory):
             # First, we check whether the task has not already failed. 
             # In such cases, we want to remove the prediction and run it again.
-            with open(os.path.join(directory, "info.json"), "r") as f:
-                info = json.load(f)
-                if _should_rerun_prediction(info):
-                    # Remove the directory and create a new prediction.
-                    shutil.rmtree(directory)
-                else:
-                    return self._response_file(directory, "info.json")
-        prediction = Prediction(
+            info = _load_status(self.name(), identifier, directory)
+            if _should_rerun_prediction(info):
+                # Remove the directory and create a new prediction.
+                _remove_failed_prediction(self.name(), identifier, directory)
+            else:
+                return self._response_file(directory, "info.json")
+        return _create_new_prediction(
+            self._new_prediction(identifier, directory))
+
+    def _create_missing(
+            self, statuses: typing.Dict[str, typing.Optional[dict]]):
+        _create_missing_predictions(self, statuses)
+
+    def _new_prediction(
+            self, identifier: str, directory: str) -> Prediction:
+        return Prediction(
             directory=directory,
             identifier=identifier,
             database=self.name(),
@@ -246,7 +365,52 @@ class DatabaseV4AlphaFoldConservationHmm(NestedReadOnlyDatabase):
                 "predictedStructure": True
             },
         )
-        return _create_new_prediction(prediction)
+
+
+def _create_uploaded_prediction(
+        prediction: Prediction, structure) -> dict:
+    os.makedirs(prediction.directory)
+    info = _prepare_prediction_directory(prediction)
+    input_directory = os.path.join(prediction.directory, "input")
+    structure_path = os.path.join(input_directory, prediction.structure_file)
+    structure.save(structure_path)
+    submit_directory_for_execution(
+        prediction.directory, LANE_INTERACTIVE,
+        prediction_task_id(prediction.directory, info["created"]))
+    return info
+
+
+def _upload_key(prediction: Prediction, structure) -> str:
+    """Return hash of the structure content and the configuration."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: structure.stream.read(1024 * 1024), b""):
+        digest.update(chunk)
+    structure.stream.seek(0)
+    configuration = {
+        "p2rank_configuration": prediction.p2rank_configuration,
+        "conservation": prediction.conservation,
+        "structure_sealed": prediction.structure_sealed,
+        "chains": sorted(prediction.chains),
+        # The file format is given by the extension.
+        "structure_format": _structure_format(prediction.structure_file),
+    }
+    digest.update(json.dumps(configuration, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _structure_format(file_name: str) -> str:
+    name, extension = os.path.splitext(file_name.lower())
+    if extension == ".gz":
+        extension = os.path.splitext(name)[1] + extension
+    return extension
+
+
+def _save_upload_entry(entry: str, identifier: str):
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    entry_swp = entry + ".swp"
+    with open(entry_swp, "w", encoding="utf-8") as stream:
+        stream.write(identifier)
+    os.replace(entry_swp, entry)
 
 
 def _parser_identifier(identifier: str):
@@ -258,16 +422,119 @@ def _parser_identifier(identifier: str):
 
 
 def _create_new_prediction(prediction: Prediction, force=False):
-    try:
-        os.makedirs(prediction.directory, exist_ok=True)
-    except OSError:
-        if not force:
-            return _prediction_can_not_be_created(prediction)
-    info = _prepare_prediction_directory(prediction)
-    submit_directory_for_execution(prediction.directory)
+    info = _initialize_prediction(prediction, force)
+    if info is None:
+        return _prediction_can_not_be_created(prediction)
+    _submit_prediction(prediction, info)
     return flask.make_response(flask.jsonify(info), 201)
 
 
+def _create_missing_predictions(
+        database: NestedReadOnlyDatabase,
+        statuses: typing.Dict[str, typing.Optional[dict]]):
+    """Create missing and failed predictions, all predictions are submitted
+    using one broker connection."""
+    created = []
+    for identifier, info in statuses.items():
+        if info is not None and not _should_rerun_prediction(info):
+            continue
+        directory = database._get_directory(identifier)
+        if directory is None:
+            continue
+        if info is not None:
+            _remove_failed_prediction(database.name(), identifier, directory)
+        prediction = database._new_prediction(identifier, directory)
+        info = _initialize_prediction(prediction)
+        if info is None:
+            # Created by someone else in the meantime.
+            info = _read_info_file(prediction)
+        else:
+            created.append((prediction, info))
+        statuses[identifier] = info
+    if not created:
+        return
+    with broker_connection() as producer:
+        for prediction, info in created:
+            _submit_prediction(prediction, info, producer)
+
+
+def _initialize_prediction(
+        prediction: Prediction, force=False) -> typing.Optional[dict]:
+    """Create and initialize the prediction directory, return None when
+    the directory already exists."""
+    with _submission_lock(prediction.directory):
+        try:
+            os.makedirs(os.path.dirname(prediction.directory), exist_ok=True)
+            # Only the client that creates the directory submits the task.
+            os.mkdir(prediction.directory)
+        except OSError:
+            if not force:
+                return None
+        return _prepare_prediction_directory(prediction)
+
+
+def _submit_prediction(prediction: Prediction, info: dict, producer=None):
+    if PREFETCH and (prediction.structure_code or prediction.uniprot_code):
+        # Download the structure while the prediction waits in the queue.
+        submit_directory_for_prefetch(prediction.directory, producer)
+    submit_directory_for_execution(
+        prediction.directory, _select_lane(prediction),
+        prediction_task_id(prediction.directory, info["created"]),
+        producer)
+
+
+def _read_info_file(prediction: Prediction) -> typing.Optional[dict]:
+    return _read_directory_info(prediction.directory)
+
+
+def _read_directory_info(directory: str) -> typing.Optional[dict]:
+    try:
+        with open(os.path.join(directory, "info.json"),
+                  encoding="utf-8") as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_failed_prediction(
+        database: str, identifier: str, directory: str):
+    """Remove failed prediction, so it can be created again. Other clients
+    may have already removed it and created a new prediction."""
+    with _submission_lock(directory):
+        if not os.path.exists(directory):
+            return
+        info = _load_status(database, identifier, directory)
+        if _should_rerun_prediction(info):
+            shutil.rmtree(directory)
+
+
+@contextlib.contextmanager
+def _submission_lock(directory: str):
+    """Lock for creating and removing the prediction directory, shared by
+    all web-server processes. Directories are mapped to a fixed number
+    of lock files."""
+    os.makedirs(SUBMISSION_LOCK_DIRECTORY, exist_ok=True)
+    index = zlib.crc32(directory.encode("utf-8")) % _SUBMISSION_LOCK_COUNT
+    lock_file = os.path.join(SUBMISSION_LOCK_DIRECTORY, f"{index:03}.lock")
+    with open(lock_file, "a") as stream:
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(stream, fcntl.LOCK_UN)
+
+
+def _select_lane(prediction: Prediction) -> str:
+    """User uploads are always interactive. Other predictions are
+    interactive unless the client asks for the bulk lane, so the header
+    can only lower the priority."""
+    if prediction.database == "v4-user-upload":
+        return LANE_INTERACTIVE
+    if flask.request.headers.get("X-Prankweb-Lane", None) == LANE_BULK:
+        return LANE_BULK
+    return LANE_INTERACTIVE
+
+
 def _prediction_can_not_be_created(prediction: Prediction):
     # Not the best, but it is possible that someone else created
     # the task before us, so we wait some time, so they can finish the
@@ -283,6 +550,15 @@ def _prediction_can_not_be_created(prediction: Prediction):
         return "", 500
 
 
+def _load_status(database: str, identifier: str, directory: str) -> dict:
+    """Return status of existing prediction, use the index if possible."""
+    info = get_status(database, identifier)
+    if info is not None:
+        return info
+    with open(os.path.join(directory, "info.json"), "r") as f:
+        return json.load(f)
+
+
 def _info_file(prediction: Prediction) -> str:
     return os.path.join(prediction.directory, "info.json")
 
@@ -291,6 +567,7 @@ def _prepare_prediction_directory(prediction: Prediction):
     """Initialize content of a directory for given task."""
     info = _create_info_file(prediction)
     _save_json(_info_file(prediction), info)
+    update_status(prediction.directory, info)
     input_directory = os.path.join(prediction.directory, "input")
     os.makedirs(input_directory, exist_ok=True)
     _save_json(
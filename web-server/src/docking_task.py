@@ -149,6 +149,15 @@ class DockingTask:
         
         return "", 404
     
+    def get_info_file(self, prediction_id: str) -> typing.Optional[str]:
+        """
+        Returns path to the info file with all tasks for given prediction.
+        """
+        directory = self._get_directory(prediction_id)
+        if directory is None:
+            return None
+        return _info_file_str(directory)
+
     def _get_directory(self, prediction_id: str) -> typing.Optional[str]:
         """
         Returns a directory for a task with given prediction ID.
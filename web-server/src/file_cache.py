@@ -0,0 +1,77 @@
+#
+# Bounded in-process cache of small files, e.g. info.json or
+# prediction.json. The entries are invalidated when the file modification
+# time or size changes.
+#
+import collections
+import dataclasses
+import hashlib
+import os
+import threading
+import typing
+
+
+@dataclasses.dataclass
+class CachedFile:
+    content: bytes
+    # Strong validator, hash of the content.
+    etag: str
+    # Modification time in seconds.
+    last_modified: float
+    # Used to detect changes of the file.
+    stat_key: typing.Tuple[int, int]
+
+
+class FileCache:
+
+    def __init__(self, max_items: int, max_bytes: int, max_file_size: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self._items: typing.OrderedDict[str, CachedFile] = \
+            collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> typing.Optional[CachedFile]:
+        """Return content of the file or None if the file is missing
+        or is too large to be cached."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            item = self._items.get(path, None)
+            if item is not None and item.stat_key == stat_key:
+                self._items.move_to_end(path)
+                return item
+        if stat.st_size > self.max_file_size or self.max_items < 1:
+            return None
+        try:
+            with open(path, "rb") as stream:
+                content = stream.read()
+        except OSError:
+            return None
+        item = CachedFile(
+            content,
+            hashlib.md5(content).hexdigest(),
+            stat.st_mtime,
+            stat_key)
+        # The file may change while we read it, in such case we do not
+        # store the content as we may use a wrong stat_key.
+        if len(content) == stat.st_size:
+            self._put(path, item)
+        return item
+
+    def _put(self, path: str, item: CachedFile):
+        with self._lock:
+            previous = self._items.pop(path, None)
+            if previous is not None:
+                self._size -= len(previous.content)
+            self._items[path] = item
+            self._size += len(item.content)
+            while len(self._items) > self.max_items or \
+                    self._size > self.max_bytes:
+                _, removed = self._items.popitem(last=False)
+                self._size -= len(removed.content)
@@ -0,0 +1,88 @@
+#
+# Access to the index of prediction status, see
+# executor-p2rank/status_index.py for details. Keep the schema in sync.
+#
+import os
+import sqlite3
+import typing
+
+# Path to the index file, the index is not used when not set.
+STATUS_INDEX = os.environ.get("PRANKWEB_STATUS_INDEX", None)
+
+_TIMEOUT_SECONDS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prediction (
+  database TEXT NOT NULL,
+  identifier TEXT NOT NULL,
+  directory TEXT NOT NULL,
+  status TEXT NOT NULL,
+  created TEXT,
+  last_change TEXT,
+  PRIMARY KEY (database, identifier)
+);
+CREATE INDEX IF NOT EXISTS prediction_status
+  ON prediction (database, status);
+CREATE INDEX IF NOT EXISTS prediction_last_change
+  ON prediction (database, last_change);
+"""
+
+
+def _connect(create: bool = False) -> sqlite3.Connection:
+    """Connect to the index, with create=True the index is created when
+    missing. The schema and journal mode are set only on creation."""
+    if create and not os.path.exists(STATUS_INDEX):
+        connection = sqlite3.connect(STATUS_INDEX, timeout=_TIMEOUT_SECONDS)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+    # Open in read-write mode, so a missing file is not created empty.
+    return sqlite3.connect(
+        f"file:{STATUS_INDEX}?mode=rw", uri=True, timeout=_TIMEOUT_SECONDS)
+
+
+def get_status(database: str, identifier: str) -> typing.Optional[dict]:
+    """Return status and lastChange as in info.json or None when
+    the prediction is not indexed."""
+    if STATUS_INDEX is None or not os.path.exists(STATUS_INDEX):
+        return None
+    try:
+        connection = _connect()
+        try:
+            row = connection.execute(
+                "SELECT status, last_change FROM prediction "
+                "WHERE database = ? AND identifier = ?",
+                (database, identifier)).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    status, last_change = row
+    return {"status": status, "lastChange": last_change}
+
+
+def update_status(directory: str, info: dict):
+    """Store status from the info.json content."""
+    if STATUS_INDEX is None:
+        return
+    try:
+        connection = _connect(create=True)
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO prediction (database, identifier,"
+                    " directory, status, created, last_change)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (info["database"], info["id"],
+                     os.path.abspath(directory), info["status"],
+                     info.get("created", None),
+                     info.get("lastChange", None)))
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        # The info.json file is the source of truth.
+        pass
@@ -0,0 +1,132 @@
+#
+# Long-polling of task status files, i.e. info.json of predictions,
+# docking or tunnels tasks. Waiting clients do not read the files,
+# a single thread per process checks each file waited for once per
+# interval and wakes up clients waiting for the file.
+#
+import json
+import os
+import threading
+import time
+import typing
+
+# How often the watched files are checked.
+INTERVAL_SECONDS = float(os.environ.get("PRANKWEB_WATCH_INTERVAL", 1))
+
+# Upper limit for a single wait, must be lower than the proxy timeout.
+MAX_WAIT_SECONDS = float(os.environ.get("PRANKWEB_LONG_POLL_SECONDS", 30))
+
+_FINAL_STATUSES = ("successful", "failed")
+
+StatKey = typing.Optional[typing.Tuple[int, int]]
+
+
+class StatusWatcher:
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._condition = threading.Condition()
+        # Number of clients waiting for given file.
+        self._waiting: typing.Dict[str, int] = {}
+        # Last observed state of a file and the check it was observed in.
+        self._observed: typing.Dict[str, typing.Tuple[StatKey, int]] = {}
+        self._check = 0
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def wait(self, path: str, stat_key: StatKey, timeout: float) -> bool:
+        """Wait until the file no longer matches the given stat key.
+        Return False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._start()
+            self._waiting[path] = self._waiting.get(path, 0) + 1
+            self._condition.notify_all()
+            first_check = self._check + 1
+            try:
+                while True:
+                    observed, check = self._observed.get(path, (None, 0))
+                    # Ignore state observed before we started waiting.
+                    if check >= first_check and observed != stat_key:
+                        return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting[path] -= 1
+                if self._waiting[path] == 0:
+                    del self._waiting[path]
+                    self._observed.pop(path, None)
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._waiting:
+                    self._condition.wait()
+                paths = list(self._waiting.keys())
+                check = self._check + 1
+            observed = {path: _stat_key(path) for path in paths}
+            with self._condition:
+                self._check = check
+                for path, stat_key in observed.items():
+                    if path in self._waiting:
+                        self._observed[path] = (stat_key, check)
+                self._condition.notify_all()
+            time.sleep(self.interval)
+
+
+_watcher = StatusWatcher(INTERVAL_SECONDS)
+
+
+def wait_for_change(path: str, since: str, timeout: float):
+    """Return once the last change of the status file differs from
+    'since', the task is finished, or on timeout."""
+    timeout = min(timeout, MAX_WAIT_SECONDS)
+    deadline = time.monotonic() + timeout
+    while True:
+        stat_key = _stat_key(path)
+        if stat_key is None:
+            return
+        try:
+            with open(path, encoding="utf-8") as stream:
+                content = json.load(stream)
+        except (OSError, ValueError):
+            # The file is being written, we try again in the next check.
+            content = None
+        if content is not None and \
+                (_last_change(content) != since or _is_finished(content)):
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _watcher.wait(path, stat_key, remaining):
+            return
+
+
+def _stat_key(path: str) -> StatKey:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _last_change(content: dict) -> typing.Optional[str]:
+    """Return the last change of a prediction, or of any docking or
+    tunnels task."""
+    if "tasks" in content:
+        changes = [task.get("lastChange", "") for task in content["tasks"]]
+        return max(changes, default=None)
+    return content.get("lastChange", None)
+
+
+def _is_finished(content: dict) -> bool:
+    if "tasks" in content:
+        return len(content["tasks"]) > 0 and all(
+            task.get("status", None) in _FINAL_STATUSES
+            for task in content["tasks"])
+    return content.get("status", None) in _FINAL_STATUSES